@@ -1,7 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, session, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
 import os
 import shutil
 from datetime import datetime, date, timedelta
@@ -9,9 +10,19 @@ import secrets
 import functools
 import json
 import math # Import nécessaire pour math.ceil
+import time
+import queue
+import threading
+import zipfile
 
 # Importez vos fonctions de traitement d'image depuis le dossier core_logic
-from core_logic.image_processing import generer_tranches_individuelles, generer_pdf_a_partir_tranches
+from core_logic.image_processing import generer_tranches_en_flux, generer_pdf_a_partir_tranches, generer_simulation_tranche, PROFILS_ENCODAGE_PDF, FORMATS_PAGE_PDF, TranchesEncodees
+from core_logic.image_processing import preparer_image_maitre, generer_tranches_depuis_maitre, ImageMaitre, DPI_MAITRE, DPI_DERIVES
+from core_logic.cache_rendu import CacheRendu, CacheTranches
+from core_logic.planificateur import PlanificateurRendus, PRIORITE_ADMIN, PRIORITE_PREMIUM, PRIORITE_STANDARD
+from core_logic.metriques import MesuresRendu, RegistreMetriques
+from core_logic.stockage import StockageArtefacts
+from core_logic.ingestion import ingerer_image_source, inspecter_image_source
 
 app = Flask(__name__)
 
@@ -92,6 +103,73 @@ class TicketMessage(db.Model):
     def __repr__(self):
         return f'<TicketMessage {self.id} - Ticket {self.ticket_id} - {self.sender_type}>'
 
+class RenderJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(50), default='En attente', nullable=False) # En attente, En cours, Terminé, Erreur
+    progress = db.Column(db.Integer, default=0, nullable=False) # Pourcentage rapporté par progress_callback
+    message = db.Column(db.String(255), nullable=True)
+    pdf_filename = db.Column(db.String(255), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error_message': self.error_message,
+            'pdf_url': url_for('get_generated_pdf', filename=self.pdf_filename) if self.pdf_filename else None,
+        }
+
+    def __repr__(self):
+        return f'<RenderJob {self.id} - User {self.user_id} - {self.status}>'
+
+class RenderBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    items = db.relationship('RenderBatchItem', backref='batch', lazy=True, order_by='RenderBatchItem.position')
+
+    def to_dict(self):
+        jobs = [item.job for item in self.items]
+        finished = [job for job in jobs if job.status in ('Terminé', 'Erreur')]
+        succeeded = [job for job in jobs if job.pdf_filename]
+        if len(finished) == len(jobs):
+            status = 'Terminé'
+        elif any(job.status != 'En attente' for job in jobs):
+            status = 'En cours'
+        else:
+            status = 'En attente'
+        return {
+            'id': self.id,
+            'status': status,
+            'progress': round(sum(job.progress for job in jobs) / len(jobs)) if jobs else 100,
+            'items_total': len(jobs),
+            'items_done': len(finished),
+            'items_failed': sum(job.status == 'Erreur' for job in jobs),
+            'items': [{'position': item.position, 'source_filename': item.source_filename, **item.job.to_dict()} for item in self.items],
+            # Archive de tous les PDF, disponible une fois le lot terminé
+            'zip_url': url_for('render_batch_zip', batch_id=self.id) if status == 'Terminé' and succeeded else None,
+        }
+
+    def __repr__(self):
+        return f'<RenderBatch {self.id} - User {self.user_id}>'
+
+class RenderBatchItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('render_batch.id'), nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('render_job.id'), nullable=False, unique=True)
+    position = db.Column(db.Integer, nullable=False)
+    source_filename = db.Column(db.String(255), nullable=False)
+    job = db.relationship('RenderJob')
+
+    def __repr__(self):
+        return f'<RenderBatchItem {self.position} - Batch {self.batch_id} - Job {self.job_id}>'
+
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -102,20 +180,379 @@ UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
 GENERATED_PDF_FOLDER = os.path.join(app.root_path, 'generated_pdfs')
 TEMP_PROCESSING_FOLDER = os.path.join(app.root_path, 'temp_processing')
 SIMULATION_IMG_FOLDER = os.path.join(app.root_path, 'simulation_images')
+RENDER_CACHE_FOLDER = os.path.join(app.root_path, 'render_cache')
+SLICE_CACHE_FOLDER = os.path.join(app.root_path, 'slice_cache')
+MASTER_CACHE_FOLDER = os.path.join(app.root_path, 'master_cache')
+# Résolutions déjà demandées pour chaque image maître (voir remember_master_resolution)
+MASTER_REQUESTS_FOLDER = os.path.join(app.root_path, 'master_requests')
+# Compteurs des rendus, un fichier par processus gunicorn (additionnés par /admin/metrics)
+METRICS_FOLDER = os.environ.get('METRICS_FOLDER', os.path.join(app.root_path, 'metrics'))
 
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_PDF_FOLDER, exist_ok=True)
 os.makedirs(TEMP_PROCESSING_FOLDER, exist_ok=True)
 os.makedirs(SIMULATION_IMG_FOLDER, exist_ok=True)
+os.makedirs(MASTER_REQUESTS_FOLDER, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+# Taille maximale (Mo) d'une image envoyée ; une requête plus grosse est refusée avant d'être reçue
+UPLOAD_MAX_MB = int(os.environ.get('UPLOAD_MAX_MB', '50'))
+# Nombre maximal de pixels (en millions) d'une image envoyée, vérifié sur l'en-tête avant tout décodage
+UPLOAD_MAX_MEGAPIXELS = int(os.environ.get('UPLOAD_MAX_MEGAPIXELS', '150'))
+# Marge pour les champs du formulaire qui accompagnent l'image
+app.config['MAX_CONTENT_LENGTH'] = (UPLOAD_MAX_MB + 1) * 1024 * 1024
+
+# Nombre de processus de calcul des tranches par génération (1 = pas de parallélisme)
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', '1'))
+# Nombre de processus d'encodage des pages du PDF par génération (1 = assemblage séquentiel)
+PDF_ASSEMBLY_PROCESSES = int(os.environ.get('PDF_ASSEMBLY_PROCESSES', '1'))
+# Mémoire maximale (Mo) pour décoder une image source, par génération
+DECODE_MEMORY_BUDGET_MB = int(os.environ.get('DECODE_MEMORY_BUDGET_MB', '512'))
+# Une seule image par page PDF (tranches composées) au lieu d'une image par tranche : PDF plus léger à traiter pour les RIP
+PDF_ROW_ATLAS = os.environ.get('PDF_ROW_ATLAS', 'false').lower() == 'true'
+# Taille maximale (Mo) du cache des PDF déjà générés (mêmes image et paramètres => PDF réutilisé)
+RENDER_CACHE_MAX_MB = int(os.environ.get('RENDER_CACHE_MAX_MB', '2048'))
+# À incrémenter quand le rendu change, pour invalider les PDF déjà en cache
+RENDER_CACHE_VERSION = 3
+
+cache_rendu = CacheRendu(RENDER_CACHE_FOLDER, RENDER_CACHE_MAX_MB * 1024 * 1024)
+
+# Taille maximale (Mo) du cache des tranches déjà découpées et encodées (mêmes image et géométrie => seule la mise en page est refaite)
+SLICE_CACHE_MAX_MB = int(os.environ.get('SLICE_CACHE_MAX_MB', '4096'))
+# Paramètres de rendu qui déterminent les tranches encodées ; les autres (numérotation, date...) ne touchent que la mise en page
+SLICE_PARAMETERS = ('version', 'hauteur_livre_mm', 'nombre_pages_livre', 'dpi_utilise', 'largeur_tranche_etiree_cible_mm',
+                    'budget_memoire_mo', 'profil_encodage')
+
+cache_tranches = CacheTranches(SLICE_CACHE_FOLDER, SLICE_CACHE_MAX_MB * 1024 * 1024)
+
+# Taille maximale (Mo) du cache des images maîtres (image source à la hauteur du livre à DPI_MAITRE) :
+# une autre résolution du même livre en est tirée sans relire ni redimensionner l'image source
+MASTER_CACHE_MAX_MB = int(os.environ.get('MASTER_CACHE_MAX_MB', '2048'))
+# Paramètres de rendu qui déterminent l'image maître (ni la résolution, ni le nombre ou la largeur des tranches)
+MASTER_PARAMETERS = ('version', 'hauteur_livre_mm', 'budget_memoire_mo')
+
+cache_maitres = CacheTranches(MASTER_CACHE_FOLDER, MASTER_CACHE_MAX_MB * 1024 * 1024)
+
+# Nombre de générations exécutées en parallèle en arrière-plan, par processus gunicorn
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '2'))
+# Générations simultanées d'un même utilisateur, par processus gunicorn
+RENDER_MAX_PER_USER = int(os.environ.get('RENDER_MAX_PER_USER', '1'))
+# Générations en attente au-delà desquelles les nouvelles demandes sont refusées (serveur occupé)
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', '20'))
+# Générations en attente ou en cours pour un même utilisateur, tous processus confondus (compté en base)
+RENDER_MAX_ACTIVE_JOBS_PER_USER = int(os.environ.get('RENDER_MAX_ACTIVE_JOBS_PER_USER', '3'))
+# Au-delà, un job jamais terminé (processus arrêté en cours de génération) n'est plus compté comme actif
+RENDER_JOB_STALE_AFTER = timedelta(hours=1)
+# Intervalle minimal (secondes) entre deux enregistrements de la progression d'une génération en base
+RENDER_PROGRESS_INTERVAL = 0.5
+
+# Flux SSE de progression : fréquence de relecture du job et durée maximale d'une connexion.
+# Au-delà, le navigateur se reconnecte tout seul (EventSource) : un worker gunicorn n'est pas bloqué toute la génération.
+# Doit rester bien en dessous du --timeout de gunicorn (voir start.sh : workers gthread, qui restent joignables pendant un flux).
+SSE_POLL_INTERVAL = 0.5
+SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', '10'))
+
+# Téléchargement direct (PDF transmis pendant sa génération) : pages en mémoire au plus entre le rendu et le client,
+# délai maximal d'attente d'un emplacement de génération (au-delà, elle continue en arrière-plan comme une génération
+# normale, pour ne pas bloquer la requête), et d'un client qui ne lit plus avant d'abandonner le rendu
+PDF_STREAM_MAX_CHUNKS = 8
+PDF_STREAM_START_TIMEOUT = int(os.environ.get('PDF_STREAM_START_TIMEOUT', '10'))
+PDF_STREAM_WRITE_TIMEOUT = int(os.environ.get('PDF_STREAM_WRITE_TIMEOUT', '120'))
+
+render_scheduler = PlanificateurRendus(RENDER_WORKERS, RENDER_MAX_PER_USER, RENDER_QUEUE_SIZE)
+
+# Lots (/batches) : images par lot, et file séparée de celle de /generate pour qu'un lot ne retarde pas les générations
+# interactives. Les éléments d'un lot sont générés en parallèle, au plus RENDER_BATCH_WORKERS à la fois (par processus gunicorn).
+RENDER_BATCH_MAX_ITEMS = int(os.environ.get('RENDER_BATCH_MAX_ITEMS', '20'))
+RENDER_BATCH_WORKERS = int(os.environ.get('RENDER_BATCH_WORKERS', '2'))
+RENDER_BATCH_QUEUE_SIZE = int(os.environ.get('RENDER_BATCH_QUEUE_SIZE', '100'))
+# Lots en cours pour un même utilisateur, tous processus confondus (compté en base)
+RENDER_MAX_ACTIVE_BATCHES_PER_USER = int(os.environ.get('RENDER_MAX_ACTIVE_BATCHES_PER_USER', '1'))
+
+batch_scheduler = PlanificateurRendus(RENDER_BATCH_WORKERS, RENDER_BATCH_WORKERS, RENDER_BATCH_QUEUE_SIZE, nom='lot')
+
+# Espace disque des fichiers produits : durée de vie par catégorie, quota global (Mo) au-delà duquel les moins
+# récemment utilisés sont supprimés (sauf les envois et fichiers de travail en cours), et intervalle de nettoyage
+ARTIFACT_STORE_MAX_MB = int(os.environ.get('ARTIFACT_STORE_MAX_MB', '20480'))
+ARTIFACT_SWEEP_INTERVAL = int(os.environ.get('ARTIFACT_SWEEP_INTERVAL', '300'))
+GENERATED_PDF_TTL_HOURS = int(os.environ.get('GENERATED_PDF_TTL_HOURS', '24'))
+
+artifact_store = StockageArtefacts(TEMP_PROCESSING_FOLDER, ARTIFACT_STORE_MAX_MB * 1024 * 1024, ARTIFACT_SWEEP_INTERVAL)
+# Un envoi est supprimé par sa génération ; il n'expire que si celle-ci n'a jamais abouti (processus arrêté)
+artifact_store.ajouter_categorie('uploads', UPLOAD_FOLDER, 6 * 3600, evincable=False)
+artifact_store.ajouter_categorie('temp_processing', TEMP_PROCESSING_FOLDER, 6 * 3600, evincable=False)
+artifact_store.ajouter_categorie('generated_pdfs', GENERATED_PDF_FOLDER, GENERATED_PDF_TTL_HOURS * 3600)
+artifact_store.ajouter_categorie('simulation_images', SIMULATION_IMG_FOLDER, 2 * 3600)
+artifact_store.ajouter_categorie('render_cache', RENDER_CACHE_FOLDER, 7 * 24 * 3600)
+artifact_store.ajouter_categorie('slice_cache', SLICE_CACHE_FOLDER, 7 * 24 * 3600)
+artifact_store.ajouter_categorie('master_cache', MASTER_CACHE_FOLDER, 7 * 24 * 3600)
+artifact_store.ajouter_categorie('master_requests', MASTER_REQUESTS_FOLDER, 7 * 24 * 3600)
+
+# Jeton d'accès à /admin/metrics pour un collecteur Prometheus (en-tête "Authorization: Bearer <jeton>") ;
+# sans jeton configuré, seuls les administrateurs connectés y ont accès.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+render_metrics = RegistreMetriques(METRICS_FOLDER)
+
+@app.before_request
+def start_artifact_sweeper():
+    # Démarré à la première requête de chaque processus : sûr avec gunicorn --preload (les threads ne survivent pas au fork)
+    artifact_store.demarrer()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # --- Fonctions utilitaires ---
+
+def render_priority(user):
+    """Classe de priorité des générations d'un utilisateur : administrateurs, puis abonnés Premium, puis les autres."""
+    if user.is_admin:
+        return PRIORITE_ADMIN
+    if user.is_premium:
+        return PRIORITE_PREMIUM
+    return PRIORITE_STANDARD
+
+def busy_response(message, status_code):
+    """Refus d'une génération pour cause de charge : JSON (503/429 + Retry-After) pour un client d'API, sinon message et retour au tableau de bord."""
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': message})
+        response.status_code = status_code
+        response.headers['Retry-After'] = '60'
+        return response
+    flash(message, 'danger')
+    return redirect(url_for('app_dashboard'))
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """Envoi plus gros que MAX_CONTENT_LENGTH : refusé sur son Content-Length, avant d'être reçu."""
+    message = f"L'image envoyée dépasse la taille maximale de {UPLOAD_MAX_MB} Mo."
+    if request.endpoint == 'create_render_batch':
+        return jsonify({'error': f"Le lot dépasse la taille maximale de {UPLOAD_MAX_MB} Mo par image."}), 413
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': message}), 413
+    flash(message, 'danger')
+    return redirect(url_for('app_dashboard'))
+
+class ZipChunkWriter:
+    """Destination (non positionnable) d'un zipfile.ZipFile : les octets écrits sont gardés jusqu'à leur transmission."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+def zip_stream(sources):
+    """
+    Archive ZIP de fichiers déjà ouverts [(nom dans l'archive, fichier)], transmise au fil de leur lecture :
+    ni fichier temporaire ni archive complète en mémoire. Sans compression, les PDF l'étant déjà.
+    """
+    writer = ZipChunkWriter()
+    try:
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED) as archive:
+            for arcname, source in sources:
+                infos = os.fstat(source.fileno())
+                zip_info = zipfile.ZipInfo(arcname, time.localtime(infos.st_mtime)[:6])
+                zip_info.file_size = infos.st_size # Permet à zipfile de choisir ZIP64 au-delà de 2 Go
+                with archive.open(zip_info, 'w') as destination:
+                    for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                        destination.write(chunk)
+                        yield from writer.drain()
+        yield from writer.drain()
+    finally:
+        for _, source in sources:
+            source.close()
+
+class PdfStream:
+    """
+    PDF transmis au client pendant sa génération : le rendu y écrit page par page (write), la réponse HTTP
+    le lit (chunks). La file est bornée : si le client lit lentement, le rendu attend ; s'il ne lit plus
+    ou s'est déconnecté, l'écriture échoue et le rendu s'arrête. Rien n'est conservé sur disque.
+    """
+
+    def __init__(self, max_chunks, write_timeout):
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._abandoned = threading.Event()
+        self._lock = threading.Lock()
+        self._detached = False
+        self.write_timeout = write_timeout
+        self.claimed = threading.Event() # La génération a démarré et écrira dans ce flux
+        self.started = threading.Event() # Premiers octets disponibles, ou génération terminée sans en produire
+        self.bytes_written = 0
+        self.error = None
+
+    def claim(self):
+        """Appelée par la génération à son démarrage. False si la requête a cessé d'attendre : le PDF va alors dans le cache."""
+        with self._lock:
+            if self._detached:
+                return False
+            self.claimed.set()
+            return True
+
+    def detach(self):
+        """Appelée par la requête qui cesse d'attendre. False si la génération a démarré entre-temps (le flux est utilisé)."""
+        with self._lock:
+            if self.claimed.is_set():
+                return False
+            self._detached = True
+            return True
+
+    def _put(self, chunk, timeout):
+        deadline = time.monotonic() + timeout
+        while not self._abandoned.is_set():
+            try:
+                self._chunks.put(chunk, timeout=1)
+                return True
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    self._abandoned.set()
+        return False
+
+    def write(self, data):
+        if not self._put(bytes(data), self.write_timeout):
+            raise OSError("Le téléchargement a été interrompu par le client.")
+        self.bytes_written += len(data)
+        self.started.set()
+
+    def finish(self, error=None):
+        """Fin de la génération (appelée par le rendu, avec son éventuelle erreur)."""
+        self.error = error
+        self.started.set()
+        self._put(None, self.write_timeout)
+
+    def abandon(self):
+        self._abandoned.set()
+
+    def chunks(self):
+        """Morceaux du PDF pour la réponse HTTP. Une erreur en cours de route coupe la connexion : le navigateur signale un échec."""
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    if self.error:
+                        raise OSError(f"Génération interrompue pendant le téléchargement : {self.error}")
+                    return
+                yield chunk
+        finally:
+            self.abandon()
+
+
+def validate_and_convert_int(value_str, field_name, min_val=None):
+    if not value_str:
+        raise ValueError(f"{field_name} est requis.")
+    if not value_str.isdigit(): # Vérifie si c'est composé uniquement de chiffres
+        raise ValueError(f"{field_name} doit être un nombre entier.")
+    val_int = int(value_str)
+    if min_val is not None and val_int < min_val:
+        raise ValueError(f"{field_name} doit être au moins {min_val}.")
+    return val_int
+
+def parse_book_parameters(form):
+    """Valide les paramètres du livre saisis dans le formulaire (génération ou simulation). Lève ValueError avec un message pour l'utilisateur."""
+    # Récupérer les valeurs brutes (peuvent être vides ou non numériques)
+    derniere_page_numerotee_str = form.get('derniere_page_numerotee', '').strip()
+    feuilles_avant_premiere_page_str = form.get('feuilles_avant_premiere_page', '').strip()
+    feuilles_apres_derniere_page_str = form.get('feuilles_apres_derniere_page', '').strip()
+    hauteur_livre_str = form.get('hauteur_livre', '').strip()
+    largeur_tranche_etiree_cible_str = form.get('largeur_tranche_etiree_cible', '').strip()
+    profil_encodage = form.get('profil_encodage', 'standard').strip()
+    format_page = form.get('format_page', 'A4').strip()
+    dpi_str = form.get('dpi', '300').strip()
+    debut_numero_tranche_str = form.get('debut_numero_tranche', '1').strip()
+    pas_numero_tranche_str = form.get('pas_numero_tranche', '2').strip()
+
+    # DEBUG: Afficher les valeurs brutes reçues du formulaire
+    print(f"DEBUG FORM DATA: derniere_page_numerotee_str='{derniere_page_numerotee_str}'")
+    print(f"DEBUG FORM DATA: feuilles_avant_premiere_page_str='{feuilles_avant_premiere_page_str}'")
+    print(f"DEBUG FORM DATA: feuilles_apres_derniere_page_str='{feuilles_apres_derniere_page_str}'")
+    print(f"DEBUG FORM DATA: hauteur_livre_str='{hauteur_livre_str}'")
+    print(f"DEBUG FORM DATA: largeur_tranche_etiree_cible_str='{largeur_tranche_etiree_cible_str}'")
+
+    derniere_page_numerotee = validate_and_convert_int(derniere_page_numerotee_str, "Numéro de la dernière page numérotée", min_val=1)
+    feuilles_avant_premiere_page = validate_and_convert_int(feuilles_avant_premiere_page_str, "Nombre de feuilles avant", min_val=0)
+    feuilles_apres_derniere_page = validate_and_convert_int(feuilles_apres_derniere_page_str, "Nombre de feuilles après", min_val=0)
+    hauteur_livre = validate_and_convert_int(hauteur_livre_str, "Hauteur des pages du livre", min_val=1)
+    largeur_tranche_etiree_cible = validate_and_convert_int(largeur_tranche_etiree_cible_str, "Largeur des bandes imprimée", min_val=1)
+    debut_numero_tranche = validate_and_convert_int(debut_numero_tranche_str, "Numéro de la première bande", min_val=0)
+    pas_numero_tranche = validate_and_convert_int(pas_numero_tranche_str, "Pas de numérotation des bandes", min_val=1)
+    if profil_encodage not in PROFILS_ENCODAGE_PDF:
+        raise ValueError(f"Profil d'encodage du PDF inconnu : '{profil_encodage}'")
+    if format_page not in FORMATS_PAGE_PDF:
+        raise ValueError(f"Format de page du PDF inconnu : '{format_page}'")
+    if not dpi_str.isdigit() or int(dpi_str) not in DPI_DERIVES:
+        raise ValueError(f"Résolution du PDF non disponible : '{dpi_str}' (choix : {', '.join(map(str, DPI_DERIVES))} DPI)")
+
+    # Calcul du nombre total de pages (chaque feuille = 2 pages)
+    nombre_pages_calcule = derniere_page_numerotee + (feuilles_avant_premiere_page * 2) + (feuilles_apres_derniere_page * 2)
+
+    if nombre_pages_calcule < 2: # Au moins 2 pages pour un motif
+        raise ValueError("Le nombre total de pages doit être d'au moins 2 pour générer un motif.")
+
+    return {
+        'nombre_pages': nombre_pages_calcule,
+        'hauteur_livre': hauteur_livre,
+        'largeur_tranche_etiree_cible': largeur_tranche_etiree_cible,
+        'debut_numero_tranche': debut_numero_tranche,
+        'pas_numero_tranche': pas_numero_tranche,
+        'profil_encodage': profil_encodage,
+        'format_page': format_page,
+        'dpi': int(dpi_str),
+    }
+
+def render_parameters(book, empreinte_source):
+    """Paramètres de rendu d'un livre (validé par parse_book_parameters) et clés des caches (PDF, tranches, image maître)."""
+    # Tout ce qui influence le PDF fait partie de la clé, y compris la date imprimée sur la page de garde
+    parametres_rendu = {
+        'version': RENDER_CACHE_VERSION,
+        'hauteur_livre_mm': book['hauteur_livre'],
+        'nombre_pages_livre': book['nombre_pages'],
+        'dpi_utilise': book['dpi'],
+        'largeur_tranche_etiree_cible_mm': book['largeur_tranche_etiree_cible'],
+        'debut_numero_tranche': book['debut_numero_tranche'],
+        'pas_numero_tranche': book['pas_numero_tranche'],
+        'budget_memoire_mo': DECODE_MEMORY_BUDGET_MB,
+        'mode_atlas': PDF_ROW_ATLAS,
+        'profil_encodage': book['profil_encodage'],
+        'format_page': book['format_page'],
+        'date_creation': date.today().isoformat(),
+    }
+    cle_rendu = CacheRendu.cle(empreinte_source, parametres_rendu)
+    cle_tranches = CacheRendu.cle(empreinte_source, {nom: parametres_rendu[nom] for nom in SLICE_PARAMETERS})
+    cle_maitre = CacheRendu.cle(empreinte_source, {'dpi_maitre': DPI_MAITRE, **{nom: parametres_rendu[nom] for nom in MASTER_PARAMETERS}})
+    return parametres_rendu, cle_rendu, cle_tranches, cle_maitre
+
+def remember_master_resolution(cle_maitre, dpi):
+    """
+    Note la résolution demandée pour une image maître (même image source, même hauteur de livre) et indique si une
+    autre résolution a déjà été demandée : l'image maître est alors préparée (build_master), car ce livre se décline
+    en plusieurs résolutions (épreuve puis impression). Un premier rendu, seul, reste direct (moins coûteux).
+    """
+    chemin = os.path.join(MASTER_REQUESTS_FOLDER, cle_maitre)
+    try:
+        try:
+            with open(chemin, encoding='utf-8') as f:
+                resolutions = {int(ligne) for ligne in f if ligne.strip()}
+        except FileNotFoundError:
+            resolutions = set()
+        if dpi in resolutions:
+            os.utime(chemin) # Marqué comme utilisé : conservé par le nettoyage des artefacts
+        else:
+            with open(chemin, 'a', encoding='utf-8') as f:
+                f.write(f"{dpi}\n")
+    except (OSError, ValueError) as e:
+        print(f"Erreur lors de l'enregistrement des résolutions demandées ({cle_maitre[:12]}): {e}")
+        return False
+    return bool(resolutions - {dpi})
+
 def admin_required(f):
     """Décorateur pour exiger que l'utilisateur soit un administrateur."""
     @login_required
@@ -139,6 +576,23 @@ def app_dashboard():
     # Récupérer les chemins de la session si une génération vient d'avoir lieu
     simulation_image_url = session.pop('last_simulation_image_url', None)
     last_generated_pdf_filename = session.pop('last_generated_pdf_filename', None)
+
+    # Génération lancée en arrière-plan : suivie jusqu'à ce qu'elle soit terminée
+    render_job = None
+    if session.get('last_render_job_id'):
+        expire_stale_render_jobs(current_user.id)
+        render_job = db.session.get(RenderJob, session['last_render_job_id'])
+        if render_job is None or render_job.user_id != current_user.id:
+            session.pop('last_render_job_id', None)
+            render_job = None
+        elif render_job.status == 'Terminé':
+            session.pop('last_render_job_id', None)
+            last_generated_pdf_filename = render_job.pdf_filename
+            render_job = None
+        elif render_job.status == 'Erreur':
+            session.pop('last_render_job_id', None)
+            flash(render_job.error_message or "La génération a échoué.", 'danger')
+            render_job = None
     
     # Calculer les jours restants si premium
     days_remaining = None
@@ -159,7 +613,8 @@ def app_dashboard():
     
     return render_template('index.html', is_premium=current_user.is_premium, days_remaining=days_remaining, 
                            simulation_image_url=simulation_image_url, 
-                           last_generated_pdf_filename=last_generated_pdf_filename)
+                           last_generated_pdf_filename=last_generated_pdf_filename,
+                           render_job=render_job)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -503,6 +958,14 @@ def generate_foreedge_form():
         flash(f'Type de fichier non autorisé. Seules les images {", ".join(ALLOWED_EXTENSIONS).upper()} sont acceptées.', 'danger')
         return redirect(url_for('app_dashboard'))
 
+    # Limite par utilisateur tous processus confondus, vérifiée avant d'accepter le fichier (les lots ont leur propre limite)
+    active_jobs = RenderJob.query.filter(RenderJob.user_id == current_user.id,
+                                         RenderJob.status.in_(['En attente', 'En cours']),
+                                         RenderJob.created_at > datetime.utcnow() - RENDER_JOB_STALE_AFTER,
+                                         ~RenderJob.id.in_(db.session.query(RenderBatchItem.job_id))).count()
+    if active_jobs >= RENDER_MAX_ACTIVE_JOBS_PER_USER:
+        return busy_response(f"Vous avez déjà {active_jobs} génération(s) en cours. Attendez qu'elles se terminent avant d'en lancer une autre.", 429)
+
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
     original_filename_base, original_filename_ext = os.path.splitext(file.filename)
     unique_filename = f"{original_filename_base}_{timestamp}{original_filename_ext}"
@@ -511,51 +974,11 @@ def generate_foreedge_form():
     pdf_output_filename = f"foreedge_pattern_{timestamp}.pdf"
     pdf_final_path = os.path.join(GENERATED_PDF_FOLDER, pdf_output_filename)
 
-    temp_tranches_dir = os.path.join(app.root_path, 'temp_processing', f"session_{timestamp}_{secrets.token_hex(8)}")
-    os.makedirs(temp_tranches_dir, exist_ok=True)
-
+    job_submitted = False
     try:
-        file.save(filepath)
-
         # Récupérer et valider les 3 éléments de saisie pour le calcul des pages
         try:
-            # Récupérer les valeurs brutes (peuvent être vides ou non numériques)
-            derniere_page_numerotee_str = request.form.get('derniere_page_numerotee', '').strip()
-            feuilles_avant_premiere_page_str = request.form.get('feuilles_avant_premiere_page', '').strip()
-            feuilles_apres_derniere_page_str = request.form.get('feuilles_apres_derniere_page', '').strip()
-            hauteur_livre_str = request.form.get('hauteur_livre', '').strip()
-            largeur_tranche_etiree_cible_str = request.form.get('largeur_tranche_etiree_cible', '').strip()
-
-            # DEBUG: Afficher les valeurs brutes reçues du formulaire
-            print(f"DEBUG FORM DATA: derniere_page_numerotee_str='{derniere_page_numerotee_str}'")
-            print(f"DEBUG FORM DATA: feuilles_avant_premiere_page_str='{feuilles_avant_premiere_page_str}'")
-            print(f"DEBUG FORM DATA: feuilles_apres_derniere_page_str='{feuilles_apres_derniere_page_str}'")
-            print(f"DEBUG FORM DATA: hauteur_livre_str='{hauteur_livre_str}'")
-            print(f"DEBUG FORM DATA: largeur_tranche_etiree_cible_str='{largeur_tranche_etiree_cible_str}'")
-            
-            # Validation et conversion
-            def validate_and_convert_int(value_str, field_name, min_val=None):
-                if not value_str:
-                    raise ValueError(f"{field_name} est requis.")
-                if not value_str.isdigit(): # Vérifie si c'est composé uniquement de chiffres
-                    raise ValueError(f"{field_name} doit être un nombre entier.")
-                val_int = int(value_str)
-                if min_val is not None and val_int < min_val:
-                    raise ValueError(f"{field_name} doit être au moins {min_val}.")
-                return val_int
-
-            derniere_page_numerotee = validate_and_convert_int(derniere_page_numerotee_str, "Numéro de la dernière page numérotée", min_val=1)
-            feuilles_avant_premiere_page = validate_and_convert_int(feuilles_avant_premiere_page_str, "Nombre de feuilles avant", min_val=0)
-            feuilles_apres_derniere_page = validate_and_convert_int(feuilles_apres_derniere_page_str, "Nombre de feuilles après", min_val=0)
-            hauteur_livre = validate_and_convert_int(hauteur_livre_str, "Hauteur des pages du livre", min_val=1)
-            largeur_tranche_etiree_cible = validate_and_convert_int(largeur_tranche_etiree_cible_str, "Largeur des bandes imprimée", min_val=1)
-
-            # Calcul du nombre total de pages (chaque feuille = 2 pages)
-            nombre_pages_calcule = derniere_page_numerotee + (feuilles_avant_premiere_page * 2) + (feuilles_apres_derniere_page * 2)
-            
-            if nombre_pages_calcule < 2: # Au moins 2 pages pour un motif
-                raise ValueError("Le nombre total de pages doit être d'au moins 2 pour générer un motif.")
-
+            book = parse_book_parameters(request.form)
         except ValueError as ve:
             flash(f"Erreur de saisie : {ve}. Veuillez vérifier vos paramètres numériques.", 'danger')
             return redirect(url_for('app_dashboard'))
@@ -564,78 +987,610 @@ def generate_foreedge_form():
             print(f"Erreur inattendue lors de la validation des paramètres (app.py): {e}")
             return redirect(url_for('app_dashboard'))
 
-
-        dossier_tranches_genere, erreur_tranches = generer_tranches_individuelles(
-            chemin_image_source=filepath,
-            hauteur_livre_mm=hauteur_livre,
-            nombre_pages_livre=nombre_pages_calcule,
-            dpi_utilise=300, # DPI fixe
-            largeur_tranche_etiree_cible_mm=largeur_tranche_etiree_cible,
-            progress_callback=lambda val, msg: None
-        )
-
-        if erreur_tranches:
-            flash(f"Erreur lors de la génération des tranches : {erreur_tranches}", 'danger')
+        # Un seul passage sur l'envoi : signature, taille et dimensions vérifiées avant d'écrire quoi que ce soit,
+        # puis copie vers UPLOAD_FOLDER avec calcul de l'empreinte (clés des caches) au fil de la copie
+        image_source, erreur = ingerer_image_source(file.stream, filepath, UPLOAD_MAX_MB * 1024 * 1024, UPLOAD_MAX_MEGAPIXELS * 1000000)
+        if erreur:
+            flash(erreur, 'danger')
             return redirect(url_for('app_dashboard'))
 
-        if not dossier_tranches_genere:
-            flash("Échec inattendu lors de la génération des tranches (aucun dossier retourné).", 'danger')
-            return redirect(url_for('app_dashboard'))
+        parametres_rendu, cle_rendu, cle_tranches, cle_maitre = render_parameters(book, image_source['empreinte'])
+        # Même livre déjà demandé à une autre résolution : l'image maître est préparée pour les suivantes
+        build_master = remember_master_resolution(cle_maitre, book['dpi'])
 
+        # Téléchargement direct : le PDF part vers le navigateur au fil de sa génération, sans copie sur le serveur
+        pdf_stream = None
+        if request.form.get('telechargement_direct') == '1':
+            chemin_pdf_cache = cache_rendu.obtenir(cle_rendu)
+            if chemin_pdf_cache is not None:
+                return send_file(chemin_pdf_cache, mimetype='application/pdf', as_attachment=True, download_name=pdf_output_filename)
+            pdf_stream = PdfStream(PDF_STREAM_MAX_CHUNKS, PDF_STREAM_WRITE_TIMEOUT)
 
-        pdf_final_path_actual, erreur_pdf = generer_pdf_a_partir_tranches(
-            dossier_tranches_source=dossier_tranches_genere,
-            hauteur_livre_mm_pdf=hauteur_livre, 
-            largeur_tranche_etiree_cible_mm_pdf=largeur_tranche_etiree_cible,
-            debut_numero_tranche=1,
-            pas_numero_tranche=2,
-            progress_callback=lambda val, msg: None,
-            image_source_original_path=filepath,
-            nombre_pages_livre_original=nombre_pages_calcule,
-            output_pdf_path=pdf_final_path
-        )
-
-        if erreur_pdf:
-            flash(f"Erreur lors de la génération du PDF : {erreur_pdf}", 'danger')
-            return redirect(url_for('app_dashboard'))
-        
-        if not pdf_final_path_actual:
-            flash("Échec inattendu lors de la génération du PDF (aucun chemin retourné).", 'danger')
-            return redirect(url_for('app_dashboard'))
-
-        flash('Votre PDF a été généré avec succès ! Cliquez sur le lien pour télécharger.', 'success')
-        session['last_generated_pdf_filename'] = os.path.basename(pdf_final_path_actual)
-        session['last_simulation_image_url'] = None # Pas de simulation
+        job = RenderJob(user_id=current_user.id, message="En attente d'un emplacement de génération...")
+        db.session.add(job)
+        db.session.commit()
 
+        # Le rendu est exécuté en arrière-plan : la requête rend la main immédiatement
+        job_id = job.id
+        job_submitted, busy_message = render_scheduler.soumettre(
+            current_user.id, render_priority(current_user),
+            lambda: run_render_job(job_id, filepath, parametres_rendu, cle_rendu, cle_tranches, cle_maitre, pdf_final_path, pdf_stream, build_master))
+        if not job_submitted:
+            db.session.delete(job)
+            db.session.commit()
+            return busy_response(busy_message, 503)
+
+        if pdf_stream is not None:
+            # En file d'attente au-delà de PDF_STREAM_START_TIMEOUT : la requête ne reste pas bloquée, la génération
+            # continue en arrière-plan et son PDF sera proposé sur le tableau de bord
+            if not pdf_stream.claimed.wait(PDF_STREAM_START_TIMEOUT) and pdf_stream.detach():
+                flash("Le serveur est occupé : la génération a été mise en file d'attente. Le PDF sera disponible ci-dessous une fois prêt.", 'info')
+                session['last_render_job_id'] = job.id
+                return redirect(url_for('app_dashboard'))
+            # Génération démarrée : elle produit des octets ou se termine (finish) dans tous les cas
+            pdf_stream.started.wait()
+            if pdf_stream.error and not pdf_stream.bytes_written:
+                flash(pdf_stream.error, 'danger')
+                return redirect(url_for('app_dashboard'))
+            # Pas de Content-Length : réponse transmise en "chunked", au rythme de la génération
+            return Response(pdf_stream.chunks(), mimetype='application/pdf',
+                            headers={'Content-Disposition': f'attachment; filename="{pdf_output_filename}"',
+                                     'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+        flash('Génération lancée ! Sa progression s\'affiche ci-dessous.', 'success')
+        session['last_render_job_id'] = job.id
         return redirect(url_for('app_dashboard'))
 
 
     except Exception as e:
+        db.session.rollback()
         flash(f"Une erreur inattendue est survenue : {e}", 'danger')
         print(f"Erreur inattendue dans /generate (bloc principal): {e}")
         return redirect(url_for('app_dashboard'))
     finally:
-        if os.path.exists(filepath): 
+        # Une fois la génération soumise, c'est elle qui supprime le fichier source
+        if not job_submitted and os.path.exists(filepath):
             try:
                 os.remove(filepath)
                 print(f"DEBUG: Fichier source '{filepath}' supprimé.")
             except OSError as e:
                 print(f"Erreur lors du nettoyage du fichier source '{filepath}': {e}")
-        
-        if os.path.exists(temp_tranches_dir): 
+
+
+@app.route('/preview', methods=['POST'])
+@login_required
+def preview_foreedge():
+    """Simulation rapide de la tranche éventée, à résolution d'écran, pour vérifier la géométrie avant de générer le PDF."""
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    def preview_error(message, status_code=400):
+        if wants_json:
+            return jsonify({'error': message}), status_code
+        flash(message, 'danger')
+        return redirect(url_for('app_dashboard'))
+
+    if not current_user.is_premium and not current_user.is_admin:
+        return preview_error("Vous devez avoir un abonnement actif pour utiliser le générateur.", 403)
+
+    file = request.files.get('image_source')
+    if file is None or file.filename == '':
+        return preview_error('Aucun fichier sélectionné. Veuillez choisir un fichier.')
+    if not allowed_file(file.filename):
+        return preview_error(f'Type de fichier non autorisé. Seules les images {", ".join(ALLOWED_EXTENSIONS).upper()} sont acceptées.')
+
+    try:
+        book = parse_book_parameters(request.form)
+    except ValueError as ve:
+        return preview_error(f"Erreur de saisie : {ve}. Veuillez vérifier vos paramètres numériques.")
+
+    _, erreur = inspecter_image_source(file.stream, UPLOAD_MAX_MB * 1024 * 1024, UPLOAD_MAX_MEGAPIXELS * 1000000)
+    if erreur:
+        return preview_error(erreur, 422)
+
+    # L'image est lue directement depuis l'envoi : rien n'est écrit dans UPLOAD_FOLDER
+    simulation_filename = f"simulation_{current_user.id}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jpg"
+    _, erreur = generer_simulation_tranche(file.stream, book['hauteur_livre'], book['nombre_pages'],
+                                           os.path.join(SIMULATION_IMG_FOLDER, simulation_filename),
+                                           budget_memoire_mo=DECODE_MEMORY_BUDGET_MB)
+    if erreur:
+        return preview_error(erreur, 422)
+
+    image_url = url_for('get_simulation_image', filename=simulation_filename)
+    if wants_json:
+        return jsonify({'image_url': image_url, 'nombre_tranches': math.ceil(book['nombre_pages'] / 2)})
+    session['last_simulation_image_url'] = image_url
+    return redirect(url_for('app_dashboard'))
+
+
+@app.route('/simulation-images/<path:filename>')
+@login_required
+def get_simulation_image(filename):
+    from flask import send_from_directory
+    return send_from_directory(SIMULATION_IMG_FOLDER, filename)
+
+
+def render_pdf(filepath, parametres_rendu, chemin_sortie, progress_callback, mesures=None, cle_tranches=None, cle_maitre=None, build_master=False):
+    """
+    Pipeline complet (tranches en flux puis PDF) pour une image source et des paramètres validés.
+    Avec cle_tranches, les tranches encodées sont conservées dans cache_tranches, ou reprises de celui-ci :
+    un changement de mise en page seule (numérotation) passe alors directement à l'assemblage du PDF.
+    Avec cle_maitre, les tranches sont tirées de l'image maître de cache_maitres si elle y est déjà ; elle n'est préparée
+    (décodage à DPI_MAITRE, 4 fois plus de pixels qu'à 300 DPI) qu'avec build_master, quand plusieurs résolutions de la
+    même image sont demandées ensemble (voir slices_from_master). Sinon, rendu direct à la résolution demandée.
+    """
+    # Le mode atlas compose les tranches avec les marges de la page : ses images dépendent de la mise en page
+    if parametres_rendu['mode_atlas']:
+        cle_tranches = None
+
+    dossier_copie_tranches = None
+    if cle_tranches:
+        dossier_tranches = cache_tranches.obtenir(cle_tranches)
+        if dossier_tranches:
+            try:
+                tranches_encodees = TranchesEncodees(dossier_tranches)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Jeu de tranches en cache illisible ({cle_tranches[:12]}), découpage complet : {e}")
+            else:
+                print(f"DEBUG: Tranches reprises du cache ({cle_tranches[:12]}), seule la mise en page est refaite.")
+                return assemble_pdf(tranches_encodees, filepath, parametres_rendu, chemin_sortie, progress_callback, mesures)
+        dossier_copie_tranches = cache_tranches.dossier_temporaire(cle_tranches)
+
+    # Les tranches sont produites en mémoire et consommées directement par le PDF (aucun PNG intermédiaire).
+    flux_tranches, erreur_tranches = None, None
+    if cle_maitre:
+        flux_tranches, erreur_tranches = slices_from_master(filepath, parametres_rendu, progress_callback, mesures, cle_maitre, build_master)
+    if flux_tranches is None and not erreur_tranches:
+        flux_tranches, erreur_tranches = generer_tranches_en_flux(
+            chemin_image_source=filepath,
+            hauteur_livre_mm=parametres_rendu['hauteur_livre_mm'],
+            nombre_pages_livre=parametres_rendu['nombre_pages_livre'],
+            dpi_utilise=parametres_rendu['dpi_utilise'],
+            largeur_tranche_etiree_cible_mm=parametres_rendu['largeur_tranche_etiree_cible_mm'],
+            progress_callback=progress_callback,
+            nombre_processus=RENDER_PROCESSES,
+            budget_memoire_mo=parametres_rendu['budget_memoire_mo'],
+            mesures=mesures
+        )
+
+    if erreur_tranches:
+        return None, f"Erreur lors de la génération des tranches : {erreur_tranches}"
+
+    if not flux_tranches:
+        return None, "Échec inattendu lors de la génération des tranches (aucune tranche retournée)."
+
+    try:
+        chemin_pdf, erreur_pdf = assemble_pdf(flux_tranches, filepath, parametres_rendu, chemin_sortie, progress_callback, mesures,
+                                              dossier_copie_tranches)
+        if not erreur_pdf and dossier_copie_tranches:
+            cache_tranches.publier(cle_tranches, dossier_copie_tranches)
+        return chemin_pdf, erreur_pdf
+    finally:
+        if dossier_copie_tranches and os.path.exists(dossier_copie_tranches):
+            shutil.rmtree(dossier_copie_tranches, ignore_errors=True)
+
+
+def slices_from_master(filepath, parametres_rendu, progress_callback, mesures, cle_maitre, build_master=False):
+    """
+    Tranches en flux tirées de l'image maître (image source à la hauteur du livre à DPI_MAITRE), reprise de cache_maitres
+    ou, avec build_master, préparée puis publiée : plusieurs résolutions d'un même livre ne chargent et ne redimensionnent
+    l'image source qu'une fois. Retourne (None, None) si l'image maître n'est pas en cache et ne doit pas être préparée.
+    """
+    def slices(image_maitre):
+        return generer_tranches_depuis_maitre(image_maitre, parametres_rendu['nombre_pages_livre'], parametres_rendu['dpi_utilise'],
+                                              parametres_rendu['largeur_tranche_etiree_cible_mm'], progress_callback,
+                                              nombre_processus=RENDER_PROCESSES, mesures=mesures)
+
+    dossier_maitre = cache_maitres.obtenir(cle_maitre)
+    if dossier_maitre:
+        try:
+            image_maitre = ImageMaitre(dossier_maitre)
+            flux_tranches, erreur = slices(image_maitre)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Image maître en cache illisible ({cle_maitre[:12]}), préparation complète : {e}")
+        else:
+            print(f"DEBUG: Image maître reprise du cache ({cle_maitre[:12]}), réduite à {parametres_rendu['dpi_utilise']} DPI.")
+            return flux_tranches, erreur
+
+    # Préparer l'image maître coûte plus qu'un rendu direct : seulement si d'autres résolutions vont la réutiliser
+    if not build_master:
+        return None, None
+
+    dossier_temporaire = cache_maitres.dossier_temporaire(cle_maitre)
+    try:
+        image_maitre, erreur = preparer_image_maitre(filepath, parametres_rendu['hauteur_livre_mm'], dossier_temporaire, progress_callback,
+                                                     budget_memoire_mo=parametres_rendu['budget_memoire_mo'], mesures=mesures)
+        if erreur:
+            return None, erreur
+        # L'image à la bonne résolution est tirée avant la publication : le flux ne dépend plus du dossier ensuite
+        flux_tranches, erreur = slices(image_maitre)
+        if not erreur:
+            cache_maitres.publier(cle_maitre, dossier_temporaire)
+        return flux_tranches, erreur
+    finally:
+        if os.path.exists(dossier_temporaire):
+            shutil.rmtree(dossier_temporaire, ignore_errors=True)
+
+
+def assemble_pdf(source_tranches, filepath, parametres_rendu, chemin_sortie, progress_callback, mesures=None, dossier_copie_tranches=None):
+    """Assemblage du PDF à partir de tranches en flux ou déjà encodées (TranchesEncodees)."""
+    chemin_pdf, erreur_pdf = generer_pdf_a_partir_tranches(
+        dossier_tranches_source=source_tranches,
+        hauteur_livre_mm_pdf=parametres_rendu['hauteur_livre_mm'],
+        largeur_tranche_etiree_cible_mm_pdf=parametres_rendu['largeur_tranche_etiree_cible_mm'],
+        debut_numero_tranche=parametres_rendu['debut_numero_tranche'],
+        pas_numero_tranche=parametres_rendu['pas_numero_tranche'],
+        progress_callback=progress_callback,
+        image_source_original_path=filepath,
+        nombre_pages_livre_original=parametres_rendu['nombre_pages_livre'],
+        output_pdf_path=chemin_sortie,
+        mode_atlas=parametres_rendu['mode_atlas'],
+        profil_encodage=parametres_rendu['profil_encodage'],
+        mesures=mesures,
+        dossier_copie_tranches=dossier_copie_tranches,
+        format_page=parametres_rendu['format_page'],
+        nombre_processus_assemblage=PDF_ASSEMBLY_PROCESSES
+    )
+
+    if erreur_pdf:
+        return None, f"Erreur lors de la génération du PDF : {erreur_pdf}"
+
+    if not chemin_pdf:
+        return None, "Échec inattendu lors de la génération du PDF (aucun chemin retourné)."
+    return chemin_pdf, None
+
+
+def expire_stale_render_jobs(user_id):
+    """
+    Passe en erreur les générations d'un utilisateur restées en attente ou en cours au-delà de RENDER_JOB_STALE_AFTER :
+    leur processus a été arrêté (redéploiement, worker redémarré) et plus rien ne les terminera.
+    """
+    stale_jobs = RenderJob.query.filter(RenderJob.user_id == user_id,
+                                        RenderJob.status.in_(['En attente', 'En cours']),
+                                        RenderJob.created_at <= datetime.utcnow() - RENDER_JOB_STALE_AFTER).all()
+    for job in stale_jobs:
+        job.status = 'Erreur'
+        job.error_message = "La génération a été interrompue (redémarrage du serveur). Veuillez la relancer."
+        job.finished_at = datetime.utcnow()
+    if stale_jobs:
+        db.session.commit()
+
+
+def make_job_progress_callback(job):
+    """progress_callback qui enregistre la progression du job en base, au plus une fois par RENDER_PROGRESS_INTERVAL."""
+    last_write = [0.0]
+
+    def progress_callback(value, message):
+        now = time.monotonic()
+        if value < 100 and now - last_write[0] < RENDER_PROGRESS_INTERVAL:
+            return
+        last_write[0] = now
+        job.progress = int(value)
+        job.message = message[:255]
+        db.session.commit()
+
+    return progress_callback
+
+
+def run_render_job(job_id, filepath, parametres_rendu, cle_rendu, cle_tranches, cle_maitre, pdf_final_path, pdf_stream=None, build_master=False):
+    """
+    Exécute une génération dans un thread du pool et tient le RenderJob à jour (statut, progression, résultat).
+    Avec pdf_stream (PdfStream), le PDF y est écrit au fil de l'assemblage au lieu de passer par le cache et pdf_final_path.
+    build_master : voir render_pdf.
+    """
+    with app.app_context():
+        job = db.session.get(RenderJob, job_id)
+        mesures = MesuresRendu()
+        metrics_status = 'erreur'
+        render_start = time.perf_counter()
+        try:
+            if pdf_stream is not None and not pdf_stream.claim():
+                pdf_stream = None # La requête n'attend plus : génération en arrière-plan, PDF dans le cache
+            job.status = 'En cours'
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+
+            progress_callback = make_job_progress_callback(job)
+            if pdf_stream is not None:
+                _, erreur_rendu = render_pdf(filepath, parametres_rendu, pdf_stream, progress_callback, mesures, cle_tranches, cle_maitre, build_master)
+                depuis_cache = False
+            else:
+                chemin_pdf_cache, erreur_rendu, depuis_cache = cache_rendu.obtenir_ou_generer(
+                    cle_rendu, lambda chemin_sortie: render_pdf(filepath, parametres_rendu, chemin_sortie, progress_callback, mesures, cle_tranches, cle_maitre, build_master))
+            if not erreur_rendu:
+                metrics_status = 'cache' if depuis_cache else 'succes'
+
+            if erreur_rendu:
+                job.status = 'Erreur'
+                job.error_message = erreur_rendu
+            elif pdf_stream is not None:
+                job.status = 'Terminé'
+                job.progress = 100
+                job.message = "PDF transmis directement au navigateur."
+            else:
+                if depuis_cache:
+                    print(f"DEBUG: PDF servi depuis le cache ({cle_rendu[:12]}).")
+
+                # Lien physique vers le PDF en cache (copie si le système de fichiers ne le permet pas) :
+                # le fichier téléchargé reste valide même si le cache l'évince ensuite.
+                try:
+                    os.link(chemin_pdf_cache, pdf_final_path)
+                except OSError:
+                    shutil.copyfile(chemin_pdf_cache, pdf_final_path)
+
+                job.status = 'Terminé'
+                job.progress = 100
+                job.message = "PDF généré !"
+                job.pdf_filename = os.path.basename(pdf_final_path)
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'Erreur'
+            job.error_message = f"Une erreur inattendue est survenue : {e}"
+            print(f"Erreur inattendue dans la génération #{job_id}: {e}")
+        finally:
+            if pdf_stream is not None:
+                pdf_stream.finish(job.error_message)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            artifact_store.signaler_ecriture()
             try:
-                shutil.rmtree(temp_tranches_dir)
-                print(f"DEBUG: Dossier temporaire des tranches '{temp_tranches_dir}' supprimé.")
+                render_metrics.enregistrer(metrics_status, time.perf_counter() - render_start, mesures)
             except OSError as e:
-                print(f"Erreur lors du nettoyage du dossier temporaire '{temp_tranches_dir}': {e}")
-        
-        # Les fichiers PDF et simulation ne sont PAS supprimés ici immédiatement,
-        # car ils doivent être accessibles pour le téléchargement.
+                print(f"Erreur lors de l'enregistrement des métriques de la génération #{job_id}: {e}")
+            if os.path.exists(filepath):
+                try:
+                    os.remove(filepath)
+                    print(f"DEBUG: Fichier source '{filepath}' supprimé.")
+                except OSError as e:
+                    print(f"Erreur lors du nettoyage du fichier source '{filepath}': {e}")
+            # Les fichiers PDF ne sont PAS supprimés ici, car ils doivent être accessibles pour le téléchargement.
+
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def render_job_status(job_id):
+    job = RenderJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'error': 'Génération introuvable.'}), 404
+    expire_stale_render_jobs(job.user_id)
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<int:job_id>/events')
+@login_required
+def render_job_events(job_id):
+    job = RenderJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'error': 'Génération introuvable.'}), 404
+    expire_stale_render_jobs(job.user_id)
+
+    def event_stream():
+        # La génération peut tourner dans un autre processus : la base est la source de vérité de la progression
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        last_state = None
+        yield "retry: 1000\n\n"
+        while True:
+            db.session.rollback() # Termine la transaction pour lire les dernières écritures du job
+            state = db.session.get(RenderJob, job_id).to_dict()
+            finished = state['status'] in ('Terminé', 'Erreur')
+            if state != last_state:
+                yield f"event: {'done' if finished else 'progress'}\ndata: {json.dumps(state)}\n\n"
+                last_state = state
+            if finished or time.monotonic() > deadline:
+                return
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/batches', methods=['POST'])
+@login_required
+def create_render_batch():
+    """
+    Lot de générations : plusieurs images (champ multipart 'images') avec les paramètres de /generate, communs
+    (champs du formulaire) ou propres à chaque image (champ 'manifest', JSON) :
+        {"parametres": {"hauteur_livre": 200, ...}, "elements": [{"fichier": "a.jpg", "parametres": {"dpi": 150}}]}
+    Chaque image devient une génération (RenderJob) exécutée par batch_scheduler. Réponse JSON (202) : progression
+    par image sur /batches/<id>, lien de chaque PDF, puis archive ZIP de tous les PDF sur /batches/<id>/zip.
+    """
+    def batch_error(message, status_code=400):
+        response = jsonify({'error': message})
+        response.status_code = status_code
+        if status_code in (429, 503):
+            response.headers['Retry-After'] = '60'
+        return response
+
+    if not current_user.is_premium and not current_user.is_admin:
+        return batch_error("Vous devez avoir un abonnement actif pour générer des PDFs.", 403)
+
+    # Plusieurs images par requête : limite de taille relevée pour cette route seulement
+    request.max_content_length = (UPLOAD_MAX_MB * RENDER_BATCH_MAX_ITEMS + 1) * 1024 * 1024
+    files = [file for file in request.files.getlist('images') if file.filename]
+    if not files:
+        return batch_error("Aucune image n'a été envoyée (champ 'images').")
+    if len(files) > RENDER_BATCH_MAX_ITEMS:
+        return batch_error(f"Un lot est limité à {RENDER_BATCH_MAX_ITEMS} images ({len(files)} envoyées).")
+    for file in files:
+        if not allowed_file(file.filename):
+            return batch_error(f"{file.filename} : type de fichier non autorisé. Seules les images {', '.join(ALLOWED_EXTENSIONS).upper()} sont acceptées.")
+
+    # Paramètres de chaque image : formulaire, puis paramètres communs du manifeste, puis ceux de l'image
+    try:
+        manifest = json.loads(request.form.get('manifest') or '{}')
+        shared_parameters = {**request.form.to_dict(), **{nom: str(valeur) for nom, valeur in manifest.get('parametres', {}).items()}}
+        file_parameters = {element['fichier']: {nom: str(valeur) for nom, valeur in element.get('parametres', {}).items()}
+                           for element in manifest.get('elements', [])}
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return batch_error("Manifeste invalide : JSON attendu de la forme {\"parametres\": {...}, \"elements\": [{\"fichier\": ..., \"parametres\": {...}}]}.")
+    unknown_files = set(file_parameters) - {file.filename for file in files}
+    if unknown_files:
+        return batch_error(f"Le manifeste cite des images absentes du lot : {', '.join(sorted(unknown_files))}.")
+
+    books = []
+    for file in files:
+        try:
+            books.append(parse_book_parameters({**shared_parameters, **file_parameters.get(file.filename, {})}))
+        except ValueError as ve:
+            return batch_error(f"{file.filename} : erreur de saisie : {ve}. Veuillez vérifier vos paramètres numériques.")
+
+    # Limite par utilisateur tous processus confondus, puis place dans la file, vérifiées avant d'accepter les fichiers
+    active_batches = (db.session.query(RenderBatchItem.batch_id).join(RenderJob)
+                      .filter(RenderJob.user_id == current_user.id,
+                              RenderJob.status.in_(['En attente', 'En cours']),
+                              RenderJob.created_at > datetime.utcnow() - RENDER_JOB_STALE_AFTER)
+                      .distinct().count())
+    if active_batches >= RENDER_MAX_ACTIVE_BATCHES_PER_USER:
+        return batch_error(f"Vous avez déjà {active_batches} lot(s) en cours. Attendez qu'ils se terminent avant d'en lancer un autre.", 429)
+    if batch_scheduler.etat()['en_attente'] + len(files) > RENDER_BATCH_QUEUE_SIZE:
+        return batch_error("Le serveur est très sollicité : trop de générations en attente. Veuillez réessayer dans quelques minutes.", 503)
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    batch = RenderBatch(user_id=current_user.id)
+    db.session.add(batch)
+    renders = [] # (job, filepath, parametres_rendu, clés, pdf_final_path)
+    batch_saved = False
+    try:
+        for position, (file, book) in enumerate(zip(files, books), start=1):
+            filepath = os.path.join(UPLOAD_FOLDER, f"lot_{timestamp}_{position:02d}{os.path.splitext(secure_filename(file.filename))[1]}")
+            image_source, erreur = ingerer_image_source(file.stream, filepath, UPLOAD_MAX_MB * 1024 * 1024, UPLOAD_MAX_MEGAPIXELS * 1000000)
+            if erreur:
+                db.session.rollback()
+                return batch_error(f"{file.filename} : {erreur}", 422)
+
+            job = RenderJob(user_id=current_user.id, message="En attente dans le lot...")
+            db.session.add(RenderBatchItem(batch=batch, job=job, position=position, source_filename=file.filename[:255]))
+            pdf_final_path = os.path.join(GENERATED_PDF_FOLDER, f"foreedge_pattern_{timestamp}_{position:02d}.pdf")
+            renders.append((job, filepath, *render_parameters(book, image_source['empreinte']), pdf_final_path))
+        db.session.commit()
+        batch_saved = True
+
+        # Une image demandée à plusieurs résolutions (même hauteur de livre, donc même image maître) : ses rendus forment
+        # une seule tâche, exécutée à la suite ; le premier prépare l'image maître, les suivants la réutilisent.
+        # Les autres rendus sont des tâches indépendantes, exécutées en parallèle.
+        renders_by_master = {}
+        for render in renders:
+            renders_by_master.setdefault(render[5], []).append(render)
+        tasks = []
+        for group in renders_by_master.values():
+            if len({parametres_rendu['dpi_utilise'] for _, _, parametres_rendu, *_ in group}) > 1:
+                tasks.append(group)
+            else:
+                tasks.extend([render] for render in group)
+
+        for task in tasks:
+            # Résolutions notées pour les demandes suivantes (lots ou /generate) ; une image seule dans le lot prépare
+            # aussi l'image maître si son livre a déjà été demandé à une autre résolution
+            other_resolution_seen = [remember_master_resolution(cle_maitre, parametres_rendu['dpi_utilise'])
+                                     for _, _, parametres_rendu, _, _, cle_maitre, _ in task]
+            submitted, busy_message = batch_scheduler.soumettre(current_user.id, render_priority(current_user),
+                                                               functools.partial(run_render_jobs, [(job.id, *render) for job, *render in task],
+                                                                                 build_master=len(task) > 1 or any(other_resolution_seen)))
+            if not submitted:
+                # File remplie entre-temps par un autre lot : ces images ne sont pas générées, les autres continuent
+                for job, filepath, *_ in task:
+                    job.status = 'Erreur'
+                    job.error_message = busy_message
+                    job.finished_at = datetime.utcnow()
+                    os.remove(filepath)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erreur inattendue dans /batches: {e}")
+        return batch_error(f"Une erreur inattendue est survenue : {e}", 500)
+    finally:
+        # Une fois le lot enregistré, ce sont ses générations qui suppriment les fichiers sources
+        # (une image refusée par ingerer_image_source n'a rien écrit)
+        if not batch_saved:
+            for _, filepath, *_ in renders:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+
+    response = jsonify({**batch.to_dict(), 'status_url': url_for('render_batch_status', batch_id=batch.id)})
+    response.status_code = 202
+    return response
+
+
+def run_render_jobs(renders, build_master=False):
+    """Exécute à la suite les rendus d'une tâche de lot : [(job_id, filepath, parametres_rendu, cle_rendu, cle_tranches, cle_maitre, pdf_final_path)]."""
+    for job_id, filepath, parametres_rendu, cle_rendu, cle_tranches, cle_maitre, pdf_final_path in renders:
+        run_render_job(job_id, filepath, parametres_rendu, cle_rendu, cle_tranches, cle_maitre, pdf_final_path, build_master=build_master)
+
+
+def get_user_batch_or_404(batch_id):
+    batch = db.session.get(RenderBatch, batch_id)
+    if batch is None or (batch.user_id != current_user.id and not current_user.is_admin):
+        return None
+    return batch
+
+
+@app.route('/batches/<int:batch_id>')
+@login_required
+def render_batch_status(batch_id):
+    batch = get_user_batch_or_404(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Lot introuvable.'}), 404
+    expire_stale_render_jobs(batch.user_id)
+    return jsonify(batch.to_dict())
+
+
+@app.route('/batches/<int:batch_id>/zip')
+@login_required
+def render_batch_zip(batch_id):
+    """Archive ZIP des PDF d'un lot terminé, transmise au fil de sa construction."""
+    batch = get_user_batch_or_404(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Lot introuvable.'}), 404
+    if batch.to_dict()['status'] != 'Terminé':
+        return jsonify({'error': "Le lot n'est pas terminé : l'archive sera disponible une fois toutes les images traitées."}), 409
+
+    # Fichiers ouverts dès maintenant : un PDF supprimé par le nettoyage pendant la transmission reste lisible
+    sources = []
+    for item in batch.items:
+        if not item.job.pdf_filename:
+            continue
+        try:
+            source = open(os.path.join(GENERATED_PDF_FOLDER, item.job.pdf_filename), 'rb')
+        except FileNotFoundError:
+            continue
+        arcname = f"{item.position:02d}_{os.path.splitext(secure_filename(item.source_filename))[0] or 'image'}.pdf"
+        sources.append((arcname, source))
+    if not sources:
+        return jsonify({'error': f"Les PDF de ce lot ne sont plus disponibles : ils sont conservés {GENERATED_PDF_TTL_HOURS} heures. Veuillez relancer le lot."}), 410
+
+    return Response(zip_stream(sources), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="lot_{batch.id}.zip"', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Métriques des rendus au format texte de Prometheus (tous les workers gunicorn), pour les administrateurs ou avec METRICS_TOKEN."""
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and secrets.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+    if not token_ok and not (current_user.is_authenticated and current_user.is_admin):
+        return Response("Accès non autorisé.\n", status=403, mimetype='text/plain')
+
+    # Générations en attente et en cours, tous processus confondus (la base est partagée par les workers)
+    active_counts = dict(db.session.query(RenderJob.status, db.func.count(RenderJob.id))
+                         .filter(RenderJob.status.in_(['En attente', 'En cours']),
+                                 RenderJob.created_at > datetime.utcnow() - RENDER_JOB_STALE_AFTER)
+                         .group_by(RenderJob.status).all())
+    gauges = {
+        'render_jobs': ("Générations en attente ou en cours.",
+                        [({'status': 'queued'}, active_counts.get('En attente', 0)),
+                         ({'status': 'running'}, active_counts.get('En cours', 0))]),
+    }
+    return Response(render_metrics.exposition(gauges), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/generated-pdfs/<path:filename>')
 def get_generated_pdf(filename):
     from flask import send_from_directory
+    from werkzeug.utils import safe_join
+    pdf_path = safe_join(GENERATED_PDF_FOLDER, filename)
+    if pdf_path is None or not os.path.isfile(pdf_path):
+        # Les PDF générés sont supprimés après GENERATED_PDF_TTL_HOURS (ou plus tôt si le disque est plein)
+        flash(f"Ce PDF n'est plus disponible : les PDF sont conservés {GENERATED_PDF_TTL_HOURS} heures. Veuillez le générer à nouveau.", 'info')
+        return redirect(url_for('app_dashboard'))
     return send_from_directory(GENERATED_PDF_FOLDER, filename, as_attachment=True)
 
 
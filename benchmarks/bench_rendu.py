@@ -0,0 +1,197 @@
+"""
+Banc d'essai du pipeline de rendu (core_logic), hors ligne, sur des images synthétiques.
+
+Chaque cas (taille d'image x nombre de pages x largeur de bande x mode) est exécuté dans un sous-processus
+pour mesurer son pic de mémoire (RSS) isolément. Les résultats sont écrits en JSON, avec le commit courant,
+pour être comparés d'un commit à l'autre.
+
+Exemples :
+    python benchmarks/bench_rendu.py --rapide
+    python benchmarks/bench_rendu.py --pages 50 500 3000 --largeurs 3 10 20 --sortie resultats.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RACINE_DEPOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE_DEPOT)
+
+# Images synthétiques : (largeur, hauteur) en pixels
+TAILLES_IMAGES = {
+    'petite': (1200, 900),
+    'moyenne': (4000, 3000),
+    'grande': (8000, 6000),
+}
+PAGES_DEFAUT = [50, 500, 3000]
+LARGEURS_DEFAUT = [3, 10, 20]
+MODES = ['dossier', 'brut', 'flux']
+
+def creer_image_synthetique(chemin, largeur, hauteur):
+    """Image déterministe : dégradés, motifs fins et bruit (ni uniforme, ni incompressible)."""
+    import numpy as np
+    from PIL import Image
+
+    generateur = np.random.default_rng(1234)
+    y, x = np.mgrid[0:hauteur, 0:largeur].astype(np.float32)
+    rouge = 128 + 100 * np.sin(x / largeur * 6.28 * 3)
+    vert = 128 + 100 * np.cos(y / hauteur * 6.28 * 2)
+    bleu = 128 + 60 * np.sin((x + y) / 37.0)
+    pixels = np.stack([rouge, vert, bleu], axis=-1) + generateur.normal(0, 12, (hauteur, largeur, 3))
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(chemin, quality=90)
+
+
+def pic_memoire_mo():
+    """
+    Pic de mémoire résidente du processus courant. VmHWM (Linux) est propre au programme exécuté,
+    alors que ru_maxrss conserve après exec le pic du processus parent au moment du fork.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for ligne in f:
+                if ligne.startswith('VmHWM:'):
+                    return round(int(ligne.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def executer_cas(cas):
+    """Exécute un cas dans le processus courant et retourne ses mesures (appelé dans un sous-processus)."""
+    from core_logic.image_processing import generer_tranches_individuelles, generer_tranches_en_flux, generer_pdf_a_partir_tranches
+    from core_logic.metriques import MesuresRendu
+
+    # Durées (exclusives) et octets par étape, relevés par core_logic lui-même (voir ETAPES_RENDU)
+    mesures = MesuresRendu()
+    dossier_sortie = tempfile.mkdtemp(prefix='bench_rendu_')
+    chemin_pdf = os.path.join(dossier_sortie, 'sortie.pdf')
+    options_pdf = {'profil_encodage': cas['profil']} if cas['profil'] else {}
+    if cas.get('processus_assemblage', 1) > 1:
+        options_pdf['nombre_processus_assemblage'] = cas['processus_assemblage']
+    dossier_tranches = None
+    try:
+        debut = time.perf_counter()
+        cpu_debut = time.process_time()
+        if cas['mode'] in ('dossier', 'brut'):
+            source_tranches, erreur = generer_tranches_individuelles(cas['image'], cas['hauteur_mm'], cas['pages'], cas['dpi'],
+                                                                     cas['largeur_mm'], None,
+                                                                     format_tranches='png' if cas['mode'] == 'dossier' else 'brut',
+                                                                     mesures=mesures)
+            dossier_tranches = source_tranches
+        else:
+            source_tranches, erreur = generer_tranches_en_flux(cas['image'], cas['hauteur_mm'], cas['pages'], cas['dpi'],
+                                                               cas['largeur_mm'], None, mesures=mesures)
+        # En mode flux, le découpage a lieu pendant l'assemblage : il est compté dans pdf_total (et dans l'étape decoupage)
+        instant_tranches = time.perf_counter() - debut
+        if not erreur:
+            _, erreur = generer_pdf_a_partir_tranches(source_tranches, cas['hauteur_mm'], cas['largeur_mm'], 1, 2, None,
+                                                      cas['image'], cas['pages'], chemin_pdf, mesures=mesures, **options_pdf)
+        duree = time.perf_counter() - debut
+        cpu = time.process_time() - cpu_debut
+
+        return {
+            'duree_s': round(duree, 4),
+            'cpu_s': round(cpu, 4),
+            'rss_max_mo': pic_memoire_mo(),
+            'taille_pdf_octets': os.path.getsize(chemin_pdf) if not erreur else None,
+            'etapes_s': {etape: round(secondes, 4) for etape, secondes in mesures.durees.items()},
+            'etapes_octets': dict(mesures.octets),
+            'tranches_total_s': round(instant_tranches, 4),
+            'pdf_total_s': round(duree - instant_tranches, 4),
+            'erreur': erreur,
+        }
+    finally:
+        shutil.rmtree(dossier_sortie, ignore_errors=True)
+        if dossier_tranches:
+            shutil.rmtree(dossier_tranches, ignore_errors=True)
+
+
+def commit_courant():
+    try:
+        return subprocess.run(['git', '-C', RACINE_DEPOT, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tailles', nargs='+', choices=sorted(TAILLES_IMAGES), default=sorted(TAILLES_IMAGES))
+    parser.add_argument('--pages', nargs='+', type=int, default=PAGES_DEFAUT)
+    parser.add_argument('--largeurs', nargs='+', type=float, default=LARGEURS_DEFAUT, help="Largeurs de bande en mm")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES,
+                        help="dossier : generer_tranches_individuelles (PNG) ; brut : idem en pixels bruts projetés en mémoire ; "
+                             "flux : generer_tranches_en_flux (utilisé par l'application)")
+    parser.add_argument('--hauteur', type=float, default=200, help="Hauteur du livre en mm")
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--profil', default=None, help="Profil d'encodage du PDF (défaut : encodage ReportLab)")
+    parser.add_argument('--processus-assemblage', type=int, default=1,
+                        help="Processus d'encodage des pages du PDF (demande --profil)")
+    parser.add_argument('--repetitions', type=int, default=1, help="Mesures par cas ; la plus rapide est retenue")
+    parser.add_argument('--rapide', action='store_true', help="Sous-ensemble court : petite image, 50 et 500 pages, bandes de 3 et 10 mm")
+    parser.add_argument('--sortie', default=None, help="Fichier JSON des résultats (défaut : sortie standard)")
+    parser.add_argument('--cas', help=argparse.SUPPRESS) # Usage interne : exécution d'un cas dans un sous-processus
+    args = parser.parse_args()
+
+    if args.cas:
+        print(json.dumps(executer_cas(json.loads(args.cas))))
+        return
+
+    if args.rapide:
+        args.tailles, args.pages, args.largeurs = ['petite'], [50, 500], [3, 10]
+
+    dossier_images = tempfile.mkdtemp(prefix='bench_images_')
+    resultats = []
+    try:
+        for taille in args.tailles:
+            chemin_image = os.path.join(dossier_images, f"{taille}.jpg")
+            creer_image_synthetique(chemin_image, *TAILLES_IMAGES[taille])
+
+            for pages in args.pages:
+                for largeur_mm in args.largeurs:
+                    for mode in args.modes:
+                        cas = {'taille': taille, 'largeur_px': TAILLES_IMAGES[taille][0], 'hauteur_px': TAILLES_IMAGES[taille][1],
+                               'pages': pages, 'largeur_mm': largeur_mm, 'hauteur_mm': args.hauteur, 'dpi': args.dpi,
+                               'mode': mode, 'profil': args.profil, 'processus_assemblage': args.processus_assemblage,
+                               'image': chemin_image}
+                        mesures = []
+                        for _ in range(args.repetitions):
+                            processus = subprocess.run([sys.executable, os.path.abspath(__file__), '--cas', json.dumps(cas)],
+                                                       capture_output=True, text=True)
+                            if processus.returncode != 0:
+                                mesures.append({'erreur': processus.stderr.strip().splitlines()[-1] if processus.stderr.strip() else 'échec'})
+                                break
+                            # core_logic écrit aussi des traces sur la sortie standard : le résultat est la dernière ligne
+                            mesures.append(json.loads(processus.stdout.strip().splitlines()[-1]))
+
+                        mesure = min(mesures, key=lambda m: m.get('duree_s', float('inf')))
+                        del cas['image']
+                        resultats.append({**cas, **mesure})
+                        print(f"{taille:8} {pages:5} p. {largeur_mm:5g} mm {mode:8} "
+                              f"{mesure.get('duree_s', '-')} s  {mesure.get('rss_max_mo', '-')} Mo  {mesure.get('erreur') or ''}",
+                              file=sys.stderr)
+    finally:
+        shutil.rmtree(dossier_images, ignore_errors=True)
+
+    rapport = {
+        'commit': commit_courant(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'systeme': platform.platform(), 'processeurs': os.cpu_count()},
+        'resultats': resultats,
+    }
+    if args.sortie:
+        with open(args.sortie, 'w', encoding='utf-8') as f:
+            json.dump(rapport, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(rapport, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import fcntl
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import time
+
+
+def empreinte_fichier(chemin_fichier):
+    """Empreinte SHA-256 du contenu d'un fichier, lu par blocs (sans le charger entièrement en mémoire)."""
+    empreinte = hashlib.sha256()
+    with open(chemin_fichier, 'rb') as f:
+        for bloc in iter(lambda: f.read(1024 * 1024), b''):
+            empreinte.update(bloc)
+    return empreinte.hexdigest()
+
+
+class CacheRendu:
+    """
+    Cache disque des PDF générés, adressé par le contenu : la clé est l'empreinte de l'image source
+    combinée à TOUS les paramètres qui influencent le rendu.
+    Les rendus identiques lancés en même temps (y compris depuis plusieurs workers gunicorn) sont coalescés :
+    un verrou de fichier par clé garantit qu'un seul les calcule, les autres attendent puis réutilisent le résultat.
+    Au-delà de taille_max_octets, les PDF les moins récemment utilisés sont supprimés.
+    """
+
+    def __init__(self, dossier_cache, taille_max_octets):
+        self.dossier_cache = dossier_cache
+        self.taille_max_octets = taille_max_octets
+        os.makedirs(dossier_cache, exist_ok=True)
+
+    @staticmethod
+    def cle(empreinte_source, parametres):
+        """Clé de cache : empreinte de la source + paramètres de rendu (dict sérialisable en JSON)."""
+        parametres_normalises = json.dumps(parametres, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(f"{empreinte_source}:{parametres_normalises}".encode('utf-8')).hexdigest()
+
+    def chemin(self, cle):
+        return os.path.join(self.dossier_cache, f"{cle}.pdf")
+
+    def obtenir(self, cle):
+        """Chemin du PDF en cache pour cette clé (marqué comme utilisé), ou None s'il est absent."""
+        chemin_pdf = self.chemin(cle)
+        return chemin_pdf if self._marquer_utilise(chemin_pdf) else None
+
+    def obtenir_ou_generer(self, cle, generer):
+        """
+        Retourne le PDF en cache pour cette clé, ou le génère une seule fois.
+
+        Args:
+            cle (str): Clé obtenue par CacheRendu.cle().
+            generer (callable): generer(chemin_pdf_sortie) -> (chemin_pdf, erreur_message), appelée en cas d'absence.
+
+        Returns:
+            tuple: (chemin_pdf, erreur_message, depuis_cache)
+        """
+        chemin_pdf = self.chemin(cle)
+        if self._marquer_utilise(chemin_pdf):
+            return chemin_pdf, None, True
+
+        with open(os.path.join(self.dossier_cache, f"{cle}.lock"), 'a') as fichier_verrou:
+            # Bloque tant qu'un autre rendu de la même clé est en cours
+            fcntl.flock(fichier_verrou, fcntl.LOCK_EX)
+            try:
+                if self._marquer_utilise(chemin_pdf):
+                    return chemin_pdf, None, True
+
+                # Rendu dans un fichier temporaire puis renommage atomique : jamais de PDF partiel visible dans le cache
+                chemin_temporaire = f"{chemin_pdf}.{os.getpid()}_{secrets.token_hex(4)}.tmp"
+                try:
+                    chemin_genere, erreur = generer(chemin_temporaire)
+                    if erreur:
+                        return None, erreur, False
+                    os.replace(chemin_genere, chemin_pdf)
+                finally:
+                    if os.path.exists(chemin_temporaire):
+                        os.remove(chemin_temporaire)
+            finally:
+                fcntl.flock(fichier_verrou, fcntl.LOCK_UN)
+
+        self._evincer(chemin_a_conserver=chemin_pdf)
+        return chemin_pdf, None, False
+
+    def _marquer_utilise(self, chemin_pdf):
+        """Met à jour la date d'utilisation d'un PDF en cache (ordre LRU). Retourne False s'il est absent."""
+        try:
+            os.utime(chemin_pdf)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _evincer(self, chemin_a_conserver=None):
+        """Supprime les PDF les moins récemment utilisés jusqu'à repasser sous la taille maximale du cache."""
+        entrees = []
+        for nom_fichier in os.listdir(self.dossier_cache):
+            if not nom_fichier.endswith('.pdf'):
+                continue
+            chemin_fichier = os.path.join(self.dossier_cache, nom_fichier)
+            try:
+                infos = os.stat(chemin_fichier)
+            except FileNotFoundError:
+                continue
+            entrees.append((infos.st_mtime, infos.st_size, chemin_fichier))
+
+        taille_totale = sum(taille for _, taille, _ in entrees)
+        for _, taille, chemin_fichier in sorted(entrees):
+            if taille_totale <= self.taille_max_octets:
+                break
+            if chemin_fichier == chemin_a_conserver:
+                continue
+            # Le fichier de verrou (vide) est conservé : le supprimer pendant qu'un rendu l'attend casserait la coalescence
+            try:
+                os.remove(chemin_fichier)
+            except FileNotFoundError:
+                pass
+            taille_totale -= taille
+
+
+class CacheTranches:
+    """
+    Cache disque des jeux de tranches encodées (un dossier par jeu, voir TranchesEncodees), adressé comme CacheRendu
+    mais avec les seuls paramètres qui influencent les tranches (géométrie et encodage, pas la mise en page) :
+    un nouveau PDF des mêmes tranches, avec une autre numérotation, ne refait ni le découpage ni l'encodage.
+    Un jeu est écrit dans un dossier temporaire puis publié par renommage atomique.
+    Au-delà de taille_max_octets, les jeux les moins récemment utilisés sont supprimés.
+    Sert aussi de cache aux images maîtres (ImageMaitre), publiées de la même façon.
+    """
+
+    # Dossiers temporaires plus anciens (secondes) : laissés par un processus arrêté en cours de rendu
+    AGE_MAX_TEMPORAIRE = 24 * 3600
+
+    def __init__(self, dossier_cache, taille_max_octets):
+        self.dossier_cache = dossier_cache
+        self.taille_max_octets = taille_max_octets
+        os.makedirs(dossier_cache, exist_ok=True)
+
+    def chemin(self, cle):
+        return os.path.join(self.dossier_cache, cle)
+
+    def obtenir(self, cle):
+        """Dossier du jeu de tranches de cette clé (marqué comme utilisé), ou None s'il est absent."""
+        chemin_jeu = self.chemin(cle)
+        try:
+            os.utime(chemin_jeu)
+            return chemin_jeu
+        except FileNotFoundError:
+            return None
+
+    def dossier_temporaire(self, cle):
+        """Chemin (non créé) où écrire un nouveau jeu avant de le publier."""
+        return f"{self.chemin(cle)}.{os.getpid()}_{secrets.token_hex(4)}.tmp"
+
+    def publier(self, cle, dossier_temporaire):
+        """Rend visible un jeu complet ; si un autre rendu l'a publié entre-temps, le sien est conservé."""
+        try:
+            os.rename(dossier_temporaire, self.chemin(cle))
+        except OSError:
+            shutil.rmtree(dossier_temporaire, ignore_errors=True)
+        self._evincer(chemin_a_conserver=self.chemin(cle))
+
+    def _evincer(self, chemin_a_conserver=None):
+        """Supprime les jeux les moins récemment utilisés jusqu'à repasser sous la taille maximale du cache."""
+        entrees = []
+        for nom_dossier in os.listdir(self.dossier_cache):
+            chemin_jeu = os.path.join(self.dossier_cache, nom_dossier)
+            try:
+                date_utilisation = os.stat(chemin_jeu).st_mtime
+                if nom_dossier.endswith('.tmp'):
+                    if time.time() - date_utilisation > self.AGE_MAX_TEMPORAIRE:
+                        shutil.rmtree(chemin_jeu, ignore_errors=True)
+                    continue
+                taille = sum(entree.stat().st_size for entree in os.scandir(chemin_jeu))
+            except FileNotFoundError:
+                continue
+            entrees.append((date_utilisation, taille, chemin_jeu))
+
+        taille_totale = sum(taille for _, taille, _ in entrees)
+        for _, taille, chemin_jeu in sorted(entrees):
+            if taille_totale <= self.taille_max_octets:
+                break
+            if chemin_jeu == chemin_a_conserver:
+                continue
+            shutil.rmtree(chemin_jeu, ignore_errors=True)
+            taille_totale -= taille
@@ -1,16 +1,541 @@
 from PIL import Image
+import numpy as np
 import os
 import shutil
 import math
-from datetime import date, datetime # Importe date et datetime pour usage précis
+import io
+import zlib
+import json
+import mmap
+import tempfile
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from datetime import date # Date de création imprimée sur la page de garde
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc
+from core_logic.metriques import MesuresRendu
+
+# Taille maximale d'une bande de tranches rééchantillonnée d'un seul coup (borne la mémoire pour les livres épais).
+# Sous le seuil mmap de glibc (32 Mo max), le tampon d'une bande libérée est réutilisé pour la suivante.
+OCTETS_MAX_PAR_BANDE = 16 * 1024 * 1024
+# Nombre de colonnes rééchantillonnées par colonne source dans chaque tranche avant l'étirement final par répétition
+SURECHANTILLONNAGE_HORIZONTAL = 4
+
+# Budget mémoire par défaut pour le décodage de l'image source (en Mo), pour un rendu
+BUDGET_MEMOIRE_DECODAGE_MO = 512
+
+# Aperçu de l'image source sur la page de garde du PDF : jamais plus grand qu'une page A4 à cette résolution
+DPI_APERCU_PAGE_GARDE = 150
+TAILLE_MAX_APERCU_PIXELS = (round(210 / 25.4 * DPI_APERCU_PAGE_GARDE), round(297 / 25.4 * DPI_APERCU_PAGE_GARDE))
+# Résolution de la simulation de la tranche éventée (aperçu à l'écran avant la génération du PDF)
+DPI_SIMULATION_TRANCHE = 96
+
+# Formats de page du PDF des tranches : (largeur, hauteur) en mm, en portrait
+FORMATS_PAGE_PDF = {
+    'A4': (210, 297),
+    'A3': (297, 420),
+    'Letter': (215.9, 279.4),
+}
+
+# Nom de l'aperçu dans un dossier de tranches (pas en .png : il ne doit pas être pris pour une tranche)
+NOM_FICHIER_APERCU = "apercu_page_garde.jpg"
+
+# Jeu de tranches déjà encodées pour le PDF (TranchesEncodees) : données concaténées et index dans un même dossier
+NOM_FICHIER_DONNEES_TRANCHES = "tranches.bin"
+NOM_FICHIER_INDEX_TRANCHES = "index.json"
+
+# Tranches en pixels bruts (TranchesBrutes) : pixels RGB de toutes les tranches dans un seul fichier, et leur index
+NOM_FICHIER_PIXELS_TRANCHES = "tranches.rgb"
+NOM_FICHIER_INDEX_PIXELS = "tranches_rgb.json"
+# Formats d'un dossier de tranches produit par generer_tranches_individuelles
+FORMATS_TRANCHES = ('png', 'brut')
+
+# Image maître (ImageMaitre) : l'image source à la hauteur du livre à DPI_MAITRE, d'où chaque résolution
+# de DPI_DERIVES est tirée par une réduction d'un facteur entier (moyenne de 2, 3 ou 4 lignes)
+DPI_MAITRE = 600
+DPI_DERIVES = (150, 200, 300)
+NOM_FICHIER_PIXELS_MAITRE = "maitre.rgb"
+NOM_FICHIER_INDEX_MAITRE = "maitre.json"
+
+# Profils d'encodage des images de tranches dans le PDF : (filtre, niveau).
+# 'flate' : sans perte, niveau zlib 1 (rapide) à 9 (compact) ; 'jpeg' : DCT, niveau = qualité ; 'brut' : aucune compression.
+PROFILS_ENCODAGE_PDF = {
+    'standard': ('flate', 6),
+    'compact': ('flate', 9),
+    'rapide': ('flate', 1),
+    'jpeg': ('jpeg', 90),
+    'brut': ('brut', None),
+}
 
 # --- Partie 1: Logique de génération des tranches individuelles ---
-def generer_tranches_individuelles(chemin_image_source, hauteur_livre_mm, nombre_pages_livre, dpi_utilise, largeur_tranche_etiree_cible_mm, progress_callback):
+def _octets_par_pixel_decode(mode):
+    """Occupation mémoire d'un pixel décodé par PIL (les modes multi-canaux sont stockés sur 4 octets)."""
+    return 1 if mode in ('1', 'L', 'P') else 4
+
+
+def _creer_apercu(img):
+    """Réduit une image déjà décodée à la taille de l'aperçu de la page de garde (proportions conservées)."""
+    echelle = min(1, TAILLE_MAX_APERCU_PIXELS[0] / img.width, TAILLE_MAX_APERCU_PIXELS[1] / img.height)
+    if echelle == 1:
+        return img.copy()
+    taille_apercu = (max(1, round(img.width * echelle)), max(1, round(img.height * echelle)))
+    return img.resize(taille_apercu, Image.LANCZOS, reducing_gap=3.0)
+
+
+def _charger_image_source(chemin_image_source, hauteur_cible_pixels, budget_memoire_mo, mesures=None):
+    """
+    Charge l'image source en RGB sans dépasser le budget mémoire de décodage.
+    Un JPEG est décodé directement à l'échelle utile (mode draft : 1/2, 1/4 ou 1/8 dans le domaine DCT),
+    réduite davantage si le budget l'exige. Les autres formats ne peuvent être décodés qu'en pleine résolution :
+    ils sont refusés s'ils dépassent le budget. L'image est ensuite réduite d'un facteur entier (Image.reduce)
+    tant qu'elle reste plus haute que la hauteur cible ; le redimensionnement exact est fait par l'appelant.
+
+    Returns:
+        tuple: (image, erreur_message)
+    """
+    budget_octets = budget_memoire_mo * 1024 * 1024
+    img = Image.open(chemin_image_source)
+    largeur, hauteur = img.size
+    if mesures is not None:
+        mesures.definir('megapixels_source', largeur * hauteur / 1e6)
+
+    if img.format == 'JPEG':
+        # Taille minimale utile : la hauteur du livre, largeur proportionnelle
+        taille_demandee = (max(1, math.ceil(largeur * hauteur_cible_pixels / hauteur)), min(hauteur, hauteur_cible_pixels))
+        pixels_max_budget = budget_octets // 4
+        if taille_demandee[0] * taille_demandee[1] > pixels_max_budget:
+            # Même à l'échelle utile l'image dépasse le budget : on la décode plus petite (l'appelant la réagrandira)
+            facteur = math.sqrt(taille_demandee[0] * taille_demandee[1] / pixels_max_budget)
+            taille_demandee = (max(1, int(taille_demandee[0] / facteur)), max(1, int(taille_demandee[1] / facteur)))
+            print(f"Avertissement: image {largeur}x{hauteur} réduite à ~{taille_demandee[0]}x{taille_demandee[1]} pour respecter le budget mémoire de {budget_memoire_mo} Mo.")
+        img.draft('RGB', taille_demandee)
+
+    # Le draft ne décode qu'à 1/2, 1/4 ou 1/8 : la taille décodée peut rester au-dessus de la taille demandée
+    octets_decodage = img.width * img.height * _octets_par_pixel_decode(img.mode)
+    if img.mode != 'RGB':
+        octets_decodage += img.width * img.height * 4 # copie lors de la conversion en RGB
+    if octets_decodage > budget_octets:
+        return None, (f"Erreur: L'image source ({largeur}x{hauteur} pixels) demande environ {octets_decodage // (1024 * 1024)} Mo "
+                      f"pour être décodée, au-delà du budget de {budget_memoire_mo} Mo.\n"
+                      f"Veuillez réduire sa résolution ou l'enregistrer en JPEG.")
+
+    if img.mode != 'RGB':
+        img = img.convert("RGB") # convert() copie l'image même si elle est déjà en RGB : on l'évite
+    else:
+        img.load()
+
+    facteur_reduction = img.height // hauteur_cible_pixels
+    if facteur_reduction >= 2:
+        img = img.reduce(facteur_reduction)
+
+    return img, None
+
+
+def _calculer_bande(img_hauteur_livre, debut, fin, largeur_source_par_tranche, colonnes_par_tranche, largeur_pixels_cible, index_colonnes_bande):
+    """
+    Calcule les tranches étirées [debut, fin) sous forme d'une bande (hauteur, (fin - debut) x largeur cible, 3).
+    Utilisée directement en mode séquentiel, et par les processus de calcul en mode parallèle.
+    """
+    hauteur_pixels = img_hauteur_livre.height
+    bande_native = img_hauteur_livre.resize(((fin - debut) * colonnes_par_tranche, hauteur_pixels), Image.LANCZOS,
+                                            box=(debut * largeur_source_par_tranche, 0, fin * largeur_source_par_tranche, hauteur_pixels))
+
+    # Étirement de toutes les tranches de la bande en une seule indexation vectorisée dans un tampon unique ;
+    # chaque tranche en est ensuite une vue (pas de crop ni d'allocation par tranche).
+    # (En mode parallèle l'image est en RGBX : seuls les trois premiers canaux sont gardés.)
+    return np.take(np.asarray(bande_native)[:, :, :3], index_colonnes_bande[:(fin - debut) * largeur_pixels_cible], axis=1)
+
+
+def _calculer_bande_partagee(nom_memoire_partagee, taille_image, *args):
+    """Point d'entrée d'un processus de calcul : l'image à la hauteur du livre est lue en mémoire partagée, sans copie."""
+    # Les processus de calcul partagent le resource_tracker du processus principal, seul à supprimer le segment
+    memoire = shared_memory.SharedMemory(name=nom_memoire_partagee)
+    try:
+        img_hauteur_livre = Image.frombuffer("RGBX", taille_image, memoire.buf, "raw", "RGBX", 0, 1)
+        bande = _calculer_bande(img_hauteur_livre, *args)
+        del img_hauteur_livre
+        return bande
+    finally:
+        memoire.close()
+
+
+class FluxTranches:
+    """
+    Séquence paresseuse des tranches étirées, produites en mémoire sans fichier intermédiaire.
+    Chaque parcours génère les tranches à la volée (images PIL RGB), dans l'ordre du livre.
+    Le nombre de tranches est connu avant le parcours (len()), ce dont la page de garde du PDF a besoin.
+
+    Les tranches sont obtenues en un seul rééchantillonnage de l'image vers (N x largeur cible, hauteur du livre),
+    calculé par bandes de plusieurs tranches pour borner la mémoire, puis découpé aux frontières exactes.
+    Les pixels d'une bande sont stockés dans un seul tableau NumPy ; tranches_brutes() en donne des vues sans copie.
+    Avec nombre_processus > 1, les bandes sont calculées en parallèle par un pool de processus,
+    et restituées dans l'ordre du livre.
+    """
+
+    def __init__(self, img_hauteur_livre, nombre_tranches, largeur_pixels_cible, hauteur_pixels, nombre_processus=1, apercu=None, mesures=None):
+        self.img_hauteur_livre = img_hauteur_livre # Image déjà ramenée à la hauteur du livre, largeur d'origine
+        self.nombre_tranches = nombre_tranches
+        self.largeur_pixels_cible = largeur_pixels_cible
+        self.hauteur_pixels = hauteur_pixels
+        self.nombre_processus = nombre_processus
+        self.apercu = apercu # Aperçu réduit de l'image source pour la page de garde (proportions d'origine)
+        self.mesures = mesures if mesures is not None else MesuresRendu() # Temps de calcul des bandes : étape 'decoupage'
+
+    def __len__(self):
+        return self.nombre_tranches
+
+    def __iter__(self):
+        for numero_tranche, pixels in self.tranches_brutes():
+            yield numero_tranche, Image.fromarray(pixels)
+
+    def tranches_brutes(self):
+        """
+        Parcourt les tranches sous forme de vues NumPy (hauteur, largeur, 3) en uint8, sans copie.
+        Chaque vue reste valide tant qu'elle est référencée (elle maintient sa bande en mémoire).
+        """
+        # Largeur (en pixels de l'image source) couverte par chaque tranche : les frontières restent fractionnaires,
+        # le filtre LANCZOS s'appuie sur les pixels voisins de part et d'autre, y compris entre deux bandes.
+        largeur_source_par_tranche = self.img_hauteur_livre.width / self.nombre_tranches
+
+        # Le LANCZOS n'est calculé qu'à la résolution utile de la tranche (SURECHANTILLONNAGE_HORIZONTAL colonnes par
+        # colonne source), puis chaque colonne est répétée jusqu'à la largeur cible : un agrandissement de x50 ou plus
+        # n'apporte aucun détail supplémentaire et coûterait six fois plus de calcul par pixel produit.
+        colonnes_par_tranche = max(1, min(self.largeur_pixels_cible, math.ceil(largeur_source_par_tranche * SURECHANTILLONNAGE_HORIZONTAL)))
+
+        octets_par_tranche = self.largeur_pixels_cible * self.hauteur_pixels * 3
+        tranches_par_bande = max(1, OCTETS_MAX_PAR_BANDE // octets_par_tranche)
+
+        # Pour chaque colonne étirée d'une bande complète, l'indice de la colonne rééchantillonnée qu'elle répète
+        # (centre du pixel) : les colonnes de la tranche k ne répètent que des colonnes de la tranche k.
+        index_colonnes_tranche = ((2 * np.arange(self.largeur_pixels_cible) + 1) * colonnes_par_tranche) // (2 * self.largeur_pixels_cible)
+        index_colonnes_bande = (np.arange(tranches_par_bande)[:, None] * colonnes_par_tranche + index_colonnes_tranche[None, :]).ravel()
+
+        limites_bandes = [(debut, min(debut + tranches_par_bande, self.nombre_tranches))
+                          for debut in range(0, self.nombre_tranches, tranches_par_bande)]
+        parametres_bande = (largeur_source_par_tranche, colonnes_par_tranche, self.largeur_pixels_cible, index_colonnes_bande)
+
+        if self.nombre_processus > 1 and len(limites_bandes) > 1:
+            bandes = self._bandes_en_parallele(limites_bandes, parametres_bande)
+        else:
+            bandes = self._bandes_en_sequence(limites_bandes, parametres_bande)
+
+        for debut, fin, bande in bandes:
+            for k in range(fin - debut):
+                left = k * self.largeur_pixels_cible
+                yield debut + k + 1, bande[:, left:left + self.largeur_pixels_cible]
+
+    def _bandes_en_sequence(self, limites_bandes, parametres_bande):
+        for debut, fin in limites_bandes:
+            with self.mesures.etape('decoupage'):
+                bande = _calculer_bande(self.img_hauteur_livre, debut, fin, *parametres_bande)
+            self.mesures.ajouter_octets('decoupage', bande.nbytes)
+            yield debut, fin, bande
+
+    def _bandes_en_parallele(self, limites_bandes, parametres_bande):
+        """
+        Répartit le calcul des bandes sur un pool de processus. L'image à la hauteur du livre est placée une fois
+        en mémoire partagée (RGBX, directement lisible par PIL) ; au plus 2 bandes par processus sont en vol,
+        et elles sont restituées dans l'ordre de soumission.
+        """
+        taille_image = self.img_hauteur_livre.size
+        memoire = shared_memory.SharedMemory(create=True, size=taille_image[0] * taille_image[1] * 4)
+        executeur = None
+        try:
+            pixels_rgbx = self.img_hauteur_livre.tobytes("raw", "RGBX")
+            memoire.buf[:len(pixels_rgbx)] = pixels_rgbx
+            del pixels_rgbx
+
+            # forkserver : les processus de calcul ne sont pas dupliqués depuis un processus web multi-thread
+            contexte = multiprocessing.get_context("forkserver")
+            contexte.set_forkserver_preload([__name__])
+            executeur = ProcessPoolExecutor(max_workers=self.nombre_processus, mp_context=contexte)
+
+            en_cours = deque()
+            for debut, fin in limites_bandes:
+                en_cours.append((debut, fin, executeur.submit(_calculer_bande_partagee, memoire.name, taille_image, debut, fin, *parametres_bande)))
+                if len(en_cours) >= 2 * self.nombre_processus:
+                    yield self._bande_calculee(en_cours.popleft())
+
+            while en_cours:
+                yield self._bande_calculee(en_cours.popleft())
+        finally:
+            if executeur is not None:
+                executeur.shutdown(wait=True, cancel_futures=True)
+            memoire.close()
+            memoire.unlink()
+
+    def _bande_calculee(self, bande_en_cours):
+        """Attend une bande du pool ; seule l'attente est comptée dans 'decoupage' (le calcul recouvre l'assemblage)."""
+        debut, fin, futur = bande_en_cours
+        with self.mesures.etape('decoupage'):
+            bande = futur.result()
+        self.mesures.ajouter_octets('decoupage', bande.nbytes)
+        return debut, fin, bande
+
+
+def generer_tranches_en_flux(chemin_image_source, hauteur_livre_mm, nombre_pages_livre, dpi_utilise, largeur_tranche_etiree_cible_mm, progress_callback,
+                             nombre_processus=1, budget_memoire_mo=None, mesures=None):
+    """
+    Prépare les tranches étirées en mémoire, sans écrire de fichiers PNG intermédiaires.
+    L'image source est chargée et ramenée à la hauteur du livre ici ; l'étirement horizontal et le découpage
+    se font ensuite pendant le parcours du FluxTranches retourné (par exemple par
+    generer_pdf_a_partir_tranches, qui l'accepte à la place d'un dossier).
+
+    Args:
+        Identiques à generer_tranches_individuelles, plus :
+        mesures (MesuresRendu, optional): Reçoit les durées et volumes des étapes (chargement, redimensionnement,
+            puis découpage pendant le parcours du flux).
+
+    Returns:
+        tuple: (flux_tranches, erreur_message)
+                flux_tranches (FluxTranches or None): Les tranches à générer, dans l'ordre.
+                erreur_message (str or None): Message d'erreur si une erreur survient.
+    """
+    nombre_tranches_reelles = math.ceil(nombre_pages_livre / 2)
+    if mesures is None:
+        mesures = MesuresRendu()
+
+    # Calcul de la hauteur en pixels pour la hauteur du livre demandée - C'est la hauteur que TOUTES les tranches DOIVENT avoir
+    hauteur_livre_pixels = int(round((hauteur_livre_mm / 25.4) * dpi_utilise))
+    img_hauteur_livre, _, apercu, erreur = _image_a_la_hauteur_du_livre(chemin_image_source, hauteur_livre_pixels, progress_callback,
+                                                                         budget_memoire_mo, mesures)
+    if erreur:
+        return None, erreur
+
+    # Largeur cible en pixels pour chaque tranche après étirement
+    largeur_pixels_cible_par_tranche_etiree = int(round((largeur_tranche_etiree_cible_mm / 25.4) * dpi_utilise))
+
+    return FluxTranches(img_hauteur_livre, nombre_tranches_reelles, largeur_pixels_cible_par_tranche_etiree, hauteur_livre_pixels,
+                        nombre_processus=nombre_processus, apercu=apercu, mesures=mesures), None
+
+
+def _image_a_la_hauteur_du_livre(chemin_image_source, hauteur_livre_pixels, progress_callback, budget_memoire_mo, mesures):
+    """
+    Charge l'image source et la ramène à la hauteur du livre (largeur d'origine), et prépare l'aperçu de la page de garde.
+
+    Returns:
+        tuple: (img_hauteur_livre, hauteur_decodee, apercu, erreur_message), où hauteur_decodee est la hauteur
+               de l'image source telle que décodée (voir _charger_image_source), avant le redimensionnement.
+    """
+    if progress_callback:
+        progress_callback(5, "Chargement de l'image source...")
+
+    try:
+        with mesures.etape('chargement'):
+            img_originale, erreur = _charger_image_source(chemin_image_source, hauteur_livre_pixels,
+                                                          budget_memoire_mo if budget_memoire_mo is not None else BUDGET_MEMOIRE_DECODAGE_MO,
+                                                          mesures)
+        if erreur:
+            return None, None, None, erreur
+        mesures.ajouter_octets('chargement', img_originale.width * img_originale.height * 3)
+    except FileNotFoundError:
+        return None, None, None, f"Erreur: L'image source n'a pas été trouvée à l'emplacement :\n{chemin_image_source}"
+    except Exception as e:
+        return None, None, None, f"Erreur: Erreur lors du chargement de l'image : {e}"
+
+    if progress_callback:
+        progress_callback(15, "Redimensionnement de l'image à la hauteur du livre...")
+
+    # Passe verticale uniquement : la largeur de l'image chargée est conservée, l'étirement horizontal vers
+    # (N x largeur cible) est fait bande par bande lors du parcours. Les deux passes 1D forment ensemble
+    # UN seul rééchantillonnage LANCZOS séparable, au lieu d'un redimensionnement puis d'un second par tranche.
+    with mesures.etape('redimensionnement'):
+        img_hauteur_livre = img_originale.resize((img_originale.width, hauteur_livre_pixels), Image.LANCZOS)
+
+        # L'aperçu de la page de garde est tiré de l'image déjà décodée : le PDF n'a pas à relire l'original
+        apercu = _creer_apercu(img_originale)
+    mesures.ajouter_octets('redimensionnement', img_hauteur_livre.width * img_hauteur_livre.height * 3)
+    return img_hauteur_livre, img_originale.height, apercu, None
+
+
+class ImageMaitre:
+    """
+    Image source chargée et ramenée à la hauteur du livre à DPI_MAITRE (largeur d'origine), conservée sur disque :
+    pixels RGB bruts, dimensions et aperçu de la page de garde. Les tranches du même livre à une résolution de
+    DPI_DERIVES en sont tirées sans relire ni redimensionner l'image source (voir generer_tranches_depuis_maitre).
+    Produite par preparer_image_maitre.
+    """
+
+    def __init__(self, dossier):
+        self.dossier = dossier
+        with open(os.path.join(dossier, NOM_FICHIER_INDEX_MAITRE), encoding='utf-8') as f:
+            index = json.load(f)
+        self.largeur_pixels = index['largeur']
+        self.hauteur_pixels = index['hauteur']
+        self.dpi = index['dpi']
+        self.hauteur_livre_mm = index['hauteur_livre_mm']
+        self.hauteur_decodee = index['hauteur_decodee'] # Hauteur de l'image source décodée, avant le redimensionnement
+
+    def charger_apercu(self):
+        return Image.open(os.path.join(self.dossier, NOM_FICHIER_APERCU))
+
+    def image_a_la_hauteur_du_livre(self, dpi_utilise):
+        """
+        L'image à la hauteur du livre pour dpi_utilise, diviseur de la résolution de l'image maître :
+        chaque ligne est la moyenne d'autant de lignes consécutives de l'image maître que le facteur de réduction.
+        Les colonnes sont réduites comme generer_tranches_en_flux réduirait l'image source pour cette hauteur
+        (voir _charger_image_source) : même largeur de travail, donc même coût du découpage.
+
+        Returns:
+            tuple: (image PIL RGB, erreur_message)
+        """
+        if dpi_utilise <= 0 or self.dpi % dpi_utilise:
+            return None, f"Erreur: La résolution de {dpi_utilise} DPI ne peut pas être tirée de l'image maître ({self.dpi} DPI)."
+        facteur = self.dpi // dpi_utilise
+        # Même arrondi que generer_tranches_en_flux : l'image maître peut avoir une ou deux lignes de plus ou de moins
+        # que facteur x hauteur, la dernière ligne est alors répétée (ou les lignes en trop ignorées)
+        hauteur_pixels = int(round((self.hauteur_livre_mm / 25.4) * dpi_utilise))
+        facteur_colonnes = max(1, self.hauteur_decodee // hauteur_pixels)
+        largeur_pixels = math.ceil(self.largeur_pixels / facteur_colonnes)
+        # Colonnes moyennées par groupes de facteur_colonnes ; la dernière est répétée pour compléter le dernier groupe
+        index_colonnes = np.minimum(np.arange(largeur_pixels * facteur_colonnes), self.largeur_pixels - 1)
+
+        with open(os.path.join(self.dossier, NOM_FICHIER_PIXELS_MAITRE), 'rb') as f:
+            projection = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pixels_maitre = np.frombuffer(projection, dtype=np.uint8).reshape(self.hauteur_pixels, self.largeur_pixels, 3)
+            pixels = np.empty((hauteur_pixels, largeur_pixels, 3), dtype=np.uint8)
+            # Par blocs de lignes, comme les bandes de FluxTranches : les sommes intermédiaires restent petites
+            lignes_par_bloc = max(1, OCTETS_MAX_PAR_BANDE // (self.largeur_pixels * 3 * facteur))
+            diviseur = facteur * facteur_colonnes
+            for debut in range(0, hauteur_pixels, lignes_par_bloc):
+                fin = min(debut + lignes_par_bloc, hauteur_pixels)
+                index_lignes = np.minimum(np.arange(debut * facteur, fin * facteur), self.hauteur_pixels - 1)
+                sommes = pixels_maitre[index_lignes].reshape(fin - debut, facteur, self.largeur_pixels, 3).sum(axis=1, dtype=np.uint16)
+                if facteur_colonnes > 1:
+                    sommes = sommes[:, index_colonnes].reshape(fin - debut, largeur_pixels, facteur_colonnes, 3).sum(axis=2, dtype=np.uint16)
+                pixels[debut:fin] = (sommes + diviseur // 2) // diviseur
+            del pixels_maitre
+        finally:
+            projection.close()
+        return Image.fromarray(pixels), None
+
+
+def preparer_image_maitre(chemin_image_source, hauteur_livre_mm, dossier_maitre, progress_callback, budget_memoire_mo=None, mesures=None):
+    """
+    Charge l'image source, la ramène à la hauteur du livre à DPI_MAITRE et l'enregistre dans dossier_maitre (créé si besoin)
+    avec l'aperçu de la page de garde. L'index est écrit en dernier : un dossier sans index est incomplet.
+
+    Returns:
+        tuple: (image_maitre, erreur_message)
+                image_maitre (ImageMaitre or None): L'image maître enregistrée.
+                erreur_message (str or None): Message d'erreur si une erreur survient.
+    """
+    if mesures is None:
+        mesures = MesuresRendu()
+    hauteur_livre_pixels = int(round((hauteur_livre_mm / 25.4) * DPI_MAITRE))
+    img_hauteur_livre, hauteur_decodee, apercu, erreur = _image_a_la_hauteur_du_livre(chemin_image_source, hauteur_livre_pixels,
+                                                                                       progress_callback, budget_memoire_mo, mesures)
+    if erreur:
+        return None, erreur
+
+    try:
+        with mesures.etape('redimensionnement'):
+            os.makedirs(dossier_maitre, exist_ok=True)
+            apercu.save(os.path.join(dossier_maitre, NOM_FICHIER_APERCU), format="JPEG", quality=90)
+            # Écriture par blocs de lignes : pas de copie complète des pixels en mémoire
+            lignes_par_bloc = max(1, OCTETS_MAX_PAR_BANDE // (img_hauteur_livre.width * 3))
+            with open(os.path.join(dossier_maitre, NOM_FICHIER_PIXELS_MAITRE), 'wb') as f:
+                for debut in range(0, img_hauteur_livre.height, lignes_par_bloc):
+                    fin = min(debut + lignes_par_bloc, img_hauteur_livre.height)
+                    f.write(img_hauteur_livre.crop((0, debut, img_hauteur_livre.width, fin)).tobytes())
+            index = {'largeur': img_hauteur_livre.width, 'hauteur': img_hauteur_livre.height, 'dpi': DPI_MAITRE,
+                     'hauteur_livre_mm': hauteur_livre_mm, 'hauteur_decodee': hauteur_decodee}
+            with open(os.path.join(dossier_maitre, NOM_FICHIER_INDEX_MAITRE), 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+    except OSError as e:
+        return None, f"Erreur d'enregistrement: Impossible d'enregistrer l'image maître : {e}"
+
+    return ImageMaitre(dossier_maitre), None
+
+
+def generer_tranches_depuis_maitre(image_maitre, nombre_pages_livre, dpi_utilise, largeur_tranche_etiree_cible_mm, progress_callback,
+                                   nombre_processus=1, mesures=None):
+    """
+    Comme generer_tranches_en_flux, mais à partir d'une ImageMaitre (hauteur du livre comprise) : l'image source
+    n'est ni relue ni redimensionnée, seule la réduction d'un facteur entier vers dpi_utilise est calculée.
+
+    Returns:
+        tuple: (flux_tranches, erreur_message)
+    """
+    if mesures is None:
+        mesures = MesuresRendu()
+    if progress_callback:
+        progress_callback(15, f"Préparation de l'image à {dpi_utilise} DPI...")
+
+    with mesures.etape('redimensionnement'):
+        img_hauteur_livre, erreur = image_maitre.image_a_la_hauteur_du_livre(dpi_utilise)
+    if erreur:
+        return None, erreur
+    mesures.ajouter_octets('redimensionnement', img_hauteur_livre.width * img_hauteur_livre.height * 3)
+
+    largeur_pixels_cible_par_tranche_etiree = int(round((largeur_tranche_etiree_cible_mm / 25.4) * dpi_utilise))
+    return FluxTranches(img_hauteur_livre, math.ceil(nombre_pages_livre / 2), largeur_pixels_cible_par_tranche_etiree,
+                        img_hauteur_livre.height, nombre_processus=nombre_processus, apercu=image_maitre.charger_apercu(),
+                        mesures=mesures), None
+
+
+def generer_simulation_tranche(chemin_image_source, hauteur_livre_mm, nombre_pages_livre, chemin_sortie,
+                               dpi_simulation=DPI_SIMULATION_TRANCHE, budget_memoire_mo=None):
+    """
+    Simule la tranche du livre éventé telle qu'elle apparaîtra une fois imprimée, à résolution d'écran :
+    chaque feuille montre la part de l'image de sa tranche, côte à côte sur la hauteur du livre.
+    Permet de vérifier la géométrie (hauteur, nombre de feuilles) en une fraction de seconde, sans générer le PDF.
+
+    Args:
+        chemin_image_source (str or file): Chemin ou fichier ouvert de l'image source.
+        hauteur_livre_mm (float): Hauteur du livre en millimètres.
+        nombre_pages_livre (int): Nombre total de pages (une tranche par feuille, soit deux pages).
+        chemin_sortie (str): Chemin du JPEG de simulation à écrire.
+        dpi_simulation (int): Résolution de la simulation (72 à 96 pour un écran).
+        budget_memoire_mo (int, optional): Mémoire maximale pour décoder l'image source.
+
+    Returns:
+        tuple: (chemin_sortie, erreur_message)
+    """
+    nombre_tranches = math.ceil(nombre_pages_livre / 2)
+    hauteur_pixels = max(1, int(round((hauteur_livre_mm / 25.4) * dpi_simulation)))
+
+    try:
+        img, erreur = _charger_image_source(chemin_image_source, hauteur_pixels,
+                                            budget_memoire_mo if budget_memoire_mo is not None else BUDGET_MEMOIRE_DECODAGE_MO)
+        if erreur:
+            return None, erreur
+    except Exception as e:
+        return None, f"Erreur: Erreur lors du chargement de l'image : {e}"
+
+    # La tranche éventée garde les proportions de l'image, ramenée à la hauteur du livre
+    largeur_pixels = max(1, round(img.width * hauteur_pixels / img.height))
+
+    # Une colonne par feuille, filtrée comme le découpage (LANCZOS sur la part de l'image de chaque tranche),
+    # puis répétée sur la largeur visible de la feuille
+    colonnes_tranches = np.asarray(img.resize((nombre_tranches, hauteur_pixels), Image.LANCZOS))
+    index_tranche_par_colonne = (np.arange(largeur_pixels) * nombre_tranches) // largeur_pixels
+    pixels = np.take(colonnes_tranches, index_tranche_par_colonne, axis=1)
+
+    # Bord de chaque feuille légèrement assombri, quand les feuilles sont assez larges pour qu'on les distingue
+    if largeur_pixels >= 4 * nombre_tranches:
+        colonnes_bords = np.flatnonzero(np.diff(index_tranche_par_colonne)) + 1
+        pixels[:, colonnes_bords] = (pixels[:, colonnes_bords] * 0.8).astype(np.uint8)
+
+    try:
+        Image.fromarray(pixels).save(chemin_sortie, quality=85)
+    except Exception as e:
+        return None, f"Erreur lors de l'enregistrement de la simulation : {e}"
+    return chemin_sortie, None
+
+
+def generer_tranches_individuelles(chemin_image_source, hauteur_livre_mm, nombre_pages_livre, dpi_utilise, largeur_tranche_etiree_cible_mm, progress_callback,
+                                   nombre_processus=1, budget_memoire_mo=None, dossier_tranches_genere=None, format_tranches='png', mesures=None):
     """
     Génère des images individuelles pour chaque tranche de feuille de papier dans un dossier.
     L'image source est redimensionnée à la hauteur du livre (proportionnellement),
     puis découpée en tranches de largeur originale.
     Chaque tranche est ENSUITE étirée individuellement pour correspondre à la largeur_tranche_etiree_cible_mm.
+    Pour éviter l'écriture des fichiers, voir generer_tranches_en_flux.
 
     Args:
         chemin_image_source (str): Chemin d'accès complet à l'image source.
@@ -20,118 +545,596 @@ def generer_tranches_individuelles(chemin_image_source, hauteur_livre_mm, nombre
         largeur_tranche_etiree_cible_mm (float): La largeur physique que chaque tranche doit avoir après étirement (en mm).
                                                  C'est à cette largeur que chaque tranche sera étirée.
         progress_callback (callable): Fonction de rappel pour mettre à jour la barre de progression. (sera un lambda vide pour le web)
+        nombre_processus (int): Nombre de processus de calcul des tranches (1 = calcul dans le processus courant).
+                                Les tranches restent produites dans l'ordre quel que soit ce nombre.
+        budget_memoire_mo (int or None): Mémoire maximale pour décoder l'image source (défaut : BUDGET_MEMOIRE_DECODAGE_MO).
+                                         Un JPEG trop grand est décodé plus petit ; les autres formats sont refusés.
+        dossier_tranches_genere (str or None): Dossier où écrire les tranches (créé si besoin), à supprimer par l'appelant.
+                                               Par défaut, un dossier temporaire du système (jamais à côté de l'image source).
+        format_tranches (str): 'png' : un fichier PNG par tranche ; 'brut' : les pixels RGB de toutes les tranches
+                               dans un seul fichier, lu par projection en mémoire (voir TranchesBrutes). Sans compression
+                               ni milliers de petits fichiers : adapté aux livres très épais, au prix de plus d'espace disque.
+        mesures (MesuresRendu, optional): Reçoit les durées et volumes des étapes chargement, redimensionnement et
+                                          decoupage (calcul et écriture des tranches).
 
     Returns:
         tuple: (chemin_dossier_tranches, erreur_message)
                 chemin_dossier_tranches (str or None): Chemin du dossier créé pour les tranches.
                 erreur_message (str or None): Message d'erreur si une erreur survient.
     """
+    flux_tranches, erreur = generer_tranches_en_flux(chemin_image_source, hauteur_livre_mm, nombre_pages_livre, dpi_utilise,
+                                                     largeur_tranche_etiree_cible_mm, progress_callback, nombre_processus=nombre_processus,
+                                                     budget_memoire_mo=budget_memoire_mo, mesures=mesures)
+    if erreur:
+        return None, erreur
+    if format_tranches not in FORMATS_TRANCHES:
+        return None, f"Erreur: Format de tranches inconnu : '{format_tranches}'. Formats disponibles : {', '.join(FORMATS_TRANCHES)}."
+
     nombre_tranches_reelles = math.ceil(nombre_pages_livre / 2)
 
-    if progress_callback:
-        progress_callback(5, "Chargement de l'image source...")
+    # C'est la responsabilité de l'appelant (app.py) de passer `dossier_tranches_genere` et de le supprimer.
+    # Pour le test autonome de cette fonction, les tranches vont dans un dossier temporaire du système :
+    # jamais à côté de l'image source, où personne ne les supprimerait.
+    if dossier_tranches_genere is not None:
+        os.makedirs(dossier_tranches_genere, exist_ok=True)
+        chemin_complet_dossier_tranches = dossier_tranches_genere
+    else:
+        chemin_complet_dossier_tranches = tempfile.mkdtemp(prefix="tranches_")
 
+    # Tranches partielles inutilisables : supprimées ici, l'appelant ne reçoit pas le chemin du dossier
     try:
-        img_originale = Image.open(chemin_image_source).convert("RGB")
-    except FileNotFoundError:
-        return None, f"Erreur: L'image source n'a pas été trouvée à l'emplacement :\n{chemin_image_source}"
+        # Calcul des bandes (compté dans 'decoupage' par FluxTranches) et écriture des fichiers : même étape
+        with flux_tranches.mesures.etape('decoupage'):
+            chemin_dossier, erreur = _enregistrer_tranches_individuelles(flux_tranches, chemin_complet_dossier_tranches, nombre_tranches_reelles,
+                                                                          progress_callback, format_tranches)
+    except Exception:
+        shutil.rmtree(chemin_complet_dossier_tranches, ignore_errors=True)
+        raise
+    if erreur:
+        shutil.rmtree(chemin_complet_dossier_tranches, ignore_errors=True)
+    return chemin_dossier, erreur
+
+
+def _enregistrer_tranches_individuelles(flux_tranches, chemin_complet_dossier_tranches, nombre_tranches_reelles, progress_callback, format_tranches='png'):
+    """Écrit l'aperçu de la page de garde et les tranches (PNG ou pixels bruts). Retourne (chemin_dossier_tranches, erreur_message)."""
+    try:
+        flux_tranches.apercu.save(os.path.join(chemin_complet_dossier_tranches, NOM_FICHIER_APERCU), format="JPEG", quality=90)
     except Exception as e:
-        return None, f"Erreur: Erreur lors du chargement de l'image : {e}"
+        return None, f"Erreur d'enregistrement: Impossible d'enregistrer l'aperçu de la page de garde : {e}"
 
     if progress_callback:
-        progress_callback(15, "Redimensionnement de l'image à la hauteur du livre (proportionnellement pour la découpe)...")
+        progress_callback(30, f"Découpage et enregistrement de {nombre_tranches_reelles} tranches individuelles...")
 
-    # Calcul de la hauteur en pixels pour la hauteur du livre demandée - C'est la hauteur que TOUTES les tranches DOIVENT avoir
-    hauteur_livre_pixels = int(round((hauteur_livre_mm / 25.4) * dpi_utilise))
+    if format_tranches == 'brut':
+        return _enregistrer_tranches_brutes(flux_tranches, chemin_complet_dossier_tranches, nombre_tranches_reelles, progress_callback)
 
-    # Redimensionner l'image originale pour que sa hauteur corresponde EXACTEMENT à hauteur_livre_pixels.
-    # La largeur sera ajustée proportionnellement.
-    ratio_img_originale = img_originale.width / img_originale.height
-    largeur_img_redimensionnee_hauteur = int(round(hauteur_livre_pixels * ratio_img_originale))
+    for i, (numero_tranche, tranche_etiree_pour_impression) in enumerate(flux_tranches):
+        nom_fichier_tranche = f"tranche_{numero_tranche:05d}.png"
+        chemin_fichier_tranche = os.path.join(chemin_complet_dossier_tranches, nom_fichier_tranche)
 
-    # L'image redimensionnée pour la découpe a maintenant la hauteur exacte désirée.
-    img_redimensionnee_pour_decoupage = img_originale.resize((largeur_img_redimensionnee_hauteur, hauteur_livre_pixels), Image.LANCZOS)
+        try:
+            tranche_etiree_pour_impression.save(chemin_fichier_tranche, format="PNG")
+        except Exception as e:
+            return None, f"Erreur d'enregistrement: Impossible d'enregistrer la tranche {numero_tranche} : {e}"
 
-    # Largeur de chaque tranche à découper de l'image redimensionnée
-    largeur_pixels_par_tranche_a_decouper = img_redimensionnee_pour_decoupage.width / nombre_tranches_reelles
 
-    # Largeur cible en pixels pour chaque tranche après étirement individuel
-    largeur_pixels_cible_par_tranche_etiree = int(round((largeur_tranche_etiree_cible_mm / 25.4) * dpi_utilise))
+        if progress_callback and (i % (max(1, nombre_tranches_reelles // 100)) == 0 or numero_tranche == nombre_tranches_reelles):
+            progress_val = 30 + int(40 * (i / nombre_tranches_reelles))
+            progress_callback(progress_val, f"Enregistrement de la tranche {numero_tranche}/{nombre_tranches_reelles}...")
 
-    # Le dossier des tranches sera créé à l'intérieur du dossier des uploads pour faciliter le nettoyage
-    # C'est la responsabilité de `app.py` de créer `dossier_tranches_genere` et de le passer ici.
-    # Pour le test autonome de cette fonction ou si le chemin n'est pas passé par Flask,
-    # nous allons créer un dossier temporaire ici. En utilisation normale avec Flask,
-    # le chemin sera fourni par Flask et ce code sera ignoré.
-    temp_dir_for_slices_base = os.path.join(os.path.dirname(chemin_image_source), f"temp_tranches_for_{os.path.basename(chemin_image_source).split('.')[0]}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
-    os.makedirs(temp_dir_for_slices_base, exist_ok=True)
-    chemin_complet_dossier_tranches = temp_dir_for_slices_base
+    return chemin_complet_dossier_tranches, None
 
 
-    if progress_callback:
-        progress_callback(30, f"Découpage et enregistrement de {nombre_tranches_reelles} tranches individuelles...")
+def _enregistrer_tranches_brutes(flux_tranches, chemin_complet_dossier_tranches, nombre_tranches_reelles, progress_callback):
+    """
+    Écrit les pixels RGB des tranches à la suite dans un seul fichier (écriture séquentielle, une tranche en mémoire
+    à la fois), puis l'index, écrit en dernier : un dossier sans index est incomplet.
+    """
+    decalages = []
+    position = 0
+    try:
+        with open(os.path.join(chemin_complet_dossier_tranches, NOM_FICHIER_PIXELS_TRANCHES), 'wb') as f:
+            for i, (numero_tranche, pixels) in enumerate(flux_tranches.tranches_brutes()):
+                # Vue d'une bande (non contiguë) : recopiée dans l'ordre ligne par ligne de la tranche seule
+                f.write(np.ascontiguousarray(pixels))
+                decalages.append(position)
+                position += pixels.nbytes
+
+                if progress_callback and (i % (max(1, nombre_tranches_reelles // 100)) == 0 or numero_tranche == nombre_tranches_reelles):
+                    progress_val = 30 + int(40 * (i / nombre_tranches_reelles))
+                    progress_callback(progress_val, f"Enregistrement de la tranche {numero_tranche}/{nombre_tranches_reelles}...")
+
+        index = {'largeur': flux_tranches.largeur_pixels_cible, 'hauteur': flux_tranches.hauteur_pixels, 'decalages': decalages}
+        with open(os.path.join(chemin_complet_dossier_tranches, NOM_FICHIER_INDEX_PIXELS), 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+    except OSError as e:
+        return None, f"Erreur d'enregistrement: Impossible d'enregistrer les pixels des tranches : {e}"
+
+    return chemin_complet_dossier_tranches, None
+
+
+# --- Partie 2: Logique de génération du PDF ---
+class _LecteurTrancheBrute(ImageReader):
+    """
+    ImageReader ReportLab alimenté directement par les pixels RGB d'une tranche (vue NumPy)
+    ou d'un atlas de tranches, sans passer par une image PIL intermédiaire.
+    """
 
-    for i in range(nombre_tranches_reelles):
-        left = int(i * largeur_pixels_par_tranche_a_decouper)
-        upper = 0
-        right = int((i + 1) * largeur_pixels_par_tranche_a_decouper)
-        lower = hauteur_livre_pixels # La hauteur de découpe est la hauteur du livre en pixels
+    def __init__(self, nom_tranche, pixels):
+        self._ident = None
+        self.fileName = nom_tranche
+        self.fp = None
+        self._image = None
+        self._height, self._width = pixels.shape[:2]
+        self._transparent = None
+        self.mode = 'RGB'
+        self._data = pixels.tobytes()
+        self._dataA = None
 
-        if right > img_redimensionnee_pour_decoupage.width:
-            right = img_redimensionnee_pour_decoupage.width
 
-        if right <= left:
-            print(f"Avertissement: Largeur de tranche initiale pour la tranche {i+1} est trop petite ({right-left} pixels). Ignorée.")
-            continue
+# Filtres PDF correspondant aux filtres des profils d'encodage
+FILTRES_PDF = {'jpeg': ('DCTDecode',), 'flate': ('FlateDecode',), 'brut': ()}
 
-        tranche_decoupee_originale_proportions = img_redimensionnee_pour_decoupage.crop((left, upper, right, lower))
 
-        # Étirer chaque tranche à la largeur cible, EN FORÇANT LA HAUTEUR à hauteur_livre_pixels.
-        tranche_etiree_pour_impression = tranche_decoupee_originale_proportions.resize((largeur_pixels_cible_par_tranche_etiree, hauteur_livre_pixels), Image.LANCZOS)
+def _encoder_pixels(pixels, filtre, niveau):
+    """Encode des pixels RGB (h, w, 3) selon un filtre de profil : données prêtes pour le flux d'une image PDF."""
+    if filtre == 'jpeg':
+        tampon = io.BytesIO()
+        # Pas de sous-échantillonnage de la chrominance : les tranches sont étroites et destinées à l'impression
+        Image.fromarray(np.ascontiguousarray(pixels)).save(tampon, 'JPEG', quality=niveau, subsampling=0)
+        return tampon.getvalue()
+    if filtre == 'flate':
+        # Une tranche contiguë (TranchesBrutes) est compressée directement depuis sa projection, sans copie
+        return zlib.compress(pixels if pixels.flags.c_contiguous else pixels.tobytes(), niveau)
+    return pixels.tobytes()
 
-        nom_fichier_tranche = f"tranche_{i+1:05d}.png"
-        chemin_fichier_tranche = os.path.join(chemin_complet_dossier_tranches, nom_fichier_tranche)
 
+class _ImageTrancheEncodee(pdfdoc.PDFImageXObject):
+    """
+    Image XObject d'une tranche (ou d'un atlas) déjà encodée selon un profil explicite (voir _encoder_pixels).
+    Contrairement à drawImage, pas d'empreinte MD5 des pixels ni d'encodage ASCII85 (+25 % de taille).
+    """
+
+    def __init__(self, nom_image, largeur, hauteur, donnees, filtre):
+        super().__init__(nom_image)
+        self.width, self.height = largeur, hauteur
+        self.bitsPerComponent = 8
+        self.colorSpace = 'DeviceRGB'
+        self.mask = None
+        self.streamContent = donnees
+        self._filters = FILTRES_PDF[filtre]
+
+
+def _lire_profil_encodage(profil_encodage):
+    """
+    Valide un profil d'encodage : nom de PROFILS_ENCODAGE_PDF ou couple (filtre, niveau).
+
+    Returns:
+        tuple: ((filtre, niveau), erreur_message)
+    """
+    if isinstance(profil_encodage, str):
+        if profil_encodage not in PROFILS_ENCODAGE_PDF:
+            return None, f"Erreur: Profil d'encodage inconnu '{profil_encodage}'."
+        return PROFILS_ENCODAGE_PDF[profil_encodage], None
+
+    filtre, niveau = profil_encodage
+    if filtre == 'flate' and niveau in range(0, 10):
+        return (filtre, niveau), None
+    if filtre == 'jpeg' and niveau in range(1, 96):
+        return (filtre, niveau), None
+    if filtre == 'brut':
+        return (filtre, None), None
+    return None, f"Erreur: Profil d'encodage invalide {profil_encodage!r} (flate 0-9, jpeg 1-95 ou brut)."
+
+
+def _encoder_page_tranches(pixels_tranches, filtre, niveau):
+    """Encode les tranches d'une page PDF (exécuté dans un processus de l'assemblage en parallèle)."""
+    return [_encoder_pixels(pixels, filtre, niveau) for pixels in pixels_tranches]
+
+
+def _dessiner_image_encodee(c, nom_image, pixels, x, y, largeur, hauteur, filtre, niveau):
+    """Place des pixels RGB (h, w, 3) dans le PDF comme drawImage, mais encodés selon le profil demandé. Retourne l'image XObject."""
+    image_xobject = _ImageTrancheEncodee(nom_image, pixels.shape[1], pixels.shape[0], _encoder_pixels(pixels, filtre, niveau), filtre)
+    return _placer_image_xobject(c, nom_image, image_xobject, x, y, largeur, hauteur)
+
+
+def _placer_image_xobject(c, nom_image, image_xobject, x, y, largeur, hauteur):
+    """Ajoute une image XObject au document et la place dans le rectangle donné. Retourne l'image XObject."""
+    c._doc.addForm(nom_image, image_xobject)
+    c.saveState()
+    c.translate(x, y)
+    c.scale(largeur, hauteur)
+    c._code.append(f"/{c._doc.getXObjectName(nom_image)} Do")
+    c.restoreState()
+    c._formsinuse.append(nom_image)
+    return image_xobject
+
+
+class _SortiePDFInterrompue(Exception):
+    """Écriture du PDF impossible (disque plein, téléchargement direct interrompu par le client...)."""
+
+
+def _sortie_pdf_interrompue_en_erreur(generer_pdf):
+    """Une écriture du PDF qui échoue en cours d'assemblage arrête celui-ci et devient un retour (None, erreur_message)."""
+    @functools.wraps(generer_pdf)
+    def generer_pdf_ou_erreur(*args, **kwargs):
         try:
-            tranche_etiree_pour_impression.save(chemin_fichier_tranche, format="PNG")
-        except Exception as e:
-            return None, f"Erreur d'enregistrement: Impossible d'enregistrer la tranche {i+1} : {e}"
+            return generer_pdf(*args, **kwargs)
+        except _SortiePDFInterrompue as e:
+            return None, f"Erreur lors de l'écriture du PDF : {e}"
+    return generer_pdf_ou_erreur
 
 
-        if progress_callback and (i % (max(1, nombre_tranches_reelles // 100)) == 0 or i == nombre_tranches_reelles - 1):
-            progress_val = 30 + int(40 * (i / nombre_tranches_reelles))
-            progress_callback(progress_val, f"Enregistrement de la tranche {i+1}/{nombre_tranches_reelles}...")
+class _EcriturePDFIncrementale:
+    """
+    Écrit le document d'un canvas ReportLab au fil des pages, au lieu de tout sérialiser en mémoire à c.save().
+
+    vider(), appelé après chaque showPage(), écrit les objets déjà complets (page, contenu, images, gabarits) et les
+    libère ; les objets modifiés jusqu'à la fin (catalogue, arbre des pages, dictionnaire des polices, informations)
+    sont écrits par terminer(), suivis de la table de références croisées et du trailer, comme le fait ReportLab.
+    La sortie est un chemin (fichier complété à chaque vidage) ou un objet disposant de write().
+    L'en-tête n'est écrit qu'avec la première page : une erreur avant celle-ci ne laisse aucun fichier tronqué.
+    Une écriture qui échoue (OSError) lève _SortiePDFInterrompue.
+    """
 
-    return chemin_complet_dossier_tranches, None
+    def __init__(self, c, sortie):
+        self.c = c
+        self.doc = c._doc
+        self.sortie = sortie
+        self._objet_suivant = 1 # Numéro du prochain objet ReportLab à examiner
+        self._objets_differes = []
+        self.doc.encrypt.prepare(self.doc)
+        self._entete = pdfdoc.PDFFile(self.doc._pdfVersion).format(self.doc)
+        self.position = len(self._entete) # Position du prochain objet dans le fichier (en-tête compris, même non encore écrit)
+
+    def _ecrire(self, morceaux):
+        donnees = b''.join(morceaux)
+        if not donnees:
+            return
+        self.position += len(donnees)
+        premier_vidage = self._entete is not None
+        if premier_vidage:
+            donnees, self._entete = self._entete + donnees, None
+        try:
+            if hasattr(self.sortie, 'write'):
+                self.sortie.write(donnees)
+            else:
+                with open(self.sortie, 'wb' if premier_vidage else 'ab') as f:
+                    f.write(donnees)
+        except OSError as e:
+            raise _SortiePDFInterrompue(e) from e
+
+    def _est_differe(self, objet):
+        doc = self.doc
+        return any(objet is objet_final for objet_final in (doc.Catalog, doc.Pages, doc.info, doc.Outlines, doc.idToObject[pdfdoc.BasicFonts]))
+
+    def _formater(self, nom, morceaux, position):
+        """Formate un objet ; les objets qu'il référence pour la première fois reçoivent un numéro et seront écrits ensuite."""
+        self.doc.idToOffset[nom] = position
+        donnees = pdfdoc.PDFIndirectObject(nom, self.doc.idToObject[nom]).format(self.doc)
+        morceaux.append(donnees)
+        return position + len(donnees)
+
+    def vider(self, tout=False):
+        """Écrit les objets enregistrés depuis le dernier vidage (tous, différés compris, si tout=True)."""
+        doc = self.doc
+        morceaux, position = [], self.position
+        if tout:
+            differes, self._objets_differes = self._objets_differes, []
+            for nom in differes:
+                position = self._formater(nom, morceaux, position)
+        while self._objet_suivant in doc.numberToId:
+            nom = doc.numberToId[self._objet_suivant]
+            self._objet_suivant += 1
+            if not tout and self._est_differe(doc.idToObject[nom]):
+                self._objets_differes.append(nom)
+                continue
+            position = self._formater(nom, morceaux, position)
+            doc.idToObject[nom] = None # Déjà écrit : ses données (images) ne restent pas en mémoire jusqu'à la fin
+        self._ecrire(morceaux)
+
+    def terminer(self):
+        """Équivalent de c.save() : dernière page, objets restants, table de références croisées et trailer."""
+        c, doc = self.c, self.doc
+        if len(c._code):
+            c.showPage()
+        # Préparation finale de ReportLab (PDFDocument.GetPDFData puis format)
+        for police in doc.delayedFonts:
+            police.addObjects(doc)
+        doc.info.invariant = doc.invariant
+        doc.info.digest(doc.signature)
+        reference_catalogue, reference_infos = doc.Reference(doc.Catalog), doc.Reference(doc.info)
+        doc.Outlines.prepare(doc, c)
+        if doc.Outlines.ready < 0:
+            doc.Catalog.Outlines = None
+        infos_chiffrement = doc.encrypt.info()
+        reference_chiffrement = doc.Reference(infos_chiffrement) if infos_chiffrement else None
+        self.vider(tout=True)
+
+        # Les objets ne sont pas dans l'ordre de leurs numéros : la table donne la position de chacun
+        noms_objets = [doc.numberToId[numero] for numero in range(1, len(doc.numberToId) + 1)]
+        table_references = pdfdoc.PDFCrossReferenceTable()
+        table_references.addsection(0, noms_objets)
+        donnees_table = table_references.format(doc)
+        trailer = pdfdoc.PDFTrailer(startxref=self.position, Size=len(noms_objets) + 1, Root=reference_catalogue,
+                                    Info=reference_infos, Encrypt=reference_chiffrement, ID=doc.ID())
+        self._ecrire([donnees_table, trailer.format(doc)])
+        doc._savedToFile = True
+
+
+class _TranchesFluxBrutes:
+    """Adapte un FluxTranches (ou des TranchesBrutes) pour le PDF : chaque tranche est passée à ReportLab sous forme de pixels bruts."""
+
+    def __init__(self, flux_tranches, pixels_bruts=False):
+        self.flux_tranches = flux_tranches
+        self.pixels_bruts = pixels_bruts
+
+    def __len__(self):
+        return len(self.flux_tranches)
+
+    def __iter__(self):
+        for numero_tranche, pixels in self.flux_tranches.tranches_brutes():
+            if self.pixels_bruts:
+                yield numero_tranche, pixels
+            else:
+                yield numero_tranche, _LecteurTrancheBrute(f"tranche_{numero_tranche:05d}", pixels)
+
+
+class _TranchesDossier:
+    """Tranches lues depuis un dossier de fichiers PNG (API historique), sous la même forme qu'un FluxTranches."""
+
+    def __init__(self, dossier_tranches_source, fichiers_tranches, pixels_bruts=False):
+        self.dossier_tranches_source = dossier_tranches_source
+        self.fichiers_tranches = fichiers_tranches
+        self.pixels_bruts = pixels_bruts
+
+    def __len__(self):
+        return len(self.fichiers_tranches)
+
+    def __iter__(self):
+        for fichier_tranche in self.fichiers_tranches:
+            chemin_tranche = os.path.join(self.dossier_tranches_source, fichier_tranche)
+            if self.pixels_bruts:
+                with Image.open(chemin_tranche) as img_tranche:
+                    yield fichier_tranche, np.asarray(img_tranche.convert("RGB"))
+            else:
+                # ImageReader accepte aussi bien un chemin qu'une image PIL
+                yield fichier_tranche, chemin_tranche
+
+
+class TranchesBrutes:
+    """
+    Pixels RGB de toutes les tranches, à la suite dans un seul fichier (tranches_brutes() de FluxTranches enregistré
+    par generer_tranches_individuelles avec format_tranches='brut'), et un index : dimensions et position de chaque tranche.
+    Le fichier est projeté en mémoire : chaque tranche est lue sous forme de vue NumPy, sans copie ni décodage,
+    et seules les tranches en cours d'utilisation occupent la mémoire, quelle que soit l'épaisseur du livre.
+    """
+
+    def __init__(self, dossier):
+        self.dossier = dossier
+        with open(os.path.join(dossier, NOM_FICHIER_INDEX_PIXELS), encoding='utf-8') as f:
+            index = json.load(f)
+        self.largeur_pixels = index['largeur']
+        self.hauteur_pixels = index['hauteur']
+        self.decalages = index['decalages']
+
+    def __len__(self):
+        return len(self.decalages)
+
+    def __iter__(self):
+        return self.tranches_brutes()
+
+    def tranches_brutes(self):
+        """
+        Parcourt les tranches sous forme de vues NumPy (hauteur, largeur, 3) en uint8 et en lecture seule, sans copie.
+        Le fichier est projeté par fenêtres de plusieurs tranches (au plus OCTETS_MAX_PAR_BANDE, comme les bandes
+        de FluxTranches) : une fenêtre est libérée dès que plus aucune vue de ses tranches n'est référencée.
+        """
+        octets_par_tranche = self.largeur_pixels * self.hauteur_pixels * 3
+        tranches_par_fenetre = max(1, OCTETS_MAX_PAR_BANDE // octets_par_tranche)
+        with open(os.path.join(self.dossier, NOM_FICHIER_PIXELS_TRANCHES), 'rb') as f:
+            for debut in range(0, len(self.decalages), tranches_par_fenetre):
+                decalages_fenetre = self.decalages[debut:debut + tranches_par_fenetre]
+                # Une projection commence à un multiple de la granularité d'allocation du système
+                debut_fenetre = decalages_fenetre[0] - decalages_fenetre[0] % mmap.ALLOCATIONGRANULARITY
+                projection = mmap.mmap(f.fileno(), decalages_fenetre[-1] + octets_par_tranche - debut_fenetre,
+                                       access=mmap.ACCESS_READ, offset=debut_fenetre)
+                pixels = np.frombuffer(projection, dtype=np.uint8)
+                del projection # Maintenue par les vues : fermée avec la dernière d'entre elles
+
+                for k, decalage in enumerate(decalages_fenetre):
+                    position = decalage - debut_fenetre
+                    yield debut + k + 1, pixels[position:position + octets_par_tranche].reshape(self.hauteur_pixels, self.largeur_pixels, 3)
+                del pixels
+
+
+class TranchesEncodees:
+    """
+    Jeu de tranches déjà encodées pour le PDF, conservé sur disque pour réassembler un PDF sans redécouper
+    ni réencoder les tranches (changement de numérotation ou de mise en page).
+    Un dossier contient les données encodées de toutes les tranches, concaténées dans l'ordre du livre,
+    leur index (taille de chaque tranche, profil d'encodage, dimensions) et l'aperçu de la page de garde.
+    Produit par generer_pdf_a_partir_tranches (argument dossier_copie_tranches), et accepté par elle
+    à la place d'un dossier de PNG ou d'un FluxTranches.
+    """
+
+    def __init__(self, dossier):
+        self.dossier = dossier
+        with open(os.path.join(dossier, NOM_FICHIER_INDEX_TRANCHES), encoding='utf-8') as f:
+            index = json.load(f)
+        self.filtre = index['filtre']
+        self.niveau = index['niveau']
+        self.largeur_pixels = index['largeur']
+        self.hauteur_pixels = index['hauteur']
+        self.tailles_tranches = index['tailles']
+
+    def __len__(self):
+        return len(self.tailles_tranches)
+
+    def __iter__(self):
+        # Lecture séquentielle : une seule tranche encodée en mémoire à la fois
+        with open(os.path.join(self.dossier, NOM_FICHIER_DONNEES_TRANCHES), 'rb') as f:
+            for numero_tranche, taille in enumerate(self.tailles_tranches, start=1):
+                yield numero_tranche, f.read(taille)
+
+
+class _EcritureTranchesEncodees:
+    """Écrit un jeu de TranchesEncodees au fil de l'assemblage du PDF, avec les données mêmes placées dans le PDF."""
+
+    def __init__(self, dossier, filtre, niveau):
+        self.dossier = dossier
+        self.filtre = filtre
+        self.niveau = niveau
+        self.tailles_tranches = []
+        self.dimensions = None
+        os.makedirs(dossier, exist_ok=True)
+        open(os.path.join(dossier, NOM_FICHIER_DONNEES_TRANCHES), 'wb').close()
+
+    def ajouter(self, donnees, largeur_pixels, hauteur_pixels):
+        # Ouvert à chaque tranche : rien à refermer si l'assemblage s'interrompt
+        with open(os.path.join(self.dossier, NOM_FICHIER_DONNEES_TRANCHES), 'ab') as f:
+            f.write(donnees)
+        self.tailles_tranches.append(len(donnees))
+        self.dimensions = (largeur_pixels, hauteur_pixels)
+
+    def terminer(self, apercu_jpeg):
+        """Enregistre l'aperçu (JPEG de la page de garde, tel quel) puis l'index, écrit en dernier : un jeu sans index est incomplet."""
+        with open(os.path.join(self.dossier, NOM_FICHIER_APERCU), 'wb') as f:
+            f.write(apercu_jpeg)
+        index = {'filtre': self.filtre, 'niveau': self.niveau, 'largeur': self.dimensions[0], 'hauteur': self.dimensions[1],
+                 'tailles': self.tailles_tranches}
+        with open(os.path.join(self.dossier, NOM_FICHIER_INDEX_TRANCHES), 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+
+
+def _apercu_page_garde(dossier_tranches_source, image_source_original_path):
+    """
+    Aperçu de l'image source pour la page de garde : celui préparé lors du découpage (FluxTranches ou fichier
+    du dossier de tranches), sinon l'original relu à taille réduite (un JPEG est décodé directement en petit).
+    """
+    if isinstance(dossier_tranches_source, FluxTranches):
+        if dossier_tranches_source.apercu is not None:
+            return dossier_tranches_source.apercu
+    else:
+        dossier = (dossier_tranches_source.dossier if isinstance(dossier_tranches_source, (TranchesEncodees, TranchesBrutes))
+                   else dossier_tranches_source)
+        chemin_apercu = os.path.join(dossier, NOM_FICHIER_APERCU)
+        if os.path.exists(chemin_apercu):
+            return Image.open(chemin_apercu)
+
+    img_originale = Image.open(image_source_original_path)
+    img_originale.draft('RGB', TAILLE_MAX_APERCU_PIXELS)
+    return _creer_apercu(img_originale.convert("RGB"))
+
+
+def _ouvrir_source_tranches(dossier_tranches_source, pixels_bruts=False):
+    """
+    Normalise la source des tranches du PDF : un dossier de tranches (PNG ou pixels bruts), un FluxTranches,
+    des TranchesBrutes ou des TranchesEncodees (ces dernières s'itèrent en données déjà encodées).
+
+    Args:
+        pixels_bruts (bool): Si True, chaque tranche est fournie en tableau NumPy RGB (h, w, 3) plutôt qu'en source pour ImageReader.
+
+    Returns:
+        tuple: (tranches, erreur_message) où tranches a une longueur et s'itère en (identifiant_tranche, source pour ImageReader).
+    """
+    if isinstance(dossier_tranches_source, FluxTranches):
+        if not len(dossier_tranches_source):
+            return None, "Erreur: Aucune tranche à assembler."
+        return _TranchesFluxBrutes(dossier_tranches_source, pixels_bruts), None
+    if isinstance(dossier_tranches_source, TranchesEncodees):
+        if not len(dossier_tranches_source):
+            return None, "Erreur: Aucune tranche à assembler."
+        return dossier_tranches_source, None
+
+    if os.path.exists(os.path.join(dossier_tranches_source, NOM_FICHIER_INDEX_PIXELS)):
+        dossier_tranches_source = TranchesBrutes(dossier_tranches_source)
+    if isinstance(dossier_tranches_source, TranchesBrutes):
+        if not len(dossier_tranches_source):
+            return None, "Erreur: Aucune tranche à assembler."
+        return _TranchesFluxBrutes(dossier_tranches_source, pixels_bruts), None
+
+    fichiers_tranches = sorted([f for f in os.listdir(dossier_tranches_source) if f.lower().endswith('.png')])
+    if not fichiers_tranches:
+        return None, "Erreur: Aucun fichier PNG trouvé."
+    return _TranchesDossier(dossier_tranches_source, fichiers_tranches, pixels_bruts), None
 
 
-# --- Partie 2: Logique de génération du PDF ---
 # MODIFICATION: Ajout de l'argument 'output_pdf_path' à la signature de la fonction
+@_sortie_pdf_interrompue_en_erreur
 def generer_pdf_a_partir_tranches(dossier_tranches_source, hauteur_livre_mm_pdf, largeur_tranche_etiree_cible_mm_pdf,
                                   debut_numero_tranche, pas_numero_tranche, progress_callback, image_source_original_path, nombre_pages_livre_original,
-                                  output_pdf_path): # NOUVEL ARGUMENT ICI !
-    from reportlab.lib.pagesizes import A4
+                                  output_pdf_path, mode_atlas=False, profil_encodage=None, mesures=None, dossier_copie_tranches=None,
+                                  format_page='A4', nombre_processus_assemblage=1): # NOUVEL ARGUMENT ICI !
+    # 'dossier_tranches_source' est soit un dossier de tranches PNG ou brutes (generer_tranches_individuelles, ou TranchesBrutes),
+    # soit un FluxTranches (generer_tranches_en_flux) consommé directement, sans fichier intermédiaire,
+    # soit des TranchesEncodees d'un assemblage précédent (leur profil d'encodage remplace 'profil_encodage').
+    # 'mode_atlas' : une seule image par page PDF (tranches et marges composées) au lieu d'une image par tranche ;
+    # cadres, repères et numéros restent vectoriels.
+    # 'profil_encodage' : nom de PROFILS_ENCODAGE_PDF ou (filtre, niveau) ; None = encodage par défaut de ReportLab.
+    # 'mesures' : MesuresRendu qui reçoit les étapes page_garde, encodage, assemblage et enregistrement
+    # (par défaut celles du FluxTranches, où le découpage est déjà compté).
+    # 'output_pdf_path' : chemin du PDF, ou flux binaire (objet avec write()) qui reçoit le PDF page par page ;
+    # une écriture qui échoue (flux fermé par le client, disque plein) arrête l'assemblage avec une erreur.
+    # 'dossier_copie_tranches' : si fourni, les tranches encodées y sont aussi écrites (TranchesEncodees réutilisables
+    # pour une autre mise en page des mêmes tranches) ; demande un profil d'encodage, hors mode atlas.
+    # 'format_page' : nom de FORMATS_PAGE_PDF ; autant de lignes de tranches par page que la hauteur du livre le permet.
+    # 'nombre_processus_assemblage' : au-delà de 1, les images des pages suivantes sont encodées en parallèle dans un pool
+    # de processus pendant que la page courante est assemblée ; demande un profil d'encodage, hors mode atlas
+    # (sinon, ou avec des TranchesEncodees déjà encodées, l'assemblage reste séquentiel).
     from reportlab.lib.units import mm
     from reportlab.pdfgen import canvas
-    from reportlab.lib.utils import ImageReader
     from reportlab.lib.colors import black
 
 
-    if progress_callback:
-        progress_callback(75, "Vérification des tranches pour le PDF...")
+    # En mode flux, le découpage a lieu pendant l'assemblage : la progression de l'assemblage couvre les deux étapes.
+    en_flux = isinstance(dossier_tranches_source, FluxTranches)
+    if mesures is None:
+        mesures = dossier_tranches_source.mesures if en_flux else MesuresRendu()
+    debut_progression_assemblage, amplitude_progression_assemblage = (30, 65) if en_flux else (80, 15)
 
-    fichiers_tranches = sorted([f for f in os.listdir(dossier_tranches_source) if f.lower().endswith('.png')])
-    if not fichiers_tranches:
-        return None, "Erreur: Aucun fichier PNG trouvé."
+    if progress_callback and not en_flux:
+        progress_callback(75, "Vérification des tranches pour le PDF...")
 
-    num_total_tranches_source = len(fichiers_tranches)
+    if format_page not in FORMATS_PAGE_PDF:
+        return None, f"Erreur: Format de page inconnu : '{format_page}'. Formats disponibles : {', '.join(FORMATS_PAGE_PDF)}."
+
+    encodage = None
+    if isinstance(dossier_tranches_source, TranchesEncodees):
+        encodage = (dossier_tranches_source.filtre, dossier_tranches_source.niveau)
+    elif profil_encodage is not None:
+        encodage, erreur = _lire_profil_encodage(profil_encodage)
+        if erreur:
+            return None, erreur
+
+    # Les tranches encodées sont indépendantes de la mise en page, sauf en mode atlas (composées avec les marges)
+    if mode_atlas and (dossier_copie_tranches is not None or isinstance(dossier_tranches_source, TranchesEncodees)):
+        return None, "Erreur: Le mode atlas ne peut ni produire ni réutiliser des tranches encodées."
+    ecriture_tranches = None
+    if dossier_copie_tranches is not None:
+        if encodage is None:
+            return None, "Erreur: La copie des tranches encodées demande un profil d'encodage."
+        ecriture_tranches = _EcritureTranchesEncodees(dossier_copie_tranches, *encodage)
+
+    tranches_source, erreur = _ouvrir_source_tranches(dossier_tranches_source, pixels_bruts=mode_atlas or encodage is not None)
+    if erreur:
+        return None, erreur
+
+    num_total_tranches_source = len(tranches_source)
+    mesures.definir('tranches', num_total_tranches_source)
+
+    # (largeur, hauteur) en pixels des tranches reçues déjà encodées : toutes les tranches d'un rendu ont la même taille
+    dimensions_tranches_encodees = None
+    if isinstance(dossier_tranches_source, TranchesEncodees):
+        dimensions_tranches_encodees = (dossier_tranches_source.largeur_pixels, dossier_tranches_source.hauteur_pixels)
+    assemblage_parallele = (nombre_processus_assemblage > 1 and encodage is not None and not mode_atlas
+                            and dimensions_tranches_encodees is None)
 
     # MODIFICATION: Utiliser le chemin 'output_pdf_path' fourni par l'appelant (app.py)
     chemin_fichier_pdf = output_pdf_path
 
 
-    c = canvas.Canvas(chemin_fichier_pdf, pagesize=A4)
-    largeur_page, hauteur_page = A4 # A4 est en points, on va utiliser mm pour le positionnement
+    largeur_page, hauteur_page = (cote * mm for cote in FORMATS_PAGE_PDF[format_page]) # En points, on va utiliser mm pour le positionnement
 
 
     # Marges fixes
@@ -157,17 +1160,14 @@ def generer_pdf_a_partir_tranches(dossier_tranches_source, hauteur_livre_mm_pdf,
     # Longueur du trait du repère vertical (s'étend au-dessus et en dessous du cadre)
     LONGUEUR_REPERE_VERTICAL_MM = 3
     REPERE_OFFSET_Y_MM = 2 # Distance du cadre pour les repères verticaux
+    # Espace entre deux lignes de tranches d'une même page : le repère du bas d'une ligne et celui du haut
+    # de la suivante, plus 2 mm pour qu'ils ne se touchent pas
+    ESPACEMENT_LIGNES_MM = 2 * (REPERE_OFFSET_Y_MM + LONGUEUR_REPERE_VERTICAL_MM) + 2
 
 
     # Calcul du nombre total de pages du PDF
     largeur_totale_par_tranche_bloc = largeur_tranche_etiree_cible_mm_pdf * mm + MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm + MARGE_INTERNE_TRANCHE_HORIZONTALE_DROITE_MM * mm
     tranches_par_ligne_pdf = max(1, int(largeur_contenu_disponible_pt / largeur_totale_par_tranche_bloc))
-    lignes_par_page_pdf = 1 # Fixé à 1 pour cet usage
-
-    num_pages_tranches = math.ceil(num_total_tranches_source / tranches_par_ligne_pdf)
-    total_pdf_pages = num_pages_tranches + 1 # +1 pour la page de garde
-
-    current_pdf_page_number = 1 # Initialise le compteur de pages PDF
 
     # --- VÉRIFICATION : HAUTEUR DU LIVRE TROP GRANDE POUR LA PAGE ---
     # La hauteur disponible pour le contenu (tranches) est hauteur_page - (marge_haut + marge_bas) en points.
@@ -177,224 +1177,369 @@ def generer_pdf_a_partir_tranches(dossier_tranches_source, hauteur_livre_mm_pdf,
     # On ajoute une petite tolérance pour les imprécisions des flottants, par exemple 0.1 mm
     if hauteur_livre_mm_pdf > hauteur_disponible_pour_tranche_en_mm + 0.1:
         return None, (f"Erreur: La hauteur du livre spécifiée ({hauteur_livre_mm_pdf:.2f} mm) est trop grande "
-                      f"pour tenir sur la hauteur de la page PDF (A4) avec les marges actuelles.\n"
+                      f"pour tenir sur la hauteur de la page PDF ({format_page}) avec les marges actuelles.\n"
                       f"Hauteur disponible pour le contenu : {hauteur_disponible_pour_tranche_en_mm:.2f} mm.\n"
                       f"Veuillez réduire la hauteur du livre ou les marges verticales.")
 
+    # Une première ligne, puis autant de lignes supplémentaires (espacement compris) que la hauteur restante en contient
+    lignes_par_page_pdf = 1 + max(0, int((hauteur_disponible_pour_tranche_en_mm + 0.1 - hauteur_livre_mm_pdf)
+                                         / (hauteur_livre_mm_pdf + ESPACEMENT_LIGNES_MM)))
+    tranches_par_page_pdf = tranches_par_ligne_pdf * lignes_par_page_pdf
 
-    try:
-        c.setFont('Helvetica-Bold', 14)
-        c.setFillColor(black)
-        creation_date_formatted = date.today().strftime("%d/%m/%Y") # CHANGEMENT ICI : Utilisation de date.today()
-        texte_titre = "Créé par Voldemort le " + creation_date_formatted
-        text_width_titre = c.stringWidth(texte_titre, 'Helvetica-Bold', 14)
-        # Positionnement du titre : centré horizontalement, à 15mm du bord supérieur (MARGE_VERTICALE_HAUT_PAGE_MM + petit décalage)
-        c.drawString((largeur_page - text_width_titre) / 2, hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3) * mm, texte_titre)
-
-        # Informations ajoutées en dessous du titre
-        c.setFont('Helvetica', 10)
-        line_height = 12 # hauteur d'une ligne de texte en points
-
-        texte_nombre_tranches = f"Nombre total de tranches : {num_total_tranches_source} (correspondant à {nombre_pages_livre_original} pages)"
-        text_width_tranches = c.stringWidth(texte_nombre_tranches, 'Helvetica', 10)
-        # Positionnement : centré horizontalement, sous le titre
-        c.drawString((largeur_page - text_width_tranches) / 2, hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3 + 12) * mm, texte_nombre_tranches)
-
-        texte_hauteur_livre = f"Hauteur du livre : {hauteur_livre_mm_pdf:.2f} mm"
-        text_width_hauteur = c.stringWidth(texte_hauteur_livre, 'Helvetica', 10)
-        # Positionnement : centré horizontalement, sous la ligne précédente
-        c.drawString((largeur_page - text_width_hauteur) / 2, hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3 + 12) * mm - line_height, texte_hauteur_livre)
-
-
-        # Charger l'image source originale pour l'aperçu
-        img_apercu_original = Image.open(image_source_original_path)
-
-        # Calculer l'espace disponible pour l'image après le texte d'information
-        # Le haut de l'espace pour l'image: juste en dessous de la dernière ligne de texte + un petit décalage
-        y_top_image_area_pt = hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3 + 12) * mm - line_height - (5 * mm) # 5mm de marge sous le texte info
-
-        # Le bas de l'espace pour l'image est le haut de la marge basse
-        y_bottom_image_area_pt = MARGE_VERTICALE_BAS_PAGE_MM * mm
-
-        max_apercu_height = y_top_image_area_pt - y_bottom_image_area_pt
-        max_apercu_width = largeur_contenu_disponible_pt # Utilise toute la largeur disponible dans le contenu
+    num_pages_tranches = math.ceil(num_total_tranches_source / tranches_par_page_pdf)
+    total_pdf_pages = num_pages_tranches + 1 # +1 pour la page de garde
 
-        apercu_ratio = img_apercu_original.width / img_apercu_original.height
+    # Canvas et écriture créés une fois la mise en page validée : une erreur de paramètres ne laisse aucun PDF tronqué
+    # (ni octets déjà transmis en téléchargement direct)
+    c = canvas.Canvas(chemin_fichier_pdf, pagesize=(largeur_page, hauteur_page))
+    # Chaque page est écrite dès qu'elle est terminée (le PDF n'est jamais entièrement en mémoire)
+    ecriture_pdf = _EcriturePDFIncrementale(c, chemin_fichier_pdf)
 
-        if (max_apercu_width / max_apercu_height) > apercu_ratio:
-            # La hauteur est le facteur limitant
-            apercu_height_pt = max_apercu_height
-            apercu_width_pt = apercu_height_pt * apercu_ratio
-        else:
-            # La largeur est le facteur limitant
-            apercu_width_pt = max_apercu_width
-            apercu_height_pt = apercu_width_pt / apercu_ratio
+    current_pdf_page_number = 1 # Initialise le compteur de pages PDF
 
-        # Centrer l'image dans l'espace disponible
-        x_apercu = (largeur_page - apercu_width_pt) / 2 # Centrage horizontal
-        y_apercu = y_bottom_image_area_pt + (max_apercu_height - apercu_height_pt) / 2 # Centrage vertical
 
+    try:
+        with mesures.etape('page_garde'):
+            c.setFont('Helvetica-Bold', 14)
+            c.setFillColor(black)
+            creation_date_formatted = date.today().strftime("%d/%m/%Y") # CHANGEMENT ICI : Utilisation de date.today()
+            texte_titre = "Créé par Voldemort le " + creation_date_formatted
+            text_width_titre = c.stringWidth(texte_titre, 'Helvetica-Bold', 14)
+            # Positionnement du titre : centré horizontalement, à 15mm du bord supérieur (MARGE_VERTICALE_HAUT_PAGE_MM + petit décalage)
+            c.drawString((largeur_page - text_width_titre) / 2, hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3) * mm, texte_titre)
 
-        c.drawImage(ImageReader(image_source_original_path), x_apercu, y_apercu,
-                    width=apercu_width_pt, height=apercu_height_pt)
+            # Informations ajoutées en dessous du titre
+            c.setFont('Helvetica', 10)
+            line_height = 12 # hauteur d'une ligne de texte en points
 
-        # Numérotation de la page de garde (décalée de 2cm à gauche, EN DESSOUS de la marge du bas)
-        page_num_text = f"Page {current_pdf_page_number} sur {total_pdf_pages}"
-        c.setFont('Helvetica', TAILLE_POLICE_PAGE_NUM)
-        text_width_page_num = c.stringWidth(page_num_text, 'Helvetica', TAILLE_POLICE_PAGE_NUM)
-        # Positionnement : Largeur de la page - Marge droite - Largeur du texte - 20mm (2cm) de décalage
-        # La numérotation est à 2mm DU BAS DE LA PAGE (zone non imprimable)
-        c.drawString(largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm - text_width_page_num - (20 * mm), 2 * mm, page_num_text)
+            texte_nombre_tranches = f"Nombre total de tranches : {num_total_tranches_source} (correspondant à {nombre_pages_livre_original} pages)"
+            text_width_tranches = c.stringWidth(texte_nombre_tranches, 'Helvetica', 10)
+            # Positionnement : centré horizontalement, sous le titre
+            c.drawString((largeur_page - text_width_tranches) / 2, hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3 + 12) * mm, texte_nombre_tranches)
 
-        current_pdf_page_number += 1 # Incrémente le compteur de pages PDF
-        c.showPage() # Passe à la page suivante pour les tranches
-    except Exception as e:
-        return None, f"Erreur lors de l'ajout de la page d'aperçu : {e}"
+            texte_hauteur_livre = f"Hauteur du livre : {hauteur_livre_mm_pdf:.2f} mm"
+            text_width_hauteur = c.stringWidth(texte_hauteur_livre, 'Helvetica', 10)
+            # Positionnement : centré horizontalement, sous la ligne précédente
+            c.drawString((largeur_page - text_width_hauteur) / 2, hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3 + 12) * mm - line_height, texte_hauteur_livre)
 
 
-    print(f"Disposition PDF: {tranches_par_ligne_pdf} tranches par ligne (calculé), {lignes_par_page_pdf} ligne par page (fixé).")
+            # Aperçu de l'image source, déjà réduit à la résolution utile (pas l'original pleine résolution)
+            img_apercu_original = _apercu_page_garde(dossier_tranches_source, image_source_original_path)
 
+            # Calculer l'espace disponible pour l'image après le texte d'information
+            # Le haut de l'espace pour l'image: juste en dessous de la dernière ligne de texte + un petit décalage
+            y_top_image_area_pt = hauteur_page - (MARGE_VERTICALE_HAUT_PAGE_MM + 3 + 12) * mm - line_height - (5 * mm) # 5mm de marge sous le texte info
 
-    tranche_actuelle_index_globale = 0
-    numero_imprime_actuel = debut_numero_tranche
+            # Le bas de l'espace pour l'image est le haut de la marge basse
+            y_bottom_image_area_pt = MARGE_VERTICALE_BAS_PAGE_MM * mm
 
-    if progress_callback:
-        progress_callback(80, "Assemblage des tranches dans le PDF...")
+            max_apercu_height = y_top_image_area_pt - y_bottom_image_area_pt
+            max_apercu_width = largeur_contenu_disponible_pt # Utilise toute la largeur disponible dans le contenu
 
-    c.setStrokeColor(black)
-    c.setLineWidth(EPAISSEUR_LIGNE_DECOUPE)
+            apercu_ratio = img_apercu_original.width / img_apercu_original.height
 
-    # La ligne du haut du cadre global est à la marge haute de la page.
-    y_global_top_line_page = hauteur_page - MARGE_VERTICALE_HAUT_PAGE_MM * mm
-    c.line(MARGE_HORIZONTALE_PAGE_MM * mm, y_global_top_line_page, largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm, y_global_top_line_page)
+            if (max_apercu_width / max_apercu_height) > apercu_ratio:
+                # La hauteur est le facteur limitant
+                apercu_height_pt = max_apercu_height
+                apercu_width_pt = apercu_height_pt * apercu_ratio
+            else:
+                # La largeur est le facteur limitant
+                apercu_width_pt = max_apercu_width
+                apercu_height_pt = apercu_width_pt / apercu_ratio
 
+            # Centrer l'image dans l'espace disponible
+            x_apercu = (largeur_page - apercu_width_pt) / 2 # Centrage horizontal
+            y_apercu = y_bottom_image_area_pt + (max_apercu_height - apercu_height_pt) / 2 # Centrage vertical
 
-    for i, fichier_tranche in enumerate(fichiers_tranches):
-        chemin_image_tranche = os.path.join(dossier_tranches_source, fichier_tranche)
 
-        colonne_actuelle_sur_page = tranche_actuelle_index_globale % tranches_par_ligne_pdf
+            # Simple aperçu (non imprimé sur la tranche) : toujours en JPEG, quel que soit le profil des tranches
+            image_apercu = _dessiner_image_encodee(c, "apercu_page_garde", np.asarray(img_apercu_original.convert("RGB")),
+                                                   x_apercu, y_apercu, apercu_width_pt, apercu_height_pt, *PROFILS_ENCODAGE_PDF['jpeg'])
+            mesures.ajouter_octets('page_garde', len(image_apercu.streamContent))
 
-        # Si c'est le début d'une nouvelle page de tranches (pas la toute première tranche du document)
-        if (tranche_actuelle_index_globale > 0 and colonne_actuelle_sur_page == 0):
-            # Dessiner le numéro de page pour la page précédente avant de la "fermer" et d'en ouvrir une nouvelle
+            # Numérotation de la page de garde (décalée de 2cm à gauche, EN DESSOUS de la marge du bas)
             page_num_text = f"Page {current_pdf_page_number} sur {total_pdf_pages}"
             c.setFont('Helvetica', TAILLE_POLICE_PAGE_NUM)
             text_width_page_num = c.stringWidth(page_num_text, 'Helvetica', TAILLE_POLICE_PAGE_NUM)
             # Positionnement : Largeur de la page - Marge droite - Largeur du texte - 20mm (2cm) de décalage
-            # La numérotation est à 2mm DU BAS DE LA PAGE
+            # La numérotation est à 2mm DU BAS DE LA PAGE (zone non imprimable)
             c.drawString(largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm - text_width_page_num - (20 * mm), 2 * mm, page_num_text)
 
             current_pdf_page_number += 1 # Incrémente le compteur de pages PDF
+            c.showPage() # Passe à la page suivante pour les tranches
+            ecriture_pdf.vider()
+    except Exception as e:
+        return None, f"Erreur lors de l'ajout de la page d'aperçu : {e}"
 
-            c.showPage() # Passe à la nouvelle page
-            # On redessine le cadre supérieur de la nouvelle page de tranches
-            c.setStrokeColor(black)
-            c.setLineWidth(EPAISSEUR_LIGNE_DECOUPE)
-            c.line(MARGE_HORIZONTALE_PAGE_MM * mm, y_global_top_line_page, largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm, y_global_top_line_page)
-
-            print(f"Passage à une nouvelle page. Tranche actuelle globale : {tranche_actuelle_index_globale}")
-
-        try:
-            # Positionnement du CADRE complet de la tranche (incluant les marges internes gauche et droite)
-            x_pos_frame_bottom_left = MARGE_HORIZONTALE_PAGE_MM * mm + (colonne_actuelle_sur_page * largeur_totale_par_tranche_bloc)
-
-            # La hauteur du cadre est EXACTEMENT la hauteur du livre.
-            frame_height = hauteur_livre_mm_pdf * mm
-            y_pos_frame_bottom_left = y_global_top_line_page - frame_height
-
-            frame_width = largeur_tranche_etiree_cible_mm_pdf * mm + MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm + MARGE_INTERNE_TRANCHE_HORIZONTALE_DROITE_MM * mm
-            c.rect(x_pos_frame_bottom_left, y_pos_frame_bottom_left, frame_width, frame_height, stroke=1, fill=0)
-
-
-            # --- DESSIN DU NUMÉRO ET DU COPYRIGHT (dans la marge blanche de GAUCHE de CHAQUE TRANCHE) ---
-            c.saveState() # Sauvegarder l'état actuel du canevas pour les transformations de texte
-
-            # Position du pivot pour le bloc de texte (Numéro + Copyright)
-            # Ce pivot est le centre de la marge gauche de la tranche, en haut.
-            x_pivot_block_text = x_pos_frame_bottom_left + (MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm / 2)
-            y_pivot_block_text = y_pos_frame_bottom_left + frame_height - (10 * mm) # Décalé de 10mm du haut du cadre
-
-            c.translate(x_pivot_block_text, y_pivot_block_text) # Déplacer l'origine au point de pivot
-            c.rotate(270) # Tourner de 270 degrés (texte de haut en bas)
-
-            # --- Dessiner le Numéro ---
-            c.setFont('Helvetica-Bold', TAILLE_POLICE_NUMERO)
-            c.setFillColor(black)
-            texte_numero = f"{numero_imprime_actuel}"
-            texte_largeur_numero_pt = c.stringWidth(texte_numero, 'Helvetica-Bold', TAILLE_POLICE_NUMERO)
-
-            # Positionnement du numéro dans le système roté (X positif vers le bas, Y positif vers la gauche)
-            # Le Y est pour le centrage du texte par rapport à l'origine (ici le milieu de la ligne de texte).
-            # Le X est 0 pour le début du texte.
-            x_pos_numero_rot = 0
-            y_pos_numero_rot = -texte_largeur_numero_pt / 2
-            c.drawString(x_pos_numero_rot, y_pos_numero_rot, texte_numero)
-
-            # --- Dessiner le Copyright à la suite du Numéro ---
-            c.setFont('Helvetica', TAILLE_POLICE_COPYRIGHT)
-            texte_copyright_a_afficher = TEXTE_COPYRIGHT
-            texte_largeur_copyright_pt = c.stringWidth(texte_copyright_a_afficher, 'Helvetica', TAILLE_POLICE_COPYRIGHT)
-
-            espacement_mm = 2 # 2 mm d'espacement entre le numéro et le copyright
-            espacement_pt = espacement_mm * mm # Convertir en points
-
-            # Positionnement du copyright après le numéro sur l'axe "X roté" (vers le bas)
-            x_pos_for_copyright_rot = x_pos_numero_rot + texte_largeur_numero_pt + espacement_pt
-
-            # Centrage sur l'axe "Y roté" (gauche/droite)
-            y_pos_for_copyright_rot = y_pos_numero_rot # Le même centrage que le numéro
-
-            # Dessiner le copyright avec les positions calculées dans le système roté.
-            c.drawString(x_pos_for_copyright_rot, y_pos_for_copyright_rot, texte_copyright_a_afficher)
 
-            c.restoreState() # Restaurer l'état du canevas après les transformations et le dessin
+    print(f"Disposition PDF: {tranches_par_ligne_pdf} tranches par ligne (calculé), {lignes_par_page_pdf} ligne(s) par page (format {format_page}).")
 
 
-            # Dessiner l'image de la tranche: placée après la marge interne gauche, et collée au bas du cadre.
-            x_pos_image = x_pos_frame_bottom_left + MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm
-            y_pos_image = y_pos_frame_bottom_left # Le bas de l'image est le bas du cadre
-            # Forcer la hauteur de l'image en points pour ReportLab
-            c.drawImage(ImageReader(chemin_image_tranche), x_pos_image, y_pos_image,
-                        width=largeur_tranche_etiree_cible_mm_pdf * mm, height=hauteur_livre_mm_pdf * mm)
+    # La ligne du haut du cadre global est à la marge haute de la page.
+    y_global_top_line_page = hauteur_page - MARGE_VERTICALE_HAUT_PAGE_MM * mm
 
-            # --- AJOUT DES REPÈRES VERTICAUX CENTRÉS ---
-            # Position X du centre de l'IMAGE de la tranche (pas du bloc entier)
-            center_x_image_tranche = x_pos_image + (largeur_tranche_etiree_cible_mm_pdf * mm / 2)
+    # La hauteur du cadre est EXACTEMENT la hauteur du livre.
+    frame_height = hauteur_livre_mm_pdf * mm
+    frame_width = largeur_tranche_etiree_cible_mm_pdf * mm + MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm + MARGE_INTERNE_TRANCHE_HORIZONTALE_DROITE_MM * mm
+
+    # Pivot du bloc de texte (Numéro + Copyright) : centre de la marge gauche, 10mm sous le haut du cadre
+    x_pivot_texte_cellule = MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm / 2
+    y_pivot_texte_cellule = frame_height - (10 * mm)
+    espacement_numero_copyright_pt = 2 * mm # 2 mm d'espacement entre le numéro et le copyright
+
+    gabarits_cellule = {}
+
+    def definir_gabarit_cellule(texte_largeur_numero_pt):
+        """
+        Form XObject de la partie fixe d'une cellule, en coordonnées relatives au coin bas-gauche du cadre :
+        cadre, repères verticaux centrés sur l'image et copyright. Le copyright suit le numéro,
+        un gabarit est donc défini par largeur de numéro (en pratique, un par nombre de chiffres).
+        """
+        cle_gabarit = round(texte_largeur_numero_pt, 3)
+        if cle_gabarit in gabarits_cellule:
+            return gabarits_cellule[cle_gabarit]
+
+        nom_gabarit = f"CelluleTranche{len(gabarits_cellule)}"
+        # Boîte englobante large : le texte ou les repères peuvent déborder du cadre sur les petits formats
+        c.beginForm(nom_gabarit, lowerx=-largeur_page, lowery=-hauteur_page, upperx=largeur_page, uppery=hauteur_page)
+        c.setStrokeColor(black)
+        c.setFillColor(black)
+        c.setLineWidth(EPAISSEUR_LIGNE_DECOUPE)
+        c.rect(0, 0, frame_width, frame_height, stroke=1, fill=0)
+
+        # Repères du HAUT (au-dessus du cadre) et du BAS (en dessous), au centre de l'IMAGE de la tranche
+        center_x_image_tranche = MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm + (largeur_tranche_etiree_cible_mm_pdf * mm / 2)
+        c.line(center_x_image_tranche, frame_height + REPERE_OFFSET_Y_MM * mm,
+               center_x_image_tranche, frame_height + REPERE_OFFSET_Y_MM * mm + LONGUEUR_REPERE_VERTICAL_MM * mm)
+        c.line(center_x_image_tranche, -REPERE_OFFSET_Y_MM * mm,
+               center_x_image_tranche, -REPERE_OFFSET_Y_MM * mm - LONGUEUR_REPERE_VERTICAL_MM * mm)
+
+        # Copyright à la suite du numéro, dans le même repère tourné de 270 degrés
+        texte = c.beginText()
+        texte.setFont('Helvetica', TAILLE_POLICE_COPYRIGHT)
+        texte.setTextTransform(0, -1, 1, 0,
+                               x_pivot_texte_cellule - texte_largeur_numero_pt / 2,
+                               y_pivot_texte_cellule - texte_largeur_numero_pt - espacement_numero_copyright_pt)
+        texte.textOut(TEXTE_COPYRIGHT)
+        c.drawText(texte)
+        c.endForm()
+
+        gabarits_cellule[cle_gabarit] = nom_gabarit
+        return nom_gabarit
+
+    def y_cadre_ligne(ligne):
+        """Bas des cadres de la ligne de tranches d'indice 'ligne' (0 = ligne du haut de la page)."""
+        return y_global_top_line_page - frame_height - ligne * (frame_height + ESPACEMENT_LIGNES_MM * mm)
+
+    def dessiner_pixels(nom_image, pixels, x, y, largeur, hauteur):
+        """
+        Place des pixels RGB dans le PDF, avec le profil d'encodage demandé ou celui de ReportLab par défaut.
+        Une tranche de TranchesEncodees (données déjà encodées) est placée telle quelle.
+        """
+        with mesures.etape('encodage'):
+            if encodage is None:
+                c.drawImage(_LecteurTrancheBrute(nom_image, pixels), x, y, width=largeur, height=hauteur)
+                return
+
+            if isinstance(pixels, bytes):
+                (largeur_pixels, hauteur_pixels), donnees = dimensions_tranches_encodees, pixels
+            else:
+                hauteur_pixels, largeur_pixels = pixels.shape[:2]
+                donnees = _encoder_pixels(pixels, *encodage)
+                mesures.ajouter_octets('encodage', len(donnees))
+            if ecriture_tranches is not None:
+                ecriture_tranches.ajouter(donnees, largeur_pixels, hauteur_pixels)
+            _placer_image_xobject(c, nom_image, _ImageTrancheEncodee(nom_image, largeur_pixels, hauteur_pixels, donnees, encodage[0]),
+                                  x, y, largeur, hauteur)
+
+    def dessiner_atlas(ligne, cellules_ligne):
+        """
+        Mode atlas : toutes les tranches d'une ligne de la page composées en une seule image (marges blanches incluses),
+        intégrée au PDF une seule fois au lieu d'une image par tranche.
+        """
+        pixels_tranches = [image_tranche for _, _, _, image_tranche in cellules_ligne]
+        hauteur_pixels, largeur_tranche_pixels = pixels_tranches[0].shape[:2]
+        pixels_par_point = largeur_tranche_pixels / (largeur_tranche_etiree_cible_mm_pdf * mm)
+
+        # Chaque tranche est arrondie au pixel le plus proche de sa position exacte : pas de dérive le long de la ligne
+        pas_pixels = largeur_totale_par_tranche_bloc * pixels_par_point
+        positions_pixels = [round(index * pas_pixels) for index in range(len(pixels_tranches))]
+        largeur_atlas_pixels = positions_pixels[-1] + pixels_tranches[-1].shape[1]
+
+        atlas = np.full((hauteur_pixels, largeur_atlas_pixels, 3), 255, dtype=np.uint8)
+        for position_pixels, pixels in zip(positions_pixels, pixels_tranches):
+            atlas[:, position_pixels:position_pixels + pixels.shape[1]] = pixels[:hauteur_pixels]
+
+        dessiner_pixels(f"atlas_page_{current_pdf_page_number:05d}_{ligne:02d}", atlas,
+                        cellules_ligne[0][0] + MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm, y_cadre_ligne(ligne),
+                        largeur_atlas_pixels / pixels_par_point, frame_height)
+
+    def dessiner_page_tranches(cellules_page):
+        """Dessine une page de tranches, ligne par ligne. Retourne un message d'erreur, ou None."""
+        for ligne, debut_ligne in enumerate(range(0, len(cellules_page), tranches_par_ligne_pdf)):
+            erreur = dessiner_ligne_tranches(ligne, debut_ligne, cellules_page[debut_ligne:debut_ligne + tranches_par_ligne_pdf])
+            if erreur:
+                return erreur
+        return None
+
+    def dessiner_ligne_tranches(ligne, index_premiere_cellule, cellules_ligne):
+        """Dessine une ligne de tranches de la page courante. Retourne un message d'erreur, ou None."""
+        y_pos_frame_bottom_left = y_cadre_ligne(ligne)
+        if mode_atlas:
+            # L'atlas est posé en premier : ses marges blanches ne doivent pas recouvrir les cadres
+            try:
+                dessiner_atlas(ligne, cellules_ligne)
+            except Exception as e:
+                return f"Erreur lors de l'ajout des tranches de la page {current_pdf_page_number} au PDF : {e}"
+
+        # Ligne de coupe horizontale au-dessus de chaque ligne de tranches
+        y_ligne_coupe = y_pos_frame_bottom_left + frame_height
+        c.setStrokeColor(black)
+        c.setLineWidth(EPAISSEUR_LIGNE_DECOUPE)
+        c.line(MARGE_HORIZONTALE_PAGE_MM * mm, y_ligne_coupe, largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm, y_ligne_coupe)
+
+        for colonne, (x_pos_frame_bottom_left, numero_imprime, nom_tranche, image_tranche) in enumerate(cellules_ligne, start=index_premiere_cellule):
+            try:
+                # Partie fixe de la cellule (cadre, repères, copyright) : un seul XObject réutilisé à chaque emplacement
+                texte_numero = f"{numero_imprime}"
+                texte_largeur_numero_pt = c.stringWidth(texte_numero, 'Helvetica-Bold', TAILLE_POLICE_NUMERO)
+                c.saveState()
+                c.translate(x_pos_frame_bottom_left, y_pos_frame_bottom_left)
+                c.doForm(definir_gabarit_cellule(texte_largeur_numero_pt))
+                c.restoreState()
+
+                # Seul le numéro change d'une cellule à l'autre : texte tourné de 270 degrés (de haut en bas),
+                # centré sur la marge blanche de GAUCHE, 10mm sous le haut du cadre.
+                texte = c.beginText()
+                texte.setFont('Helvetica-Bold', TAILLE_POLICE_NUMERO)
+                texte.setTextTransform(0, -1, 1, 0,
+                                       x_pos_frame_bottom_left + x_pivot_texte_cellule - texte_largeur_numero_pt / 2,
+                                       y_pos_frame_bottom_left + y_pivot_texte_cellule)
+                texte.textOut(texte_numero)
+                c.drawText(texte)
+
+                if not mode_atlas:
+                    # Dessiner l'image de la tranche: placée après la marge interne gauche, et collée au bas du cadre.
+                    x_pos_image = x_pos_frame_bottom_left + MARGE_INTERNE_TRANCHE_HORIZONTALE_GAUCHE_MM * mm
+                    # Forcer la hauteur de l'image en points pour ReportLab
+                    if encodage is None:
+                        with mesures.etape('encodage'):
+                            c.drawImage(ImageReader(image_tranche), x_pos_image, y_pos_frame_bottom_left,
+                                        width=largeur_tranche_etiree_cible_mm_pdf * mm, height=hauteur_livre_mm_pdf * mm)
+                    else:
+                        dessiner_pixels(f"tranche_page_{current_pdf_page_number:05d}_{colonne:03d}", image_tranche, x_pos_image, y_pos_frame_bottom_left,
+                                        largeur_tranche_etiree_cible_mm_pdf * mm, hauteur_livre_mm_pdf * mm)
+            except Exception as e:
+                return f"Erreur lors de l'ajout de la tranche '{nom_tranche}' au PDF : {e}"
+        return None
+
+    def numeroter_page_tranches():
+        """Numérotation de la page de tranches courante (décalée de 2cm à gauche, à 2mm DU BAS DE LA PAGE)."""
+        nonlocal current_pdf_page_number
+        page_num_text = f"Page {current_pdf_page_number} sur {total_pdf_pages}"
+        c.setFont('Helvetica', TAILLE_POLICE_PAGE_NUM)
+        text_width_page_num = c.stringWidth(page_num_text, 'Helvetica', TAILLE_POLICE_PAGE_NUM)
+        c.drawString(largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm - text_width_page_num - (20 * mm), 2 * mm, page_num_text)
+        current_pdf_page_number += 1
+
+    def pages_de_cellules():
+        """
+        Regroupe les tranches par page, ligne après ligne : (cellules, nombre de tranches parcourues), où chaque cellule
+        est (x du cadre, numéro imprimé, identifiant, image).
+        """
+        numero_imprime_actuel = debut_numero_tranche
+        cellules_page = []
+        for i, (nom_tranche, image_tranche) in enumerate(tranches_source):
+            x_pos_frame_bottom_left = MARGE_HORIZONTALE_PAGE_MM * mm + ((len(cellules_page) % tranches_par_ligne_pdf) * largeur_totale_par_tranche_bloc)
+            cellules_page.append((x_pos_frame_bottom_left, numero_imprime_actuel, nom_tranche, image_tranche))
+            numero_imprime_actuel += pas_numero_tranche
+            if len(cellules_page) == tranches_par_page_pdf or i + 1 == num_total_tranches_source:
+                yield cellules_page, i + 1
+                cellules_page = []
+
+    def pages_encodees_en_parallele(pages):
+        """
+        Encode les images des pages dans un pool de processus, en avance sur l'assemblage : au plus 2 pages
+        par processus sont en vol, et elles sont restituées dans l'ordre du document, images remplacées par
+        leurs données encodées. Le document reste unique : numérotation et ressources partagées (polices,
+        gabarits de cellule) sont celles de l'assemblage séquentiel.
+        """
+        nonlocal dimensions_tranches_encodees
+        executeur = None
+        try:
+            # forkserver : les processus d'encodage ne sont pas dupliqués depuis un processus web multi-thread
+            contexte = multiprocessing.get_context("forkserver")
+            contexte.set_forkserver_preload([__name__])
+            executeur = ProcessPoolExecutor(max_workers=nombre_processus_assemblage, mp_context=contexte)
+
+            en_cours = deque()
+            for cellules_page, tranches_parcourues in pages:
+                hauteur_pixels, largeur_pixels = cellules_page[0][3].shape[:2]
+                dimensions_tranches_encodees = (largeur_pixels, hauteur_pixels)
+                en_cours.append((cellules_page, tranches_parcourues,
+                                 executeur.submit(_encoder_page_tranches, [cellule[3] for cellule in cellules_page], *encodage)))
+                if len(en_cours) >= 2 * nombre_processus_assemblage:
+                    yield page_encodee(en_cours.popleft())
+
+            while en_cours:
+                yield page_encodee(en_cours.popleft())
+        finally:
+            if executeur is not None:
+                executeur.shutdown(wait=True, cancel_futures=True)
+
+    def page_encodee(page_en_cours):
+        """Attend les images d'une page du pool ; seule l'attente est comptée dans 'encodage' (le calcul recouvre l'assemblage)."""
+        cellules_page, tranches_parcourues, futur = page_en_cours
+        with mesures.etape('encodage'):
+            donnees_tranches = futur.result()
+        mesures.ajouter_octets('encodage', sum(len(donnees) for donnees in donnees_tranches))
+        return [cellule[:3] + (donnees,) for cellule, donnees in zip(cellules_page, donnees_tranches)], tranches_parcourues
 
-            # Repère du HAUT (au-dessus du cadre)
-            c.line(center_x_image_tranche, y_pos_frame_bottom_left + frame_height + REPERE_OFFSET_Y_MM * mm,
-                   center_x_image_tranche, y_pos_frame_bottom_left + frame_height + REPERE_OFFSET_Y_MM * mm + LONGUEUR_REPERE_VERTICAL_MM * mm)
+    if progress_callback:
+        progress_callback(debut_progression_assemblage, "Assemblage des tranches dans le PDF...")
 
-            # Repère du BAS (en dessous du cadre)
-            # CORRECTION : 'REPERE_OFFSET_Y_Y_MM' a été remplacé par 'REPERE_OFFSET_Y_MM'
-            c.line(center_x_image_tranche, y_pos_frame_bottom_left - REPERE_OFFSET_Y_MM * mm,
-                   center_x_image_tranche, y_pos_frame_bottom_left - REPERE_OFFSET_Y_MM * mm - LONGUEUR_REPERE_VERTICAL_MM * mm)
-            # --- FIN DES REPÈRES ---
+    pages = pages_de_cellules()
+    if assemblage_parallele:
+        pages = pages_encodees_en_parallele(pages)
 
-            tranche_actuelle_index_globale += 1
-            numero_imprime_actuel += pas_numero_tranche
+    lignes_derniere_page = 1
+    try:
+        for cellules_page, tranches_parcourues in pages:
+            with mesures.etape('assemblage'):
+                erreur_page = dessiner_page_tranches(cellules_page)
+            if erreur_page:
+                return None, erreur_page
+            lignes_derniere_page = math.ceil(len(cellules_page) / tranches_par_ligne_pdf)
 
             if progress_callback:
-                progress_val = 80 + int(15 * (i / num_total_tranches_source))
-                progress_callback(progress_val, f"Ajout de la tranche {i+1}/{num_total_tranches_source} au PDF...")
-
-        except Exception as e:
-            return None, f"Erreur lors de l'ajout de la tranche '{fichier_tranche}' au PDF : {e}"
+                progress_val = debut_progression_assemblage + int(amplitude_progression_assemblage * (tranches_parcourues / num_total_tranches_source))
+                progress_callback(progress_val, f"Ajout de la tranche {tranches_parcourues}/{num_total_tranches_source} au PDF...")
+
+            if tranches_parcourues < num_total_tranches_source:
+                with mesures.etape('assemblage'):
+                    numeroter_page_tranches()
+                    c.showPage() # Passe à la nouvelle page
+                    ecriture_pdf.vider()
+                print(f"Passage à une nouvelle page. Tranche actuelle globale : {tranches_parcourues}")
+    finally:
+        pages.close() # Arrête le pool d'encodage si l'assemblage s'interrompt
 
     # Numérotation de la page pour la *dernière* page de tranches (qui ne déclenchera pas de showPage() après elle)
-    page_num_text = f"Page {current_pdf_page_number} sur {total_pdf_pages}"
-    c.setFont('Helvetica', TAILLE_POLICE_PAGE_NUM)
-    text_width_page_num = c.stringWidth(page_num_text, 'Helvetica', TAILLE_POLICE_PAGE_NUM)
-    # Positionnement : Largeur de la page - Marge droite - Largeur du texte - 20mm (2cm) de décalage
-    # La numérotation est à 2mm DU BAS DE LA PAGE (zone non imprimable)
-    c.drawString(largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm - text_width_page_num - (20 * mm), 2 * mm, page_num_text)
+    numeroter_page_tranches()
 
     # Correction de la ligne diagonale sur la dernière page
-    y_global_bottom_line_page = y_pos_frame_bottom_left # Le bas du dernier cadre dessiné.
+    y_global_bottom_line_page = y_cadre_ligne(lignes_derniere_page - 1) # Le bas de la dernière ligne de cadres dessinée.
     c.line(MARGE_HORIZONTALE_PAGE_MM * mm, y_global_bottom_line_page, largeur_page - MARGE_HORIZONTALE_PAGE_MM * mm, y_global_bottom_line_page)
 
 
-    c.save() # Le PDF est sauvegardé au chemin 'output_pdf_path'
+    with mesures.etape('enregistrement'):
+        ecriture_pdf.terminer() # Remplace c.save() : fin du PDF au chemin (ou dans le flux) 'output_pdf_path'
+        if ecriture_tranches is not None:
+            ecriture_tranches.terminer(image_apercu.streamContent)
+    taille_pdf_octets = ecriture_pdf.position
+    mesures.ajouter_octets('enregistrement', taille_pdf_octets)
+    mesures.definir('taille_pdf_octets', taille_pdf_octets)
+    mesures.definir('pages', total_pdf_pages)
 
     if progress_callback:
         progress_callback(100, "PDF généré !")
@@ -0,0 +1,95 @@
+import hashlib
+import os
+
+from PIL import Image
+
+# Signatures (premiers octets du fichier) des formats d'image acceptés, et format PIL correspondant
+SIGNATURES_IMAGES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+)
+# Taille des blocs copiés depuis le flux envoyé
+TAILLE_BLOC_COPIE = 1024 * 1024
+
+
+def format_par_signature(debut_fichier):
+    """Format PIL reconnu d'après les premiers octets d'un fichier, ou None."""
+    for signature, format_image in SIGNATURES_IMAGES:
+        if debut_fichier.startswith(signature):
+            return format_image
+    return None
+
+
+def inspecter_image_source(flux, taille_max_octets, pixels_max):
+    """
+    Vérifie une image envoyée SANS la décoder : format reconnu par sa signature (pas par l'extension du nom),
+    taille du fichier, puis dimensions lues dans l'en-tête. Une image trop grande (« bombe de décompression »)
+    est refusée avant que son décodage ne réserve la moindre mémoire. Le flux est ramené au début.
+
+    Args:
+        flux: Flux binaire positionnable (fichier envoyé : SpooledTemporaryFile de werkzeug).
+        taille_max_octets (int): Taille maximale du fichier.
+        pixels_max (int): Nombre maximal de pixels (largeur x hauteur).
+
+    Returns:
+        tuple: (infos, erreur_message) où infos = {'format', 'largeur', 'hauteur', 'octets'}
+    """
+    format_image = format_par_signature(flux.read(16))
+    if format_image is None:
+        flux.seek(0)
+        return None, "Erreur: Le fichier envoyé n'est pas une image JPEG, PNG, GIF ou BMP valide."
+
+    taille_octets = flux.seek(0, os.SEEK_END)
+    flux.seek(0)
+    if taille_octets > taille_max_octets:
+        return None, (f"Erreur: L'image envoyée ({taille_octets / (1024 * 1024):.1f} Mo) dépasse la taille maximale "
+                      f"de {taille_max_octets // (1024 * 1024)} Mo.")
+
+    try:
+        # Image.open ne lit que l'en-tête ; limité au format annoncé par la signature
+        with Image.open(flux, formats=[format_image]) as img:
+            largeur, hauteur = img.size
+    except Image.DecompressionBombError:
+        largeur = hauteur = None
+    except Exception as e:
+        print(f"Image envoyée illisible ({format_image}) : {e}")
+        return None, "Erreur: L'image envoyée est illisible ou endommagée."
+    finally:
+        flux.seek(0)
+
+    if largeur is None or largeur * hauteur > pixels_max:
+        dimensions = f"{largeur}x{hauteur} pixels" if largeur is not None else "dimensions hors limites"
+        return None, (f"Erreur: L'image envoyée ({dimensions}) dépasse le maximum de {pixels_max / 1e6:.0f} mégapixels.\n"
+                      f"Veuillez réduire sa résolution.")
+
+    return {'format': format_image, 'largeur': largeur, 'hauteur': hauteur, 'octets': taille_octets}, None
+
+
+def ingerer_image_source(flux, chemin_destination, taille_max_octets, pixels_max):
+    """
+    Vérifie une image envoyée (voir inspecter_image_source) puis l'enregistre en un seul passage sur le flux :
+    l'empreinte SHA-256 du contenu (identique à empreinte_fichier) est calculée pendant la copie, sans relire le fichier.
+
+    Returns:
+        tuple: (infos, erreur_message) où infos = {'format', 'largeur', 'hauteur', 'octets', 'empreinte'}
+    """
+    infos, erreur = inspecter_image_source(flux, taille_max_octets, pixels_max)
+    if erreur:
+        return None, erreur
+
+    empreinte = hashlib.sha256()
+    try:
+        with open(chemin_destination, 'wb') as f:
+            for bloc in iter(lambda: flux.read(TAILLE_BLOC_COPIE), b''):
+                empreinte.update(bloc)
+                f.write(bloc)
+    except OSError as e:
+        if os.path.exists(chemin_destination):
+            os.remove(chemin_destination)
+        return None, f"Erreur d'enregistrement: Impossible d'enregistrer l'image envoyée : {e}"
+
+    infos['empreinte'] = empreinte.hexdigest()
+    return infos, None
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Étapes d'un rendu, dans l'ordre du pipeline. Les durées sont exclusives : le temps d'une étape imbriquée
+# (ex. encodage d'une tranche pendant l'assemblage) n'est compté que dans celle-ci, leur somme fait la durée du rendu.
+ETAPES_RENDU = ('chargement', 'redimensionnement', 'decoupage', 'encodage', 'page_garde', 'assemblage', 'enregistrement')
+
+# Bornes (secondes) de l'histogramme des durées de rendu
+BORNES_DUREE_RENDU = (1, 5, 15, 30, 60, 120, 300, 600)
+
+
+class MesuresRendu:
+    """
+    Mesures d'UN rendu, remplies par core_logic au fil du pipeline : durée et octets produits par étape,
+    et grandeurs du travail (pages, tranches, mégapixels de la source, taille du PDF).
+    Sans effet sur le rendu : une fonction appelée sans mesures en utilise une instance jetable.
+    """
+
+    def __init__(self):
+        self.durees = {}   # étape -> secondes (exclusives)
+        self.octets = {}   # étape -> octets produits
+        self.valeurs = {}  # 'pages', 'tranches', 'megapixels_source', 'taille_pdf_octets'
+        self._pile = []    # [étape, début de la portion en cours] des étapes imbriquées
+
+    @contextmanager
+    def etape(self, nom):
+        """Chronomètre une étape ; l'étape englobante est suspendue pendant ce temps."""
+        maintenant = time.perf_counter()
+        if self._pile:
+            parent = self._pile[-1]
+            self.durees[parent[0]] = self.durees.get(parent[0], 0.0) + maintenant - parent[1]
+        self._pile.append([nom, maintenant])
+        try:
+            yield
+        finally:
+            maintenant = time.perf_counter()
+            _, debut = self._pile.pop()
+            self.durees[nom] = self.durees.get(nom, 0.0) + maintenant - debut
+            if self._pile:
+                self._pile[-1][1] = maintenant
+
+    def ajouter_octets(self, nom, octets):
+        self.octets[nom] = self.octets.get(nom, 0) + octets
+
+    def definir(self, nom, valeur):
+        self.valeurs[nom] = valeur
+
+
+class RegistreMetriques:
+    """
+    Compteurs cumulés des rendus d'un processus, exposés au format texte de Prometheus.
+
+    Chaque processus (worker gunicorn) écrit ses compteurs dans son propre fichier metriques_<pid>.json
+    du dossier partagé, à chaque rendu terminé ; l'exposition additionne les fichiers de tous les processus.
+    Les fichiers des processus arrêtés sont conservés : les compteurs restent croissants. Un processus qui
+    reprend le pid d'un ancien repart de ses compteurs.
+    """
+
+    def __init__(self, dossier, prefixe='foreedge'):
+        self.dossier = dossier
+        self.prefixe = prefixe
+        self._verrou = threading.Lock()
+        self._pid = None
+        self._compteurs = None
+        os.makedirs(dossier, exist_ok=True)
+
+    def _chemin(self, pid):
+        return os.path.join(self.dossier, f"metriques_{pid}.json")
+
+    @staticmethod
+    def _compteurs_vides():
+        return {
+            'rendus': {},                                       # statut -> nombre
+            'duree_rendu': {'somme': 0.0, 'nombre': 0, 'seaux': [0] * len(BORNES_DUREE_RENDU)},
+            'etapes_secondes': {}, 'etapes_nombre': {}, 'etapes_octets': {},
+            'valeurs': {},                                      # pages, tranches, ... cumulés
+        }
+
+    def _compteurs_processus(self):
+        """Compteurs du processus courant (rechargés après un fork : le pid a changé)."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._compteurs = self._lire(self._chemin(self._pid)) or self._compteurs_vides()
+        return self._compteurs
+
+    @staticmethod
+    def _lire(chemin):
+        try:
+            with open(chemin, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def enregistrer(self, statut, duree_secondes, mesures=None):
+        """Ajoute un rendu terminé ('succes', 'erreur' ou 'cache') et ses mesures, puis publie les compteurs du processus."""
+        with self._verrou:
+            compteurs = self._compteurs_processus()
+            compteurs['rendus'][statut] = compteurs['rendus'].get(statut, 0) + 1
+
+            duree = compteurs['duree_rendu']
+            duree['somme'] += duree_secondes
+            duree['nombre'] += 1
+            for index, borne in enumerate(BORNES_DUREE_RENDU):
+                if duree_secondes <= borne:
+                    duree['seaux'][index] += 1
+
+            if mesures is not None:
+                for etape, secondes in mesures.durees.items():
+                    compteurs['etapes_secondes'][etape] = compteurs['etapes_secondes'].get(etape, 0.0) + secondes
+                    compteurs['etapes_nombre'][etape] = compteurs['etapes_nombre'].get(etape, 0) + 1
+                for etape, octets in mesures.octets.items():
+                    compteurs['etapes_octets'][etape] = compteurs['etapes_octets'].get(etape, 0) + octets
+                for nom, valeur in mesures.valeurs.items():
+                    compteurs['valeurs'][nom] = compteurs['valeurs'].get(nom, 0) + valeur
+
+            # Écriture atomique : l'exposition ne lit jamais un fichier à moitié écrit
+            chemin = self._chemin(self._pid)
+            with open(f"{chemin}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(compteurs, f)
+            os.replace(f"{chemin}.tmp", chemin)
+
+    def _cumuler_processus(self):
+        """Somme des compteurs publiés par tous les processus."""
+        total = self._compteurs_vides()
+        for nom_fichier in os.listdir(self.dossier):
+            if not (nom_fichier.startswith('metriques_') and nom_fichier.endswith('.json')):
+                continue
+            compteurs = self._lire(os.path.join(self.dossier, nom_fichier))
+            if compteurs is None:
+                continue
+            for statut, nombre in compteurs['rendus'].items():
+                total['rendus'][statut] = total['rendus'].get(statut, 0) + nombre
+            total['duree_rendu']['somme'] += compteurs['duree_rendu']['somme']
+            total['duree_rendu']['nombre'] += compteurs['duree_rendu']['nombre']
+            total['duree_rendu']['seaux'] = [a + b for a, b in zip(total['duree_rendu']['seaux'], compteurs['duree_rendu']['seaux'])]
+            for cle in ('etapes_secondes', 'etapes_nombre', 'etapes_octets', 'valeurs'):
+                for nom, valeur in compteurs[cle].items():
+                    total[cle][nom] = total[cle].get(nom, 0) + valeur
+        return total
+
+    def exposition(self, jauges=None):
+        """
+        Texte au format d'exposition Prometheus (version 0.0.4), tous processus confondus.
+
+        Args:
+            jauges (dict, optional): {nom: (aide, [(étiquettes, valeur), ...])} ajoutées telles quelles (ex. jobs en attente).
+        """
+        total = self._cumuler_processus()
+        p = self.prefixe
+        lignes = []
+
+        def metrique(nom, type_metrique, aide, echantillons):
+            lignes.append(f"# HELP {nom} {aide}")
+            lignes.append(f"# TYPE {nom} {type_metrique}")
+            for suffixe, etiquettes, valeur in echantillons:
+                texte_etiquettes = ','.join(f'{cle}="{val}"' for cle, val in etiquettes.items())
+                lignes.append(f"{nom}{suffixe}{{{texte_etiquettes}}} {valeur}" if texte_etiquettes else f"{nom}{suffixe} {valeur}")
+
+        metrique(f"{p}_renders_total", 'counter', "Rendus terminés, par statut (succes, erreur, cache).",
+                 [('', {'status': statut}, nombre) for statut, nombre in sorted(total['rendus'].items())])
+
+        duree = total['duree_rendu']
+        metrique(f"{p}_render_duration_seconds", 'histogram', "Durée totale des rendus.",
+                 [('_bucket', {'le': str(borne)}, nombre) for borne, nombre in zip(BORNES_DUREE_RENDU, duree['seaux'])]
+                 + [('_bucket', {'le': '+Inf'}, duree['nombre']), ('_sum', {}, round(duree['somme'], 6)), ('_count', {}, duree['nombre'])])
+
+        etapes = [e for e in ETAPES_RENDU if e in total['etapes_nombre']]
+        metrique(f"{p}_render_stage_seconds", 'summary', "Durée exclusive de chaque étape du rendu.",
+                 [s for e in etapes for s in (('_sum', {'stage': e}, round(total['etapes_secondes'][e], 6)),
+                                               ('_count', {'stage': e}, total['etapes_nombre'][e]))])
+        metrique(f"{p}_render_stage_bytes_total", 'counter', "Octets produits par chaque étape du rendu.",
+                 [('', {'stage': e}, total['etapes_octets'][e]) for e in ETAPES_RENDU if e in total['etapes_octets']])
+
+        for nom_valeur, nom_metrique, aide in (('pages', 'render_pdf_pages_total', "Pages PDF produites."),
+                                                ('tranches', 'render_slices_total', "Tranches produites."),
+                                                ('megapixels_source', 'render_input_megapixels_total', "Mégapixels des images sources."),
+                                                ('taille_pdf_octets', 'render_output_bytes_total', "Taille des PDF produits.")):
+            metrique(f"{p}_{nom_metrique}", 'counter', aide, [('', {}, round(total['valeurs'].get(nom_valeur, 0), 6))])
+
+        for nom, (aide, echantillons) in (jauges or {}).items():
+            metrique(f"{p}_{nom}", 'gauge', aide, [('', etiquettes, valeur) for etiquettes, valeur in echantillons])
+
+        return '\n'.join(lignes) + '\n'
@@ -0,0 +1,110 @@
+import threading
+import itertools
+
+# Classes de priorité des générations (la plus petite valeur passe en premier)
+PRIORITE_ADMIN = 0
+PRIORITE_PREMIUM = 1
+PRIORITE_STANDARD = 2
+
+
+class PlanificateurRendus:
+    """
+    File d'attente des générations d'un processus, exécutées par un nombre fixe de threads.
+
+    - au plus max_simultanes générations en cours en même temps, et max_simultanes_par_utilisateur pour un même utilisateur ;
+    - la prochaine génération lancée est la plus prioritaire parmi celles dont l'utilisateur n'a pas déjà atteint
+      sa limite, en alternant entre utilisateurs : un utilisateur très actif ne retarde pas les autres ;
+    - la file est bornée : au-delà de taille_max_file générations en attente, les nouvelles sont refusées.
+
+    Indépendant de Flask et de la base de données : une tâche est un simple appelable sans argument.
+    """
+
+    def __init__(self, max_simultanes, max_simultanes_par_utilisateur, taille_max_file, nom='rendu'):
+        self.max_simultanes = max_simultanes
+        self.max_simultanes_par_utilisateur = max_simultanes_par_utilisateur
+        self.taille_max_file = taille_max_file
+        self.nom = nom
+        self._condition = threading.Condition()
+        self._file = [] # (priorite, ordre d'arrivée, utilisateur_id, tache)
+        self._ordre_arrivee = itertools.count()
+        self._en_cours_par_utilisateur = {}
+        self._lancees_par_utilisateur = {} # Générations lancées depuis que la file a été vide (équité entre utilisateurs)
+        self._travailleurs = []
+
+    def soumettre(self, utilisateur_id, priorite, tache):
+        """
+        Met une tâche en file d'attente.
+
+        Returns:
+            tuple: (acceptee, erreur_message) ; acceptee vaut False si la file est pleine.
+        """
+        with self._condition:
+            if len(self._file) >= self.taille_max_file:
+                return False, "Le serveur est très sollicité : trop de générations en attente. Veuillez réessayer dans quelques minutes."
+            self._file.append((priorite, next(self._ordre_arrivee), utilisateur_id, tache))
+            # Threads démarrés au premier usage : sûr même si le module est importé avant un fork (gunicorn --preload)
+            if not self._travailleurs:
+                self._demarrer_travailleurs()
+            self._condition.notify_all()
+        return True, None
+
+    def etat(self):
+        """Nombre de générations en attente et en cours (pour le suivi)."""
+        with self._condition:
+            return {
+                'en_attente': len(self._file),
+                'en_cours': sum(self._en_cours_par_utilisateur.values()),
+            }
+
+    def _demarrer_travailleurs(self):
+        for index in range(self.max_simultanes):
+            travailleur = threading.Thread(target=self._boucle_travailleur, name=f"{self.nom}-{index}", daemon=True)
+            travailleur.start()
+            self._travailleurs.append(travailleur)
+
+    def _prochaine_tache(self):
+        """
+        Entrée la plus prioritaire dont l'utilisateur a encore une place libre (appelée sous verrou).
+        À priorité égale, passe d'abord l'utilisateur le moins servi depuis que la file a été vide
+        (générations déjà lancées + demandes qui le précèdent dans la file), puis l'ordre d'arrivée.
+        """
+        rang_par_utilisateur = {}
+        meilleure_cle, meilleure_entree = None, None
+        for entree in sorted(self._file, key=lambda e: e[1]):
+            priorite, ordre_arrivee, utilisateur_id, _ = entree
+            rang = rang_par_utilisateur.get(utilisateur_id, self._lancees_par_utilisateur.get(utilisateur_id, 0))
+            rang_par_utilisateur[utilisateur_id] = rang + 1
+            if self._en_cours_par_utilisateur.get(utilisateur_id, 0) >= self.max_simultanes_par_utilisateur:
+                continue
+            cle = (priorite, rang, ordre_arrivee)
+            if meilleure_cle is None or cle < meilleure_cle:
+                meilleure_cle, meilleure_entree = cle, entree
+        if meilleure_entree is not None:
+            self._file.remove(meilleure_entree)
+            utilisateur_id = meilleure_entree[2]
+            self._lancees_par_utilisateur[utilisateur_id] = self._lancees_par_utilisateur.get(utilisateur_id, 0) + 1
+            if not self._file:
+                self._lancees_par_utilisateur.clear()
+        return meilleure_entree
+
+    def _boucle_travailleur(self):
+        while True:
+            with self._condition:
+                entree = self._prochaine_tache()
+                while entree is None:
+                    self._condition.wait()
+                    entree = self._prochaine_tache()
+                utilisateur_id = entree[2]
+                self._en_cours_par_utilisateur[utilisateur_id] = self._en_cours_par_utilisateur.get(utilisateur_id, 0) + 1
+
+            try:
+                entree[3]()
+            except Exception as e:
+                print(f"Erreur inattendue dans une génération planifiée (utilisateur {utilisateur_id}): {e}")
+            finally:
+                with self._condition:
+                    self._en_cours_par_utilisateur[utilisateur_id] -= 1
+                    if not self._en_cours_par_utilisateur[utilisateur_id]:
+                        del self._en_cours_par_utilisateur[utilisateur_id]
+                    # Une place s'est libérée (globale et pour cet utilisateur)
+                    self._condition.notify_all()
@@ -0,0 +1,175 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+
+# Suffixes des entrées en cours d'écriture (rendu en cours) ou de coordination : jamais supprimées pour libérer
+# de la place, seulement une fois leur durée de vie dépassée
+SUFFIXES_EN_COURS = ('.tmp', '.lock')
+
+
+class StockageArtefacts:
+    """
+    Gestion de l'espace disque des fichiers produits par l'application (envois, tranches, PDF, aperçus...).
+
+    Chaque catégorie est un dossier dont chaque entrée (fichier ou dossier) est un artefact :
+    - un artefact plus ancien que la durée de vie de sa catégorie est supprimé ;
+    - au-delà du quota global (toutes catégories confondues), les artefacts les moins récemment utilisés
+      (date de modification, mise à jour par les caches à chaque utilisation) des catégories évinçables sont supprimés.
+    Le nettoyage est fait par un thread de fond, périodiquement et après chaque signal d'écriture.
+    Plusieurs processus (workers gunicorn) peuvent partager les mêmes dossiers : un verrou de fichier
+    évite que deux nettoyages tournent en même temps.
+    """
+
+    def __init__(self, dossier_verrou, quota_octets, intervalle_secondes=300):
+        self.dossier_verrou = dossier_verrou
+        self.quota_octets = quota_octets
+        self.intervalle_secondes = intervalle_secondes
+        self._categories = {}
+        self._reveil = threading.Event()
+        self._pid_nettoyeur = None
+        self._verrou_demarrage = threading.Lock()
+        os.makedirs(dossier_verrou, exist_ok=True)
+
+    def ajouter_categorie(self, nom, dossier, duree_vie_secondes, evincable=True):
+        """
+        Args:
+            duree_vie_secondes (float or None): Âge maximal d'un artefact ; None = pas de limite d'âge.
+            evincable (bool): Si False, les artefacts ne sont jamais supprimés pour respecter le quota
+                              (ex. images envoyées en attente de rendu), seulement à expiration.
+        """
+        os.makedirs(dossier, exist_ok=True)
+        self._categories[nom] = {'dossier': dossier, 'duree_vie': duree_vie_secondes, 'evincable': evincable}
+
+    def demarrer(self):
+        """Démarre le thread de nettoyage du processus courant (sans effet s'il tourne déjà, redémarré après un fork)."""
+        with self._verrou_demarrage:
+            if self._pid_nettoyeur == os.getpid():
+                return
+            self._pid_nettoyeur = os.getpid()
+            threading.Thread(target=self._boucle_nettoyage, name='nettoyage-artefacts', daemon=True).start()
+
+    def signaler_ecriture(self):
+        """À appeler après l'écriture d'un artefact volumineux : le quota est vérifié sans attendre le prochain passage."""
+        self._reveil.set()
+
+    def _boucle_nettoyage(self):
+        while True:
+            try:
+                self.nettoyer()
+            except Exception as e:
+                print(f"Erreur inattendue lors du nettoyage des artefacts : {e}")
+            self._reveil.wait(self.intervalle_secondes)
+            self._reveil.clear()
+
+    def nettoyer(self):
+        """
+        Supprime les artefacts expirés, puis les moins récemment utilisés tant que le quota est dépassé.
+
+        Returns:
+            dict or None: {'expires', 'evinces', 'octets_liberes', 'octets_utilises'}, ou None si un autre processus nettoie déjà.
+        """
+        with open(os.path.join(self.dossier_verrou, 'nettoyage.lock'), 'a') as fichier_verrou:
+            try:
+                fcntl.flock(fichier_verrou, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                return self._nettoyer()
+            finally:
+                fcntl.flock(fichier_verrou, fcntl.LOCK_UN)
+
+    def _nettoyer(self):
+        maintenant = time.time()
+        bilan = {'expires': 0, 'evinces': 0, 'octets_liberes': 0, 'octets_utilises': 0}
+        candidats = [] # (date d'utilisation, chemin, fichiers) des artefacts évinçables
+        # Liens restants de chaque fichier (st_dev, st_ino) : un PDF lié en dur dans deux catégories (cache des rendus
+        # et PDF générés) n'est compté qu'une fois, et ses octets ne sont libérés qu'avec la suppression du dernier lien
+        liens_restants = {}
+
+        entrees = []
+        for categorie in self._categories.values():
+            for chemin, date_utilisation, fichiers in self._entrees(categorie['dossier']):
+                entrees.append((categorie, chemin, date_utilisation, fichiers))
+                for inode, taille, nombre_liens in fichiers:
+                    if inode not in liens_restants:
+                        liens_restants[inode] = nombre_liens
+                        bilan['octets_utilises'] += taille
+
+        for categorie, chemin, date_utilisation, fichiers in entrees:
+            expire = categorie['duree_vie'] is not None and maintenant - date_utilisation > categorie['duree_vie']
+            en_cours = chemin.endswith(SUFFIXES_EN_COURS)
+            if expire and self._supprimer(chemin):
+                bilan['expires'] += 1
+                self._liberer(fichiers, liens_restants, bilan)
+                continue
+            if categorie['evincable'] and not en_cours:
+                candidats.append((date_utilisation, chemin, fichiers))
+
+        for _, chemin, fichiers in sorted(candidats):
+            if bilan['octets_utilises'] <= self.quota_octets:
+                break
+            if self._supprimer(chemin):
+                bilan['evinces'] += 1
+                self._liberer(fichiers, liens_restants, bilan)
+        return bilan
+
+    @staticmethod
+    def _liberer(fichiers, liens_restants, bilan):
+        """Retire du bilan les octets des fichiers d'un artefact supprimé dont c'était le dernier lien."""
+        for inode, taille, _ in fichiers:
+            liens_restants[inode] -= 1
+            if liens_restants[inode] == 0:
+                bilan['octets_liberes'] += taille
+                bilan['octets_utilises'] -= taille
+
+    @staticmethod
+    def _entrees(dossier):
+        """
+        (chemin, date de modification, fichiers) de chaque entrée du dossier, où fichiers est la liste des
+        ((st_dev, st_ino), taille, nombre de liens) du fichier, ou des fichiers contenus s'il s'agit d'un dossier.
+        """
+        try:
+            noms = os.listdir(dossier)
+        except FileNotFoundError:
+            return
+        for nom in noms:
+            chemin = os.path.join(dossier, nom)
+            try:
+                infos = os.stat(chemin)
+                if os.path.isdir(chemin):
+                    fichiers = []
+                    for racine, _, noms_fichiers in os.walk(chemin):
+                        for nom_fichier in noms_fichiers:
+                            try:
+                                infos_fichier = os.stat(os.path.join(racine, nom_fichier))
+                            except FileNotFoundError:
+                                continue
+                            fichiers.append(((infos_fichier.st_dev, infos_fichier.st_ino), infos_fichier.st_size, infos_fichier.st_nlink))
+                else:
+                    fichiers = [((infos.st_dev, infos.st_ino), infos.st_size, infos.st_nlink)]
+            except FileNotFoundError:
+                continue
+            yield chemin, infos.st_mtime, fichiers
+
+    @staticmethod
+    def _supprimer(chemin):
+        """Supprime un artefact. Retourne False s'il est encore utilisé (verrou détenu) ou déjà supprimé."""
+        try:
+            if chemin.endswith('.lock'):
+                # Verrou d'un cache : supprimé seulement si personne ne le détient
+                with open(chemin, 'a') as fichier_verrou:
+                    try:
+                        fcntl.flock(fichier_verrou, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return False
+                    os.remove(chemin)
+                return True
+            if os.path.isdir(chemin):
+                shutil.rmtree(chemin)
+            else:
+                os.remove(chemin)
+            return True
+        except FileNotFoundError:
+            return False
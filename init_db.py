@@ -1,9 +1,9 @@
-from app import app, db, User, Ticket, TicketMessage # AJOUT DE Ticket et TicketMessage
+from app import app, db, User, Ticket, TicketMessage, RenderJob, RenderBatch, RenderBatchItem # AJOUT DE Ticket, TicketMessage, RenderJob et des lots
 
 with app.app_context():
     # ATTENTION: Si vous aviez des messages de contact importants dans l'ancienne table 'contact_message',
     # ils seront perdus car db.create_all() ne gère pas les migrations de schéma complexes.
-    # Cette commande va créer les nouvelles tables 'ticket' et 'ticket_message'.
+    # Cette commande va créer les nouvelles tables 'ticket', 'ticket_message', 'render_job', 'render_batch' et 'render_batch_item'.
     db.create_all()
     print("Database tables created (or already existed).")
     # Si vous avez un utilisateur admin initial, vous pouvez le créer ici si la DB est vide.
@@ -2,4 +2,12 @@
 
 # Ce script lance simplement Gunicorn.
 # L'initialisation de la base de données est maintenant gérée par la Build Command via init_db.py.
-gunicorn app:app --bind 0.0.0.0:$PORT
\ No newline at end of file
+#
+# Workers "gthread" obligatoires : les flux de progression (SSE) et le téléchargement direct du PDF gardent une
+# réponse ouverte. Un worker "sync" (défaut de gunicorn) ne signale plus qu'il est vivant pendant ce temps : au-delà
+# de --timeout il est tué, avec les générations en cours dans son processus. Avec gthread, un thread transmet la
+# réponse pendant que le worker reste joignable ; --timeout ne concerne alors plus que les workers bloqués.
+gunicorn app:app --bind 0.0.0.0:$PORT \
+    --worker-class gthread \
+    --threads "${GUNICORN_THREADS:-8}" \
+    --timeout "${GUNICORN_TIMEOUT:-120}"
@@ -0,0 +1,103 @@
+"""
+Tests de core_logic.image_processing.
+
+Lancement : python -m pytest tests
+"""
+import io
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core_logic.image_processing import FluxTranches, generer_tranches_en_flux, generer_pdf_a_partir_tranches
+
+
+def creer_image_synthetique(largeur, hauteur):
+    """Image déterministe faite de dégradés et de motifs sinusoïdaux de périodes variées."""
+    y, x = np.mgrid[0:hauteur, 0:largeur].astype(np.float32)
+    rouge = 128 + 100 * np.sin(x / largeur * 6.28 * 7)
+    vert = 128 + 100 * np.cos(y / hauteur * 6.28 * 3)
+    bleu = 128 + 60 * np.sin((x + 2 * y) / 23.0)
+    return Image.fromarray(np.clip(np.stack([rouge, vert, bleu], axis=-1), 0, 255).astype(np.uint8))
+
+
+def tranches_par_recadrage(img_hauteur_livre, nombre_tranches, largeur_pixels_cible):
+    """Étirement d'origine : chaque tranche est recadrée aux frontières entières puis agrandie seule en LANCZOS."""
+    largeur_par_tranche = img_hauteur_livre.width / nombre_tranches
+    for i in range(nombre_tranches):
+        left, right = int(i * largeur_par_tranche), min(int((i + 1) * largeur_par_tranche), img_hauteur_livre.width)
+        tranche = img_hauteur_livre.crop((left, 0, right, img_hauteur_livre.height))
+        yield np.asarray(tranche.resize((largeur_pixels_cible, img_hauteur_livre.height), Image.LANCZOS))
+
+
+# (largeur de l'image à la hauteur du livre, nombre de tranches, largeur cible) : 12 px source par tranche étirés
+# à 59 px (10 mm à 150 DPI), puis des frontières fractionnaires (11,1 px par tranche) étirées à 118 px (10 mm à 300 DPI)
+@pytest.mark.parametrize("largeur_image, nombre_tranches, largeur_pixels_cible", [(1200, 100, 59), (1000, 90, 118)])
+def test_etirement_en_un_passage_proche_de_l_etirement_par_tranche(largeur_image, nombre_tranches, largeur_pixels_cible):
+    img_hauteur_livre = creer_image_synthetique(largeur_image, 400)
+
+    flux = FluxTranches(img_hauteur_livre, nombre_tranches, largeur_pixels_cible, img_hauteur_livre.height)
+    tranches = list(flux.tranches_brutes())
+    references = list(tranches_par_recadrage(img_hauteur_livre, nombre_tranches, largeur_pixels_cible))
+
+    assert [numero for numero, _ in tranches] == list(range(1, nombre_tranches + 1))
+    ecarts = np.stack([np.abs(pixels.astype(np.int16) - reference.astype(np.int16))
+                       for (_, pixels), reference in zip(tranches, references)])
+    assert ecarts.shape == (nombre_tranches, img_hauteur_livre.height, largeur_pixels_cible, 3)
+    # Écarts en niveaux (0-255) : l'étirement d'origine arrondit les frontières au pixel entier (jusqu'à un pixel
+    # source de décalage), l'étirement en un passage les garde fractionnaires et répète des colonnes suréchantillonnées
+    assert ecarts.mean() < 1.0
+    assert ecarts.max() <= 8
+
+
+class SortieInterrompue(io.BytesIO):
+    """Flux de sortie dont le client se déconnecte après quelques écritures (comme PdfStream.write dans app.py)."""
+
+    def __init__(self, ecritures_avant_erreur):
+        super().__init__()
+        self.ecritures_restantes = ecritures_avant_erreur
+
+    def write(self, donnees):
+        if self.ecritures_restantes == 0:
+            raise OSError("Le téléchargement a été interrompu par le client.")
+        self.ecritures_restantes -= 1
+        return super().write(donnees)
+
+
+def assembler_livre(tmp_path, sortie):
+    """Petit livre (100 tranches, plusieurs pages A4) assemblé depuis une image synthétique dans le flux 'sortie'."""
+    chemin_image = str(tmp_path / 'source.png')
+    creer_image_synthetique(600, 450).save(chemin_image)
+    tranches, erreur = generer_tranches_en_flux(chemin_image, 60, 200, 100, 10, None)
+    assert erreur is None
+    return generer_pdf_a_partir_tranches(tranches, 60, 10, 1, 2, None, chemin_image, 200, sortie, profil_encodage='standard')
+
+
+def test_ecriture_incrementale_table_references_croisees(tmp_path):
+    """Le PDF écrit page par page (_EcriturePDFIncrementale, liée au format interne de ReportLab) reste cohérent."""
+    sortie = io.BytesIO()
+    _, erreur = assembler_livre(tmp_path, sortie)
+    assert erreur is None
+    pdf = sortie.getvalue()
+    assert pdf.startswith(b'%PDF-') and pdf.rstrip().endswith(b'%%EOF')
+
+    position_xref = int(re.findall(rb'startxref\s+(\d+)', pdf)[-1])
+    assert pdf[position_xref:].startswith(b'xref')
+    positions_objets = re.findall(rb'(\d{10}) 00000 n', pdf[position_xref:])
+    assert len(positions_objets) > 10 # Plusieurs pages, donc plusieurs vidages
+    for numero, position in enumerate(positions_objets, start=1):
+        assert pdf[int(position):].startswith(b'%d 0 obj' % numero)
+
+
+def test_ecriture_incrementale_client_deconnecte(tmp_path):
+    """Une écriture qui échoue en cours d'assemblage (client parti) donne une erreur retournée, pas une exception."""
+    sortie = SortieInterrompue(ecritures_avant_erreur=1)
+    chemin_pdf, erreur = assembler_livre(tmp_path, sortie)
+    assert chemin_pdf is None
+    assert "interrompu par le client" in erreur
+    assert sortie.getvalue().startswith(b'%PDF-') # Première page transmise avant la déconnexion
@@ -0,0 +1,43 @@
+"""
+Tests de core_logic.stockage.
+
+Lancement : python -m pytest tests
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core_logic.stockage import StockageArtefacts
+
+
+def ecrire_fichier(chemin, taille, age_secondes):
+    with open(chemin, 'wb') as f:
+        f.write(b'\0' * taille)
+    date = time.time() - age_secondes
+    os.utime(chemin, (date, date))
+
+
+def test_pdf_lie_en_dur_compte_une_seule_fois(tmp_path):
+    """Un PDF du cache lié en dur dans les PDF générés : compté une fois, libéré avec son dernier lien seulement."""
+    stockage = StockageArtefacts(str(tmp_path / 'verrous'), quota_octets=1500)
+    stockage.ajouter_categorie('render_cache', str(tmp_path / 'render_cache'), None)
+    stockage.ajouter_categorie('generated_pdfs', str(tmp_path / 'generated_pdfs'), None)
+
+    pdf_cache = tmp_path / 'render_cache' / 'cle.pdf'
+    ecrire_fichier(pdf_cache, 1000, age_secondes=300)
+    os.link(pdf_cache, tmp_path / 'generated_pdfs' / 'livre.pdf')
+    ecrire_fichier(tmp_path / 'render_cache' / 'autre.pdf', 400, age_secondes=100)
+
+    # 1400 octets sur disque (et non 2400) : sous le quota, rien n'est évincé
+    bilan = stockage.nettoyer()
+    assert bilan == {'expires': 0, 'evinces': 0, 'octets_liberes': 0, 'octets_utilises': 1400}
+
+    # Au-dessus du quota, supprimer l'un des deux liens ne libère rien : les deux sont évincés (du plus ancien au
+    # plus récent) avant que le quota ne soit respecté
+    stockage.quota_octets = 1000
+    bilan = stockage.nettoyer()
+    assert bilan == {'expires': 0, 'evinces': 2, 'octets_liberes': 1000, 'octets_utilises': 400}
+    assert sorted(os.listdir(tmp_path / 'render_cache')) == ['autre.pdf']
+    assert os.listdir(tmp_path / 'generated_pdfs') == []